@@ -0,0 +1,223 @@
+"""
+This module parses Authentication-Results headers (RFC 8601).
+
+A header is read in one linear pass by a small tokenizer instead of regexes:
+
+    mx.example.com; dkim=pass header.d=example.com header.s=s1;
+        spf=pass smtp.mailfrom=bounce@example.com;
+        dmarc=pass (p=REJECT sp=REJECT dis=NONE) header.from=example.com
+
+Each `;`-separated result becomes a `MethodResult` with its method, result,
+reason, comments, and `ptype.property` values. A message can carry several
+Authentication-Results headers and, when relayed through ARC-sealing hops,
+ARC-Authentication-Results headers as well; `parse_auth_results` folds all of
+them into the single `EmailAuthenticationModel` row stored per message.
+"""
+import re
+from typing import Optional, List, Dict, Tuple, Iterator, Sequence, Union, TypedDict
+
+from mailStructs import EmailAuthenticationModel
+
+# One token of a header: an atom, '=' with the value after it, ';' or '=', a comment
+# (nesting one level), or a quoted string. Whitespace is skipped by not matching it.
+# A value may itself contain '=' (base64 padding), unlike an atom. The loops are
+# unrolled so no two branches can match the same text, and an unterminated comment or
+# quoted string ends the token instead of failing, so matching never restarts on it.
+_TOKEN = re.compile(
+    r'(?P<atom>[^\s;=()"]+)'
+    r'|=[ \t]*(?P<value>[^\s;()"]+)'
+    r'|(?P<special>[;=])'
+    r'|(?P<comment>\([^()\\]*(?:(?:\\.|\([^()\\]*(?:\\.[^()\\]*)*\))[^()\\]*)*\)?)'
+    r'|(?P<quoted>"[^"\\]*(?:\\.[^"\\]*)*"?)',
+    re.DOTALL
+)
+
+# Matches a backslash escape inside a quoted string.
+_QUOTED_PAIR = re.compile(r'\\(.)', re.DOTALL)
+
+# Reads the published policy from a DMARC result comment, e.g. "(p=REJECT sp=NONE dis=NONE)".
+_DMARC_POLICY_COMMENT = re.compile(r'\bp=([A-Za-z]+)')
+
+# The ARC instance tag that starts an ARC-Authentication-Results header ("i=2; ...").
+_ARC_INSTANCE = re.compile(r'\s*i\s*=\s*(\d+)\s*;')
+
+# Token kinds produced by `tokenize_auth_results`.
+TOKEN_ATOM = "atom"
+TOKEN_QUOTED = "quoted"
+TOKEN_COMMENT = "comment"
+TOKEN_EQUALS = "="
+TOKEN_SEMICOLON = ";"
+
+
+class MethodResult(TypedDict):
+    """One `method=result` entry of an Authentication-Results header."""
+    method: str                  # e.g. 'spf', 'dkim', 'dmarc', lower-cased
+    result: str                  # e.g. 'pass', 'fail', 'none', lower-cased
+    reason: Optional[str]
+    comments: List[str]
+    properties: Dict[str, str]   # 'ptype.property' (lower-cased) -> value
+
+
+def tokenize_auth_results(header_value: str) -> Iterator[Tuple[str, str]]:
+    """
+    Splits an Authentication-Results header into tokens in one pass.
+
+    The token pattern's alternatives cannot overlap, so matching stays linear
+    in the header length. Comments may nest one level and quoted strings may
+    contain escapes. A value after '=' keeps any further '=' characters, so
+    base64 values such as `header.b=AbC+/9==` stay whole.
+
+    Args:
+        header_value (str): The unfolded header value.
+
+    Yields:
+        Tuple[str, str]: (token kind, text) pairs.
+    """
+    for match in _TOKEN.finditer(header_value):
+        kind = match.lastgroup
+        if kind == "atom":
+            yield TOKEN_ATOM, match.group(kind)
+        elif kind == "value":
+            yield TOKEN_EQUALS, "="
+            yield TOKEN_ATOM, match.group(kind)
+        elif kind == "special":
+            yield match.group(kind), match.group(kind)
+        elif kind == "comment":
+            yield TOKEN_COMMENT, match.group(kind)[1:].removesuffix(")").strip()
+        else:
+            yield TOKEN_QUOTED, _QUOTED_PAIR.sub(r"\1", match.group(kind)[1:].removesuffix('"'))
+
+
+def parse_auth_results_header(header_value: str) -> Tuple[Optional[str], List[MethodResult]]:
+    """
+    Parses one Authentication-Results header.
+
+    Args:
+        header_value (str): The unfolded header value, without an ARC instance tag.
+
+    Returns:
+        Tuple[Optional[str], List[MethodResult]]: The authserv-id and every method
+            result, in header order. 'none' (no checks were done) yields no results.
+    """
+    authserv_id = None
+    results: List[MethodResult] = []
+    current: Optional[MethodResult] = None
+    pending_key: Optional[str] = None   # 'method', 'reason', or a property name awaiting its value
+    previous_atom: Optional[str] = None
+    first_atom: Optional[str] = None    # The authserv-id, until the first ';' confirms it
+
+    for kind, text in tokenize_auth_results(header_value):
+        if kind == TOKEN_COMMENT:
+            if current is not None:
+                current["comments"].append(text)
+            continue
+        if kind == TOKEN_SEMICOLON:
+            if authserv_id is None:
+                authserv_id = first_atom or ""
+            current, pending_key, previous_atom = None, None, None
+            continue
+        if kind == TOKEN_EQUALS:
+            if previous_atom is None:
+                continue
+            name = previous_atom.lower()
+            if current is None and authserv_id is not None:
+                # "method[/version]=result" opens a new result.
+                pending_key = "method"
+                current = {"method": name.split("/", 1)[0], "result": "", "reason": None,
+                           "comments": [], "properties": {}}
+                results.append(current)
+            elif current is not None:
+                pending_key = name
+            previous_atom = None
+            continue
+
+        # An atom or a quoted string.
+        if pending_key is not None and current is not None:
+            if pending_key == "method":
+                current["result"] = text.lower()
+            elif pending_key == "reason":
+                current["reason"] = text
+            elif "." in pending_key:
+                current["properties"].setdefault(pending_key, text)
+            pending_key = None
+            previous_atom = None
+        else:
+            previous_atom = text if kind == TOKEN_ATOM else None
+            if authserv_id is None and first_atom is None:
+                first_atom = text
+
+    return authserv_id if authserv_id is not None else first_atom, results
+
+
+def _domain_of(value: Optional[str]) -> Optional[str]:
+    """Returns the domain of an address or identity ('user@example.com', '@example.com', 'example.com')."""
+    if not value:
+        return None
+    return value.rsplit("@", 1)[-1].strip("<>") or None
+
+
+def _preferred(results: List[MethodResult], method: str) -> Optional[MethodResult]:
+    """Returns the first passing result of a method, or its first result of any kind."""
+    candidates = [result for result in results if result["method"] == method]
+    return next((result for result in candidates if result["result"] == "pass"), candidates[0] if candidates else None)
+
+
+def parse_auth_results(header_values: Union[str, Sequence[str], None],
+                       arc_header_values: Sequence[str] = ()) -> Optional[EmailAuthenticationModel]:
+    """
+    Summarizes the SPF, DKIM, and DMARC results of a message.
+
+    Authentication-Results headers are trusted in header order (the topmost
+    was added by the final receiving server), then ARC-Authentication-Results
+    headers from the newest ARC instance to the oldest. Each method is taken
+    from the first header that reports it; when a header holds several results
+    for one method (e.g. two DKIM signatures), a passing one is preferred.
+
+    Args:
+        header_values (Union[str, Sequence[str], None]): The Authentication-Results
+            header value, or all of them in header order.
+        arc_header_values (Sequence[str]): The ARC-Authentication-Results header values.
+
+    Returns:
+        Optional[EmailAuthenticationModel]: The parsed results, or None if none were found.
+    """
+    if isinstance(header_values, str):
+        header_values = [header_values]
+
+    arc_headers = []
+    for value in arc_header_values:
+        match = _ARC_INSTANCE.match(value)
+        instance = int(match.group(1)) if match else 0
+        arc_headers.append((instance, value[match.end():] if match else value))
+    ordered_headers = list(header_values or []) + [value for _, value in sorted(arc_headers, key=lambda h: -h[0])]
+
+    auth_results: EmailAuthenticationModel = {}
+    for header_value in ordered_headers:
+        _, results = parse_auth_results_header(header_value)
+
+        spf = _preferred(results, "spf")
+        if spf and "spf_status" not in auth_results:
+            auth_results["spf_status"] = spf["result"]
+            properties = spf["properties"]
+            auth_results["spf_domain"] = _domain_of(properties.get("smtp.mailfrom") or properties.get("smtp.helo"))
+
+        dkim = _preferred(results, "dkim")
+        if dkim and "dkim_status" not in auth_results:
+            auth_results["dkim_status"] = dkim["result"]
+            properties = dkim["properties"]
+            auth_results["dkim_domain"] = properties.get("header.d") or _domain_of(properties.get("header.i"))
+            auth_results["dkim_selector"] = properties.get("header.s")
+
+        dmarc = _preferred(results, "dmarc")
+        if dmarc and "dmarc_status" not in auth_results:
+            auth_results["dmarc_status"] = dmarc["result"]
+            policy = dmarc["properties"].get("policy.dmarc")
+            if not policy:
+                match = next(filter(None, (_DMARC_POLICY_COMMENT.search(c) for c in dmarc["comments"])), None)
+                policy = match.group(1) if match else None
+            auth_results["dmarc_policy"] = policy.lower() if policy else None
+
+        if all(key in auth_results for key in ("spf_status", "dkim_status", "dmarc_status")):
+            break
+
+    return auth_results if auth_results else None
@@ -0,0 +1,79 @@
+"""
+Measures how many messages per second `mail_parser.parse_raw_message` handles.
+
+The corpus is generated with `fake_gmail.synthetic_raw_message`. With
+--newsletter-headers, every message also gets that many extra List-/X- headers,
+like a bulk mailing, since header handling dominates the parse cost of those.
+
+Usage:
+    python benchmarks/bench_parse.py --count 2000 --newsletter-headers 150
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_gmail import synthetic_raw_message  # noqa: E402
+from mail_parser import parse_raw_message  # noqa: E402
+
+
+def build_corpus(count: int, newsletter_headers: int, seed: int) -> list:
+    """
+    Builds the (raw bytes, message resource) pairs to parse.
+
+    Args:
+        count (int): The number of messages.
+        newsletter_headers (int): Extra headers prepended to every message.
+        seed (int): Seed for the random source.
+
+    Returns:
+        list: (raw bytes, message resource) tuples.
+    """
+    rng = random.Random(seed)
+    corpus = []
+    for index in range(count):
+        raw = synthetic_raw_message(index, rng)
+        if newsletter_headers:
+            extra = "".join(
+                f"X-Campaign-Field-{n}: segment={n % 7}; variant={index % 3}; tracking=abcdef{n:04d}\r\n"
+                if n % 2 else
+                f"List-Meta-{n}: <https://lists.example.org/{index}/{n}>\r\n"
+                for n in range(newsletter_headers)
+            )
+            raw = extra.encode("ascii") + raw
+        message = {"id": f"{index:016x}", "threadId": f"{index:016x}", "labelIds": ["INBOX"],
+                   "internalDate": "0", "snippet": ""}
+        corpus.append((raw, message))
+    return corpus
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=2000, help="Messages in the corpus.")
+    parser.add_argument("--newsletter-headers", type=int, default=0, help="Extra headers per message.")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed passes over the corpus.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the synthetic corpus.")
+    args = parser.parse_args()
+
+    corpus = build_corpus(args.count, args.newsletter_headers, args.seed)
+    # One untimed pass to warm up imports and caches.
+    for raw, message in corpus:
+        parse_raw_message(raw, message)
+
+    rates = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        for raw, message in corpus:
+            parse_raw_message(raw, message)
+        rates.append(len(corpus) / (time.perf_counter() - start))
+
+    print(f"{len(corpus)} messages, {args.newsletter_headers} extra headers each, {args.repeat} passes")
+    print(f"Parsed: {statistics.median(rates):,.0f} msg/s median (best {max(rates):,.0f} msg/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+Compares the SQLite PRAGMA profiles of `sqlite_db.PRAGMA_PROFILES`.
+
+The ingest phase writes the same synthetic corpus into a fresh database once
+per write profile with `SQLiteDB.insert_messages`, committing every
+--batch-size messages as a sync does. The query phase runs a few typical
+archive queries against one database under each profile.
+
+Bodies are padded to --body-kb, so the database size can be scaled up: 250,000
+messages at 16 KB make a database of about 4 GB. Pass --db to run only the
+query phase against an existing database instead. The OS page cache is not
+dropped between runs, so query times are for a warm cache unless the database
+is larger than memory.
+
+Usage:
+    python benchmarks/bench_sqlite.py --count 250000 --body-kb 16 --dir /var/tmp/bench
+    python benchmarks/bench_sqlite.py --db mail_database/mail_database.db
+"""
+import argparse
+import copy
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_gmail import synthetic_raw_message  # noqa: E402
+from mail_parser import parse_raw_message  # noqa: E402
+from sqlite_db import SQLiteDB, PRAGMA_PROFILES, READ_ONLY_PROFILES  # noqa: E402
+
+# Distinct parsed messages the corpus is cloned from; parsing every message would
+# take longer than the writes being measured.
+TEMPLATE_COUNT = 500
+
+# (name, SQL) pairs run in the query phase.
+QUERIES = [
+    ("labels", "SELECT label_name, COUNT(*) FROM email_labels GROUP BY label_name"),
+    ("top senders", "SELECT sender_email, COUNT(*) FROM emails GROUP BY sender_email ORDER BY 2 DESC LIMIT 20"),
+    ("body search", "SELECT COUNT(*) FROM emails WHERE body_text LIKE '%invoice%'"),
+    ("recent", "SELECT message_id, subject FROM emails ORDER BY internal_date_ms DESC LIMIT 100"),
+]
+
+
+def iter_corpus(count: int, body_kb: int, batch_size: int, seed: int):
+    """
+    Yields the synthetic corpus in batches of parsed messages.
+
+    Args:
+        count (int): The number of messages.
+        body_kb (int): The size each body_text is padded to, in kilobytes.
+        batch_size (int): The number of messages per batch.
+        seed (int): Seed for the random source.
+
+    Yields:
+        list: A batch of `ExtractedEmailData` with unique message IDs.
+    """
+    rng = random.Random(seed)
+    templates = []
+    for index in range(min(count, TEMPLATE_COUNT)):
+        message = {"id": f"{index:016x}", "threadId": f"{index:016x}", "labelIds": ["INBOX", "UNREAD"],
+                   "internalDate": str(index), "snippet": ""}
+        templates.append(parse_raw_message(synthetic_raw_message(index, rng), message))
+    padding = ("lorem ipsum dolor sit amet " * (body_kb * 40))[:body_kb * 1024]
+
+    batch = []
+    for index in range(count):
+        email_data = copy.copy(templates[index % len(templates)])
+        email_data["message_id"] = f"{index:016x}"
+        email_data["thread_id"] = f"{index // 3:016x}"
+        email_data["internal_date_ms"] = index
+        email_data["body_text"] = (email_data.get("body_text") or "") + padding
+        batch.append(email_data)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def bench_ingest(db_path: str, profile: str, args) -> float:
+    """Writes the corpus into a new database with a profile; returns messages per second."""
+    db = SQLiteDB(db_path, profile=profile)
+    db.open_db()
+    elapsed = 0.0
+    for batch in iter_corpus(args.count, args.body_kb, args.batch_size, args.seed):
+        start = time.perf_counter()
+        db.insert_messages(batch, batch_size=args.batch_size)
+        elapsed += time.perf_counter() - start
+    start = time.perf_counter()
+    db.close_db()  # Closing checkpoints the WAL, which is part of the cost.
+    elapsed += time.perf_counter() - start
+    return args.count / elapsed
+
+
+def bench_queries(db_path: str, profile: str, repeat: int) -> dict:
+    """Runs every query `repeat` times with a profile; returns the median seconds per query."""
+    db = SQLiteDB(db_path, profile=profile)
+    db.open_db()
+    timings = {}
+    for name, sql in QUERIES:
+        runs = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            db.query_db(sql)
+            runs.append(time.perf_counter() - start)
+        timings[name] = statistics.median(runs)
+    db.close_db()
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=20000, help="Messages in the corpus.")
+    parser.add_argument("--body-kb", type=int, default=4, help="Size each message body is padded to, in KB.")
+    parser.add_argument("--batch-size", type=int, default=500, help="Messages per transaction.")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs of each query.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the synthetic corpus.")
+    parser.add_argument("--dir", default=None, help="Directory for the databases (default: a temporary one).")
+    parser.add_argument("--db", default=None, help="Only run the query phase against this existing database.")
+    args = parser.parse_args()
+
+    query_db_path = args.db
+    if not query_db_path:
+        work_dir = args.dir or tempfile.mkdtemp(prefix="bench_sqlite_")
+        os.makedirs(work_dir, exist_ok=True)
+        print(f"{args.count} messages of about {args.body_kb} KB, {args.batch_size} per transaction, in {work_dir}")
+        for profile in PRAGMA_PROFILES:
+            if profile in READ_ONLY_PROFILES:
+                continue
+            db_path = os.path.join(work_dir, f"{profile}.db")
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(db_path + suffix):
+                    os.remove(db_path + suffix)
+            rate = bench_ingest(db_path, profile, args)
+            size_mb = os.path.getsize(db_path) / 1024 ** 2
+            print(f"  Ingest '{profile}': {rate:,.0f} msg/s ({size_mb:,.0f} MB)")
+            query_db_path = db_path
+
+    print(f"Queries against {query_db_path}, median of {args.repeat} runs:")
+    for profile in PRAGMA_PROFILES:
+        timings = bench_queries(query_db_path, profile, args.repeat)
+        print(f"  '{profile}': " + ", ".join(f"{name} {seconds * 1000:,.1f} ms" for name, seconds in timings.items()))
+
+
+if __name__ == "__main__":
+    main()
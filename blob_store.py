@@ -0,0 +1,121 @@
+"""
+This module provides a deduplicated, content-addressed store for attachment bodies.
+
+Each blob is saved once under the SHA-256 of its content, in a sharded
+directory tree (`ab/cd/abcd...`) that keeps directories small. The same PDF or
+newsletter image received thousands of times therefore takes the space of one
+copy, and `email_attachments` rows only reference it by hash and path.
+
+Writes are atomic and bounded by a concurrency limit so parse workers do not
+saturate the disk; blobs above a size limit are skipped.
+"""
+import hashlib
+import os
+import threading
+from typing import Optional, Tuple, Dict
+
+# Default limit on the size of a stored attachment.
+DEFAULT_MAX_BLOB_BYTES = 25 * 1024 ** 2
+
+# Default number of blobs written at the same time.
+DEFAULT_MAX_CONCURRENT_WRITES = 4
+
+
+class BlobStore:
+    """
+    Stores blobs in a sharded directory tree keyed by their SHA-256.
+    """
+    def __init__(self, root: str, max_blob_bytes: int = DEFAULT_MAX_BLOB_BYTES,
+                 max_concurrent_writes: int = DEFAULT_MAX_CONCURRENT_WRITES):
+        """
+        Initializes the store.
+
+        Args:
+            root (str): The directory holding the blobs.
+            max_blob_bytes (int): Larger blobs are not stored.
+            max_concurrent_writes (int): The number of blobs written at the same time.
+        """
+        self.root = root
+        self.max_blob_bytes = max_blob_bytes
+        self.max_concurrent_writes = max(1, max_concurrent_writes)
+        os.makedirs(root, exist_ok=True)
+        self._write_slots = threading.BoundedSemaphore(self.max_concurrent_writes)
+        self._stats_lock = threading.Lock()
+        self._stats = {"stored": 0, "deduplicated": 0, "skipped_too_large": 0, "bytes_written": 0}
+
+    @staticmethod
+    def relative_path(content_hash: str) -> str:
+        """Returns the path of a blob relative to the store root."""
+        return os.path.join(content_hash[:2], content_hash[2:4], content_hash)
+
+    def path_for(self, relative_path: str) -> str:
+        """Returns the absolute path of a blob from its stored relative path."""
+        return os.path.join(self.root, relative_path)
+
+    def _count(self, key: str, amount: int = 1):
+        with self._stats_lock:
+            self._stats[key] += amount
+
+    def put(self, data: bytes) -> Optional[Tuple[str, str]]:
+        """
+        Stores a blob unless an identical one is already stored.
+
+        Args:
+            data (bytes): The blob content.
+
+        Returns:
+            Optional[Tuple[str, str]]: The SHA-256 hex digest and the path relative
+                to the store root, or None if the blob exceeds the size limit.
+        """
+        if len(data) > self.max_blob_bytes:
+            self._count("skipped_too_large")
+            return None
+
+        content_hash = hashlib.sha256(data).hexdigest()
+        relative_path = self.relative_path(content_hash)
+        path = self.path_for(relative_path)
+        if os.path.exists(path):
+            self._count("deduplicated")
+            return content_hash, relative_path
+
+        with self._write_slots:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write under a unique name and rename, so readers never see a partial blob
+            # and concurrent writers of the same content cannot corrupt it.
+            temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        self._count("stored")
+        self._count("bytes_written", len(data))
+        return content_hash, relative_path
+
+    def get(self, relative_path: str) -> bytes:
+        """
+        Reads a stored blob.
+
+        Args:
+            relative_path (str): The path returned by `put`.
+
+        Returns:
+            bytes: The blob content.
+        """
+        with open(self.path_for(relative_path), "rb") as f:
+            return f.read()
+
+    def stats(self) -> Dict[str, int]:
+        """Returns how many blobs were stored, deduplicated, and skipped."""
+        with self._stats_lock:
+            return dict(self._stats)
+
+    def add_stats(self, stats: Dict[str, int]):
+        """Adds counters reported by another store over the same directory (e.g. in a worker process)."""
+        with self._stats_lock:
+            for key, amount in stats.items():
+                self._stats[key] += amount
+
+    def print_stats(self):
+        """Prints the blob statistics in a readable form."""
+        stats = self.stats()
+        print(f"Attachments: {stats['stored']} stored ({stats['bytes_written'] / 1024 ** 2:.1f} MB), "
+              f"{stats['deduplicated']} already stored, {stats['skipped_too_large']} over the size limit.")
@@ -0,0 +1,62 @@
+"""
+This module provides the compression used for stored raw email sources.
+
+Zstandard is used when the optional `zstandard` package is installed, since it
+compresses email text well at high speed; otherwise the standard library's
+zlib is used. Each compressed payload is stored together with the name of its
+codec, so data written with either codec can always be read back.
+"""
+import zlib
+from typing import Tuple
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# The codec used for newly compressed data.
+DEFAULT_CODEC = "zstd" if zstandard is not None else "zlib"
+
+# Compression levels that favour speed, as payloads are written during ingest.
+_ZSTD_LEVEL = 3
+_ZLIB_LEVEL = 6
+
+
+def compress(data: bytes, codec: str = DEFAULT_CODEC) -> Tuple[str, bytes]:
+    """
+    Compresses data with the given codec.
+
+    Args:
+        data (bytes): The data to compress.
+        codec (str): "zstd" or "zlib".
+
+    Returns:
+        Tuple[str, bytes]: The codec used and the compressed data.
+    """
+    if codec == "zstd":
+        if zstandard is None:
+            raise ValueError("The zstandard package is not installed.")
+        return codec, zstandard.ZstdCompressor(level=_ZSTD_LEVEL).compress(data)
+    if codec == "zlib":
+        return codec, zlib.compress(data, _ZLIB_LEVEL)
+    raise ValueError(f"Unknown compression codec: {codec}")
+
+
+def decompress(data: bytes, codec: str) -> bytes:
+    """
+    Decompresses data written by `compress`.
+
+    Args:
+        data (bytes): The compressed data.
+        codec (str): The codec returned by `compress`.
+
+    Returns:
+        bytes: The original data.
+    """
+    if codec == "zstd":
+        if zstandard is None:
+            raise ValueError("Data is zstd-compressed but the zstandard package is not installed.")
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == "zlib":
+        return zlib.decompress(data)
+    raise ValueError(f"Unknown compression codec: {codec}")
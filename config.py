@@ -26,6 +26,9 @@ CLIENT_SECRET_FILE = os.path.expanduser(_client_secret_path)
 # This file is created automatically upon the first successful authorization.
 API_TOKEN_FILE = 'token.json'
 
+# Access tokens are refreshed this many seconds before they expire.
+TOKEN_REFRESH_MARGIN_SECONDS = int(os.getenv('TOKEN_REFRESH_MARGIN_SECONDS', '300'))
+
 # Define the scopes required for the application's functionality.
 # These scopes grant permissions to read emails and manage labels.
 GMAIL_SCOPES = [
@@ -34,7 +37,43 @@ GMAIL_SCOPES = [
     'https://www.googleapis.com/auth/gmail.labels'    # For label creation/deletion
 ]
 
+# Gmail's per-user quota, in quota units per second (each method has a unit cost).
+# Keep the limiter slightly below the ceiling to leave room for other clients.
+GMAIL_QUOTA_UNITS_PER_SECOND = int(os.getenv('GMAIL_QUOTA_UNITS_PER_SECOND', '240'))
+
+# Messages that failed this many times are no longer retried by --retry-failed.
+MAX_FAILED_ATTEMPTS = int(os.getenv('MAX_FAILED_ATTEMPTS', '5'))
+
+# --- Raw Message Cache Configuration ---
+# Directory of the local cache of raw Gmail messages, used to reparse without
+# downloading again. The cache is only kept when this is set.
+RAW_CACHE_DIR = os.getenv('RAW_CACHE_DIR', '')
+# Cap on the compressed size of the cache, in megabytes.
+RAW_CACHE_MAX_MB = int(os.getenv('RAW_CACHE_MAX_MB', '2048'))
+
+# --- Attachment Blob Store Configuration ---
+# Directory where attachment bodies are stored, deduplicated by SHA-256.
+# Attachments are only saved when this is set.
+ATTACHMENTS_DIR = os.getenv('ATTACHMENTS_DIR', '')
+# Attachments larger than this many megabytes are not saved.
+MAX_ATTACHMENT_MB = int(os.getenv('MAX_ATTACHMENT_MB', '25'))
+
+# --- Raw Source Storage Configuration ---
+# Set KEEP_RAW_SOURCE=1 to store the compressed original source of every message
+# in the 'email_raw' table.
+KEEP_RAW_SOURCE = os.getenv('KEEP_RAW_SOURCE', '0') == '1'
+
 # --- SQLite Database Configuration ---
+# Number of messages written per SQLite transaction during ingest.
+WRITE_BATCH_SIZE = int(os.getenv('WRITE_BATCH_SIZE', '500'))
+# The PRAGMA profile used while syncing: 'default' (SQLite's settings) or 'ingest'
+# (WAL, synchronous=NORMAL, a large cache). See PRAGMA_PROFILES in sqlite_db.py.
+DB_PROFILE = os.getenv('DB_PROFILE', 'default')
+# Tokenizer of the full-text search index, used when the index is created:
+# 'trigram' matches any substring of three or more characters, like LIKE '%term%';
+# 'unicode61' matches whole words and makes a much smaller index.
+FTS_TOKENIZER = os.getenv('FTS_TOKENIZER', 'trigram')
+
 # The path for the SQLite database file.
 # Can be set via an environment variable to override the default.
 # set MAIL_DB_PATH as environment variable and disable line below
@@ -0,0 +1,128 @@
+"""
+This module keeps the OAuth 2.0 credentials for the Gmail API between runs.
+
+The token file holds a refreshable token, so after the first authorization
+every run starts from a local file read instead of a browser round trip, and
+scheduled runs can start unattended. The file is only readable by its owner
+and is replaced atomically, so a crash mid-write never leaves a truncated
+token behind. Access tokens are refreshed shortly before they expire.
+"""
+import datetime
+import json
+import os
+import tempfile
+from typing import Optional, List
+
+from google.auth.exceptions import RefreshError
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+from google_auth_oauthlib.flow import InstalledAppFlow
+
+from config import TOKEN_REFRESH_MARGIN_SECONDS
+
+
+class CredentialStore:
+    """
+    Loads, refreshes, and saves the OAuth credentials kept in a token file.
+    """
+    def __init__(self, token_file: str, scopes: List[str],
+                 refresh_margin: int = TOKEN_REFRESH_MARGIN_SECONDS):
+        """
+        Initializes the store.
+
+        Args:
+            token_file (str): The path to the token JSON file.
+            scopes (List[str]): The OAuth scopes the token must grant.
+            refresh_margin (int): How many seconds before expiry a token is refreshed.
+        """
+        self.token_file = token_file
+        self.scopes = scopes
+        self.refresh_margin = datetime.timedelta(seconds=refresh_margin)
+
+    def load(self) -> Optional[Credentials]:
+        """
+        Reads the stored credentials.
+
+        Returns:
+            Optional[Credentials]: The credentials, or None if there is no usable token file.
+        """
+        if not os.path.exists(self.token_file):
+            return None
+        try:
+            return Credentials.from_authorized_user_file(self.token_file, self.scopes)
+        except (ValueError, json.JSONDecodeError) as e:
+            print(f"Ignoring unreadable token file {self.token_file}: {e}")
+            return None
+
+    def save(self, creds: Credentials):
+        """
+        Writes the credentials atomically with owner-only permissions.
+
+        Args:
+            creds (Credentials): The credentials to store.
+        """
+        directory = os.path.dirname(os.path.abspath(self.token_file))
+        # mkstemp creates the file with mode 0600, so the token is never world-readable.
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".token-", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(creds.to_json())
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.token_file)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        os.chmod(self.token_file, 0o600)
+
+    def delete(self) -> bool:
+        """
+        Removes the token file.
+
+        Returns:
+            bool: True if a token file was removed.
+        """
+        if os.path.exists(self.token_file):
+            os.remove(self.token_file)
+            return True
+        return False
+
+    def needs_refresh(self, creds: Credentials) -> bool:
+        """Returns True if the access token is missing, expired, or about to expire."""
+        if not creds.token or not creds.expiry:
+            return True
+        # google-auth keeps expiry as a naive UTC datetime.
+        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        return creds.expiry - now < self.refresh_margin
+
+    def get_credentials(self, client_secrets_file: str) -> Credentials:
+        """
+        Returns valid credentials, authorizing interactively only when unavoidable.
+
+        Stored credentials are used as-is while their access token is fresh,
+        and refreshed (and saved) when it is close to expiry. The browser flow
+        only runs if there is no stored token or its refresh token was revoked.
+
+        Args:
+            client_secrets_file (str): The OAuth client secrets JSON file.
+
+        Returns:
+            Credentials: Valid credentials.
+        """
+        creds = self.load()
+        if creds and not self.needs_refresh(creds):
+            return creds
+
+        if creds and creds.refresh_token:
+            try:
+                creds.refresh(Request())
+                self.save(creds)
+                return creds
+            except RefreshError as e:
+                print(f"Stored token could not be refreshed ({e}); authorization is required.")
+
+        flow = InstalledAppFlow.from_client_secrets_file(client_secrets_file, self.scopes)
+        creds = flow.run_local_server(port=0)
+        self.save(creds)
+        return creds
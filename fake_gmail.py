@@ -0,0 +1,496 @@
+"""
+This module provides an offline stand-in for the Gmail API service object.
+
+`FakeGmailService` mimics the object returned by
+`googleapiclient.discovery.build("gmail", "v1", ...)` closely enough for
+`GmailAPI` to run unchanged, so ingest can be tested and load-tested without
+network access or production quota. It serves:
+
+- `users().labels().list()`
+- `users().getProfile()`
+- `users().messages().list()` with paging and simple `in:`/`label:` queries
+- `users().messages().get()` in raw, full, minimal, and metadata formats,
+  including `fields=` partial responses
+- `users().threads().get()` in full, minimal, and metadata formats
+- `users().history().list()` (always reports no changes)
+- `new_batch_http_request()` batches
+
+Messages come from a directory of recorded API resources (`<id>.json`, as
+saved by `record_messages`) or `.eml` files, or are generated synthetically.
+Per-request latency, random server errors, and 429 rate-limit responses can be
+injected to exercise retries and throughput under realistic conditions.
+"""
+import base64
+import email.utils
+import json
+import os
+import random
+import threading
+import time
+from email import message_from_bytes
+from email.message import EmailMessage, Message
+from typing import Optional, List, Dict, Any, Callable
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+from mail_parser import decode_header_value
+
+# System labels every fake mailbox has, in addition to any fixture labels.
+SYSTEM_LABELS = [
+    "INBOX", "SENT", "DRAFT", "SPAM", "TRASH", "STARRED", "IMPORTANT", "UNREAD",
+    "CATEGORY_PERSONAL", "CATEGORY_SOCIAL", "CATEGORY_PROMOTIONS",
+    "CATEGORY_UPDATES", "CATEGORY_FORUMS",
+]
+
+# Labels assigned to synthetic messages, with their relative frequency.
+_SYNTHETIC_LABEL_SETS = [
+    (["INBOX", "CATEGORY_PERSONAL"], 4),
+    (["INBOX", "CATEGORY_UPDATES"], 3),
+    (["CATEGORY_PROMOTIONS"], 3),
+    (["CATEGORY_SOCIAL"], 2),
+    (["CATEGORY_FORUMS", "Label_1"], 2),
+    (["SPAM"], 1),
+]
+
+
+def _b64url(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode("ascii")
+
+
+def _http_error(status: int, reason: str, message: str) -> HttpError:
+    """Builds an HttpError shaped like the ones googleapiclient raises."""
+    content = json.dumps({
+        "error": {"code": status, "message": message, "errors": [{"reason": reason, "message": message}]}
+    }).encode("utf-8")
+    return HttpError(httplib2.Response({"status": status}), content)
+
+
+def synthetic_raw_message(index: int, rng: random.Random) -> bytes:
+    """
+    Generates a plausible RFC 822 message.
+
+    Args:
+        index (int): The message number, used to vary its content.
+        rng (random.Random): The random source.
+
+    Returns:
+        bytes: The message source.
+    """
+    domain = rng.choice(["example.com", "news.example.org", "shop.example.net", "lists.example.edu"])
+    sent = time.time() - rng.randint(0, 5 * 365 * 86400)
+    message = EmailMessage()
+    message["Return-Path"] = f"<bounce-{index}@{domain}>"
+    for hop in range(rng.randint(2, 5)):
+        hop_time = email.utils.formatdate(sent + hop * rng.randint(1, 30))
+        message["Received"] = f"from relay{hop}.{domain} (relay{hop}.{domain} [192.0.2.{hop + 1}]) by mx{hop}.example.com with ESMTPS id {index:x}{hop}; {hop_time}"
+    message["Authentication-Results"] = (
+        f"mx.example.com; dkim=pass header.i=@{domain} header.s=s{index % 3} header.b=abc{index}; "
+        f"spf=pass (example.com: domain of bounce@{domain} designates 192.0.2.1 as permitted sender) smtp.mailfrom=bounce@{domain}; "
+        f"dmarc=pass (p=REJECT sp=REJECT dis=NONE) header.from={domain}"
+    )
+    message["From"] = f"Sender {index % 97} <sender{index % 97}@{domain}>"
+    message["To"] = "Archive Owner <owner@example.com>"
+    if index % 4 == 0:
+        message["Cc"] = f"friend{index % 13}@example.com, \"Team, Ops\" <ops@example.com>"
+    message["Subject"] = f"Synthetic message {index}: " + " ".join(rng.choice(["news", "update", "offer", "report", "hello"]) for _ in range(4))
+    message["Date"] = email.utils.formatdate(sent)
+    message["Message-ID"] = f"<synthetic-{index}@{domain}>"
+    for header in range(rng.randint(1, 6)):
+        message[f"X-Synthetic-{header}"] = f"value-{index}-{header}"
+
+    text = f"Hello,\n\nThis is synthetic message number {index}.\n" + "Lorem ipsum dolor sit amet. " * rng.randint(5, 60)
+    message.set_content(text)
+    message.add_alternative(f"<html><body><p>{text}</p></body></html>", subtype="html")
+    if index % 5 == 0:
+        message.add_attachment(rng.randbytes(rng.randint(1_000, 50_000)), maintype="application",
+                               subtype="pdf", filename=f"report-{index % 20}.pdf")
+    return message.as_bytes()
+
+
+class FakeGmailService:
+    """
+    A thread-safe, in-memory drop-in for the Gmail API service object.
+    """
+    def __init__(self, messages: Optional[List[Dict[str, Any]]] = None, labels: Optional[List[Dict[str, str]]] = None,
+                 latency: float = 0.0, latency_jitter: float = 0.0, error_rate: float = 0.0,
+                 rate_limit_rate: float = 0.0, seed: Optional[int] = None):
+        """
+        Initializes the fake service.
+
+        Args:
+            messages (Optional[List[Dict]]): Message resources in 'raw' format
+                (id, threadId, labelIds, internalDate, snippet, raw).
+            labels (Optional[List[Dict]]): Label resources (id, name, type). System
+                labels and any label IDs used by the messages are added automatically.
+            latency (float): Seconds added to every HTTP round trip (a batch is one round trip).
+            latency_jitter (float): Maximum extra random seconds added to each round trip.
+            error_rate (float): Probability that a request fails with a 503 error.
+            rate_limit_rate (float): Probability that a request fails with a 429 error.
+            seed (Optional[int]): Seed for the random source, for repeatable runs.
+        """
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.request_count = 0
+
+        self._messages: Dict[str, Dict[str, Any]] = {}
+        self._parsed: Dict[str, Message] = {}
+        for message in messages or []:
+            self._messages[message["id"]] = message
+        # Newest messages first, as Gmail lists them.
+        self._order = sorted(self._messages, key=lambda m: int(self._messages[m].get("internalDate", 0)), reverse=True)
+
+        known = {label["id"]: label for label in labels or []}
+        for label_id in SYSTEM_LABELS:
+            known.setdefault(label_id, {"id": label_id, "name": label_id, "type": "system"})
+        for message in self._messages.values():
+            for label_id in message.get("labelIds", []):
+                known.setdefault(label_id, {"id": label_id, "name": label_id, "type": "user"})
+        self._labels = list(known.values())
+        self._history_id = str(max((int(m.get("historyId", 0)) for m in self._messages.values()), default=1))
+
+    # --- Construction ---
+
+    @classmethod
+    def from_directory(cls, directory: str, **kwargs) -> "FakeGmailService":
+        """
+        Loads messages from a directory of fixtures.
+
+        `<id>.json` files hold recorded 'raw' message resources; `<id>.eml` files
+        hold plain message sources and are given the INBOX label. An optional
+        `labels.json` holds the label resources.
+
+        Args:
+            directory (str): The fixture directory.
+            **kwargs: Passed to the constructor (latency, error rates, seed).
+        """
+        messages = []
+        labels = None
+        for filename in sorted(os.listdir(directory)):
+            path = os.path.join(directory, filename)
+            if filename == "labels.json":
+                with open(path, "r", encoding="utf-8") as f:
+                    labels = json.load(f)
+            elif filename.endswith(".json"):
+                with open(path, "r", encoding="utf-8") as f:
+                    messages.append(json.load(f))
+            elif filename.endswith(".eml"):
+                with open(path, "rb") as f:
+                    raw = f.read()
+                message_id = filename[:-len(".eml")]
+                messages.append({
+                    "id": message_id,
+                    "threadId": message_id,
+                    "labelIds": ["INBOX"],
+                    "internalDate": str(int(os.path.getmtime(path) * 1000)),
+                    "raw": _b64url(raw),
+                })
+        return cls(messages=messages, labels=labels, **kwargs)
+
+    @classmethod
+    def synthetic(cls, count: int, seed: int = 0, **kwargs) -> "FakeGmailService":
+        """
+        Generates a mailbox of synthetic messages.
+
+        Args:
+            count (int): The number of messages to generate.
+            seed (int): Seed for the generated content and the injected faults.
+            **kwargs: Passed to the constructor (latency, error rates).
+        """
+        rng = random.Random(seed)
+        label_sets = [labels for labels, weight in _SYNTHETIC_LABEL_SETS for _ in range(weight)]
+        messages = []
+        for index in range(count):
+            raw = synthetic_raw_message(index, rng)
+            messages.append({
+                "id": f"{index:016x}",
+                # Group roughly every third message into a shared thread.
+                "threadId": f"{index - index % 3:016x}",
+                "labelIds": list(rng.choice(label_sets)),
+                "internalDate": str(1_600_000_000_000 + index * 60_000),
+                "historyId": str(1000 + index),
+                "raw": _b64url(raw),
+            })
+        labels = [{"id": "Label_1", "name": "Newsletters", "type": "user"}]
+        return cls(messages=messages, labels=labels, seed=seed, **kwargs)
+
+    def save_fixtures(self, directory: str):
+        """
+        Writes the mailbox to a fixture directory readable by `from_directory`.
+
+        Args:
+            directory (str): The directory to write to; created if missing.
+        """
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, "labels.json"), "w", encoding="utf-8") as f:
+            json.dump(self._labels, f, indent=2)
+        for message_id, message in self._messages.items():
+            with open(os.path.join(directory, f"{message_id}.json"), "w", encoding="utf-8") as f:
+                json.dump(message, f)
+
+    # --- Fault and latency injection ---
+
+    def _round_trip(self):
+        """Simulates the latency of one HTTP round trip."""
+        with self._lock:
+            self.request_count += 1
+            delay = self.latency + (self._rng.uniform(0, self.latency_jitter) if self.latency_jitter else 0.0)
+        if delay:
+            time.sleep(delay)
+
+    def _maybe_fail(self):
+        """Raises an injected error with the configured probabilities."""
+        with self._lock:
+            roll = self._rng.random()
+        if roll < self.rate_limit_rate:
+            raise _http_error(429, "rateLimitExceeded", "Too many requests (injected).")
+        if roll < self.rate_limit_rate + self.error_rate:
+            raise _http_error(503, "backendError", "Backend error (injected).")
+
+    # --- Service object interface ---
+
+    def users(self) -> "_Users":
+        return _Users(self)
+
+    def new_batch_http_request(self, callback: Optional[Callable] = None) -> "_FakeBatch":
+        return _FakeBatch(self, callback)
+
+    # --- Resource implementations ---
+
+    def _get_parsed(self, message_id: str) -> Message:
+        with self._lock:
+            parsed = self._parsed.get(message_id)
+        if parsed is None:
+            parsed = message_from_bytes(base64.urlsafe_b64decode(self._messages[message_id]["raw"]))
+            with self._lock:
+                self._parsed[message_id] = parsed
+        return parsed
+
+    def _snippet(self, message_id: str) -> str:
+        message = self._messages[message_id]
+        if "snippet" in message:
+            return message["snippet"]
+        for part in self._get_parsed(message_id).walk():
+            if part.get_content_type() == "text/plain" and not part.get_filename():
+                text = (part.get_payload(decode=True) or b"").decode("utf-8", errors="replace")
+                return " ".join(text.split())[:200]
+        return ""
+
+    def _payload(self, part: Message, part_id: str, include_bodies: bool) -> Dict[str, Any]:
+        """Converts a parsed MIME part into the Gmail 'payload' structure."""
+        payload = {
+            "partId": part_id,
+            "mimeType": part.get_content_type(),
+            "filename": decode_header_value(part.get_filename()) if part.get_filename() else "",
+            "headers": [{"name": name, "value": decode_header_value(value)} for name, value in part.items()],
+        }
+        if part.is_multipart():
+            payload["body"] = {"size": 0}
+            if include_bodies:
+                payload["parts"] = [
+                    self._payload(child, f"{part_id}.{index}" if part_id else str(index), include_bodies)
+                    for index, child in enumerate(part.get_payload())
+                ]
+            return payload
+
+        data = part.get_payload(decode=True) or b""
+        if not include_bodies:
+            payload["body"] = {"size": len(data)}
+        elif payload["filename"]:
+            payload["body"] = {"attachmentId": f"attachment-{part_id or '0'}", "size": len(data)}
+        else:
+            payload["body"] = {"size": len(data), "data": _b64url(data)}
+        return payload
+
+    def get_message(self, message_id: str, format: str = "full", metadata_headers: Optional[List[str]] = None,
+                    fields: Optional[str] = None) -> Dict[str, Any]:
+        """Builds the response of users.messages.get."""
+        if message_id not in self._messages:
+            raise _http_error(404, "notFound", "Requested entity was not found.")
+        stored = self._messages[message_id]
+        response = {
+            "id": message_id,
+            "threadId": stored.get("threadId", message_id),
+            "labelIds": list(stored.get("labelIds", [])),
+            "snippet": self._snippet(message_id),
+            "sizeEstimate": len(stored["raw"]) * 3 // 4,
+            "historyId": stored.get("historyId", self._history_id),
+            "internalDate": stored.get("internalDate", "0"),
+        }
+        if format == "raw":
+            response["raw"] = stored["raw"]
+        elif format in ("full", "metadata"):
+            payload = self._payload(self._get_parsed(message_id), "", include_bodies=(format == "full"))
+            if format == "metadata" and metadata_headers:
+                wanted = {name.lower() for name in metadata_headers}
+                payload["headers"] = [h for h in payload["headers"] if h["name"].lower() in wanted]
+            response["payload"] = payload
+
+        if fields:
+            # Only top-level partial responses are supported (e.g., "id,labelIds").
+            wanted_fields = {field.strip() for field in fields.split(",")}
+            response = {key: value for key, value in response.items() if key in wanted_fields}
+        return response
+
+    def get_thread(self, thread_id: str, format: str = "full", metadata_headers: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Builds the response of users.threads.get."""
+        message_ids = sorted(
+            (message_id for message_id, message in self._messages.items() if message.get("threadId", message_id) == thread_id),
+            key=lambda m: int(self._messages[m].get("internalDate", 0))
+        )
+        if not message_ids:
+            raise _http_error(404, "notFound", "Requested entity was not found.")
+        messages = [self.get_message(message_id, format, metadata_headers) for message_id in message_ids]
+        return {"id": thread_id, "historyId": max(m["historyId"] for m in messages), "messages": messages}
+
+    def list_messages(self, q: Optional[str] = None, labelIds: Optional[List[str]] = None,
+                      maxResults: int = 100, pageToken: Optional[str] = None) -> Dict[str, Any]:
+        """Builds the response of users.messages.list."""
+        wanted = set(labelIds or [])
+        for term in (q or "").split():
+            if term.startswith(("in:", "label:")):
+                name = term.split(":", 1)[1]
+                wanted.add(next((l["id"] for l in self._labels if l["name"] == name), name))
+
+        matching = [
+            message_id for message_id in self._order
+            if wanted.issubset(self._messages[message_id].get("labelIds", []))
+        ]
+        start = int(pageToken or 0)
+        page_size = max(1, min(maxResults or 100, 500))
+        page = matching[start:start + page_size]
+        response: Dict[str, Any] = {"resultSizeEstimate": len(matching)}
+        if page:
+            response["messages"] = [
+                {"id": message_id, "threadId": self._messages[message_id].get("threadId", message_id)}
+                for message_id in page
+            ]
+        if start + page_size < len(matching):
+            response["nextPageToken"] = str(start + page_size)
+        return response
+
+
+class _FakeRequest:
+    """An unexecuted request; `execute()` applies the injected latency and faults."""
+    def __init__(self, service: FakeGmailService, handler: Callable[[], Any]):
+        self._service = service
+        self._handler = handler
+
+    def execute(self):
+        self._service._round_trip()
+        self._service._maybe_fail()
+        return self._handler()
+
+
+class _FakeBatch:
+    """A batch of requests sent in one simulated round trip."""
+    def __init__(self, service: FakeGmailService, callback: Optional[Callable]):
+        self._service = service
+        self._callback = callback
+        self._requests = []
+
+    def add(self, request: _FakeRequest, callback: Optional[Callable] = None, request_id: Optional[str] = None):
+        if len(self._requests) >= 1000:
+            raise ValueError("Exceeded the maximum number of calls in a batch.")
+        self._requests.append((request_id or str(len(self._requests) + 1), request, callback or self._callback))
+
+    def execute(self):
+        self._service._round_trip()
+        for request_id, request, callback in self._requests:
+            response, exception = None, None
+            try:
+                # Faults are injected per sub-request, as Gmail reports them.
+                self._service._maybe_fail()
+                response = request._handler()
+            except HttpError as error:
+                exception = error
+            if callback:
+                callback(request_id, response, exception)
+
+
+class _Users:
+    def __init__(self, service: FakeGmailService):
+        self._service = service
+
+    def labels(self) -> "_Labels":
+        return _Labels(self._service)
+
+    def messages(self) -> "_Messages":
+        return _Messages(self._service)
+
+    def threads(self) -> "_Threads":
+        return _Threads(self._service)
+
+    def history(self) -> "_History":
+        return _History(self._service)
+
+    def getProfile(self, userId: str = "me") -> _FakeRequest:
+        service = self._service
+        return _FakeRequest(service, lambda: {
+            "emailAddress": "owner@example.com",
+            "messagesTotal": len(service._messages),
+            "threadsTotal": len({m.get("threadId") for m in service._messages.values()}),
+            "historyId": service._history_id,
+        })
+
+
+class _Labels:
+    def __init__(self, service: FakeGmailService):
+        self._service = service
+
+    def list(self, userId: str = "me") -> _FakeRequest:
+        return _FakeRequest(self._service, lambda: {"labels": [dict(label) for label in self._service._labels]})
+
+
+class _Messages:
+    def __init__(self, service: FakeGmailService):
+        self._service = service
+
+    def list(self, userId: str = "me", q: Optional[str] = None, labelIds: Optional[List[str]] = None,
+             maxResults: int = 100, pageToken: Optional[str] = None, **kwargs) -> _FakeRequest:
+        return _FakeRequest(self._service, lambda: self._service.list_messages(q, labelIds, maxResults, pageToken))
+
+    def get(self, userId: str = "me", id: str = "", format: str = "full",
+            metadataHeaders: Optional[List[str]] = None, fields: Optional[str] = None) -> _FakeRequest:
+        return _FakeRequest(self._service, lambda: self._service.get_message(id, format, metadataHeaders, fields))
+
+
+class _Threads:
+    def __init__(self, service: FakeGmailService):
+        self._service = service
+
+    def get(self, userId: str = "me", id: str = "", format: str = "full",
+            metadataHeaders: Optional[List[str]] = None) -> _FakeRequest:
+        return _FakeRequest(self._service, lambda: self._service.get_thread(id, format, metadataHeaders))
+
+
+class _History:
+    def __init__(self, service: FakeGmailService):
+        self._service = service
+
+    def list(self, userId: str = "me", startHistoryId: Optional[str] = None, **kwargs) -> _FakeRequest:
+        # The fake mailbox never changes, so there is never any history to report.
+        return _FakeRequest(self._service, lambda: {"historyId": self._service._history_id})
+
+
+def record_messages(gmail, message_ids: List[str], directory: str):
+    """
+    Saves real 'raw' message resources as fixtures for `FakeGmailService.from_directory`.
+
+    Args:
+        gmail (GmailAPI): A connected client.
+        message_ids (List[str]): The messages to record.
+        directory (str): The fixture directory; created if missing.
+    """
+    os.makedirs(directory, exist_ok=True)
+    raw_messages, errors = gmail.get_raw_messages_by_ids(message_ids)
+    for message_id, message in raw_messages.items():
+        with open(os.path.join(directory, f"{message_id}.json"), "w", encoding="utf-8") as f:
+            json.dump(message, f)
+    for message_id, error in errors.items():
+        print(f"Failed to record message {message_id}: {error}")
+    print(f"Recorded {len(raw_messages)} messages to {directory}.")
@@ -6,82 +6,142 @@ operations such as listing labels, fetching emails, and parsing message data.
 The `GmailAPI` class encapsulates the logic for handling OAuth 2.0 flow,
 building the API service, and extracting structured data from raw email messages.
 """
-import os.path
 import base64
-import re
-import datetime
 from email.mime.text import MIMEText
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Tuple, Callable, Any, Iterator
 import json
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
 from mailStructs import (
-    ExtractedEmailData, RecipientTuple, EmailAttachmentModel,
-    EmailXHeaderModel, EmailLabelModel, EmailAuthenticationModel, AdditionalPart
+    ExtractedEmailData, EmailAttachmentModel, EmailXHeaderModel,
+    EmailLabelModel, AdditionalPart, BatchFetchResult, HistoryChanges
 )
+from mail_parser import (
+    HeaderIndex, parse_recipients, parse_auth_results, parse_sent_timestamp, parse_sender,
+    parse_raw_api_message, compress_raw_source, summarize_raw_source, parse_received_chain
+)
+from credential_store import CredentialStore
+from raw_cache import RawMessageCache
+from rate_limiter import QuotaRateLimiter, QUOTA_COSTS, is_retryable_error, shared_rate_limiter
 from config import GMAIL_SCOPES, API_TOKEN_FILE, CLIENT_SECRET_FILE
 
+# The Gmail batch endpoint accepts at most 100 sub-requests per HTTP call.
+MAX_BATCH_REQUESTS = 100
+
+
+class ErrorDescription(str):
+    """
+    The description of a failed request, remembering the class of its exception.
+
+    Batch calls report errors as strings keyed by request ID; `error_class`
+    lets callers record what kind of error it was without parsing the text.
+    """
+    error_class: str = "Exception"
+
+    @classmethod
+    def from_exception(cls, error: BaseException) -> "ErrorDescription":
+        description = cls(str(error))
+        description.error_class = type(error).__name__
+        return description
+
 
 class GmailAPI:
     """
     A wrapper class for the Gmail API to simplify authentication and data fetching.
     """
-    def __init__(self, credentials_file=CLIENT_SECRET_FILE, token_file=API_TOKEN_FILE):
+    def __init__(self, credentials_file=CLIENT_SECRET_FILE, token_file=API_TOKEN_FILE,
+                 rate_limiter: Optional[QuotaRateLimiter] = None, service: Any = None,
+                 raw_cache: Optional[RawMessageCache] = None):
         """
         Initializes the GmailAPI client.
 
         Args:
             credentials_file (str): The path to the credentials JSON file.
             token_file (str): The path to the token JSON file.
+            rate_limiter (Optional[QuotaRateLimiter]): The quota limiter for all API
+                calls. Defaults to one limiter shared by every client in the process.
+            service (Any): A ready-made service object (e.g., `fake_gmail.FakeGmailService`)
+                to use instead of authenticating and building one. It must be
+                thread-safe, as it is shared with spawned clients.
+            raw_cache (Optional[RawMessageCache]): A local cache of raw messages to
+                consult before fetching and to fill with what is fetched.
         """
         self.credentials_file = credentials_file
         self.token_file = token_file
         self.creds = None
         self.service = None
+        self.rate_limiter = rate_limiter or shared_rate_limiter
+        self.injected_service = service
+        self.raw_cache = raw_cache
+        self.credential_store = CredentialStore(token_file, GMAIL_SCOPES)
 
     def connect(self):
         """
         Establishes a connection to the Gmail API.
 
-        Handles the OAuth 2.0 authorization flow, including refreshing
-        expired tokens and saving new ones.
+        Stored credentials are reused and refreshed ahead of expiry; the OAuth 2.0
+        authorization flow only runs when no usable token exists. An injected
+        service is used as-is.
         """
-        # Load existing credentials if a token file exists.
-        if os.path.exists(self.token_file):
-            self.creds = Credentials.from_authorized_user_file(self.token_file, GMAIL_SCOPES)
-        
-        # If credentials are not valid (or don't exist), initiate the auth flow.
-        if not self.creds or not self.creds.valid:
-            if self.creds and self.creds.expired and self.creds.refresh_token:
-                # If credentials have expired, refresh them.
-                self.creds.refresh(Request())
-            else:
-                # Otherwise, start a new authorization flow.
-                flow = InstalledAppFlow.from_client_secrets_file(
-                    self.credentials_file, GMAIL_SCOPES
-                )
-                self.creds = flow.run_local_server(port=0)
-            
-            # Save the new or refreshed credentials to the token file.
-            with open(self.token_file, "w") as token:
-                token.write(self.creds.to_json())
+        if self.injected_service is not None:
+            self.service = self.injected_service
+            return
+
+        # Reuse the stored token; the browser flow only runs on first use or after a logout.
+        self.creds = self.credential_store.get_credentials(self.credentials_file)
 
         # Build the Gmail API service object.
         self.service = build("gmail", "v1", credentials=self.creds)
 
+    def spawn(self) -> "GmailAPI":
+        """
+        Creates a connected copy of this client with its own service object.
+
+        The underlying HTTP transport is not thread-safe, so each worker thread
+        needs its own service; the credentials and the quota limiter are shared.
+
+        Returns:
+            GmailAPI: A new client that reuses this client's credentials.
+        """
+        clone = GmailAPI(self.credentials_file, self.token_file, rate_limiter=self.rate_limiter,
+                         service=self.injected_service, raw_cache=self.raw_cache)
+        clone.creds = self.creds
+        if self.injected_service is not None:
+            clone.service = self.injected_service
+        else:
+            clone.service = build("gmail", "v1", credentials=self.creds)
+        return clone
+
     def disconnect(self):
         """
-        Disconnects from the Gmail API and removes the token file.
+        Disconnects from the Gmail API, keeping the stored token for the next run.
         """
         self.creds = None
         self.service = None
-        # For security, remove the token file upon disconnection.
-        if os.path.exists(self.token_file):
-            os.remove(self.token_file)
+
+    def logout(self) -> bool:
+        """
+        Disconnects and removes the stored token, so the next run must authorize again.
+
+        Returns:
+            bool: True if a stored token was removed.
+        """
+        self.disconnect()
+        return self.credential_store.delete()
+
+    def _execute(self, request, method: str):
+        """
+        Sends an API request within the quota budget, retrying transient errors.
+
+        Args:
+            request: The unexecuted API request.
+            method (str): The API method name, used to look up its quota cost.
+
+        Returns:
+            The response of the request.
+        """
+        return self.rate_limiter.execute(request.execute, QUOTA_COSTS[method])
 
     def list_tags(self) -> Optional[List[str]]:
         """
@@ -96,7 +156,7 @@ class GmailAPI:
 
         try:
             # Execute the API call to list labels.
-            results = self.service.users().labels().list(userId="me").execute()
+            results = self._execute(self.service.users().labels().list(userId="me"), "labels.list")
             labels = results.get("labels", [])
             
             if not labels:
@@ -113,6 +173,124 @@ class GmailAPI:
             print(f"An error occurred: {error}")
             return None
 
+    def get_label_map(self) -> Dict[str, str]:
+        """
+        Maps each label ID in the user's account to its display name.
+
+        Messages carry label IDs (e.g., 'Label_12'), while queries and the CLI
+        use label names; system labels use the same value for both.
+
+        Returns:
+            Dict[str, str]: Label names keyed by label ID, or an empty dict if an error occurs.
+        """
+        if not self.service:
+            print("Not connected. Call connect() first.")
+            return {}
+
+        try:
+            results = self._execute(self.service.users().labels().list(userId="me"), "labels.list")
+            return {label["id"]: label["name"] for label in results.get("labels", [])}
+        except HttpError as error:
+            print(f"An error occurred while fetching labels: {error}")
+            return {}
+
+    def get_profile(self) -> Optional[dict]:
+        """
+        Fetches the user's mailbox profile, including its current historyId.
+
+        Returns:
+            Optional[dict]: The profile resource, or None if an error occurs.
+        """
+        if not self.service:
+            print("Not connected. Call connect() first.")
+            return None
+
+        try:
+            return self._execute(self.service.users().getProfile(userId="me"), "getProfile")
+        except HttpError as error:
+            print(f"An error occurred while fetching the profile: {error}")
+            return None
+
+    def get_history_changes(self, start_history_id: str) -> Optional[HistoryChanges]:
+        """
+        Collects the mailbox changes made since a stored historyId.
+
+        Changes are folded per message: a message's label IDs are taken from its
+        latest change, and messages added then deleted within the window are
+        reported only as deleted.
+
+        Args:
+            start_history_id (str): The historyId recorded after the last successful sync.
+
+        Returns:
+            Optional[HistoryChanges]: The folded changes, or None if the historyId
+                                      has expired (or another error occurs) and a
+                                      full scan is needed.
+        """
+        if not self.service:
+            print("Not connected. Call connect() first.")
+            return None
+
+        added: Dict[str, List[str]] = {}
+        deleted: Dict[str, None] = {}
+        label_updates: Dict[str, List[str]] = {}
+        latest_history_id = start_history_id
+        page_token = None
+
+        try:
+            while True:
+                results = self._execute(
+                    self.service
+                    .users()
+                    .history()
+                    .list(
+                        userId="me",
+                        startHistoryId=start_history_id,
+                        historyTypes=["messageAdded", "messageDeleted", "labelAdded", "labelRemoved"],
+                        pageToken=page_token,
+                    ),
+                    "history.list"
+                )
+
+                # History records are returned in chronological order.
+                for record in results.get("history", []):
+                    for change in record.get("messagesAdded", []):
+                        message = change["message"]
+                        added[message["id"]] = message.get("labelIds", [])
+                        deleted.pop(message["id"], None)
+                    for change in record.get("messagesDeleted", []):
+                        message_id = change["message"]["id"]
+                        deleted[message_id] = None
+                        added.pop(message_id, None)
+                        label_updates.pop(message_id, None)
+                    for change in record.get("labelsAdded", []) + record.get("labelsRemoved", []):
+                        message = change["message"]
+                        if message["id"] in deleted:
+                            continue
+                        if message["id"] in added:
+                            added[message["id"]] = message.get("labelIds", [])
+                        else:
+                            label_updates[message["id"]] = message.get("labelIds", [])
+
+                latest_history_id = results.get("historyId", latest_history_id)
+                page_token = results.get("nextPageToken")
+                if not page_token:
+                    break
+
+        except HttpError as error:
+            if error.resp is not None and error.resp.status == 404:
+                print(f"History ID {start_history_id} has expired.")
+            else:
+                print(f"An error occurred while fetching history: {error}")
+            return None
+
+        return {
+            "history_id": str(latest_history_id),
+            "added": added,
+            "deleted": list(deleted),
+            "label_updates": label_updates,
+        }
+
     def get_email_by_message_id(self, message_id) -> Optional[ExtractedEmailData]:
         """
         Fetches and parses a single email by its message ID.
@@ -128,88 +306,294 @@ class GmailAPI:
             print("Not connected. Call connect() first.")
             return None
 
+        message = self.raw_cache.get(message_id) if self.raw_cache else None
+        if message is not None:
+            # Sources never change, but labels may have since the message was cached.
+            label_ids, label_errors = self.get_label_ids_by_message_ids([message_id])
+            if message_id in label_ids:
+                message["labelIds"] = label_ids[message_id]
+                self.raw_cache.update_labels(label_ids)
+                return self.extract_email_data_from_raw(message)
+            print(f"An error occurred while fetching labels: {label_errors.get(message_id)}")
+            return None
+
         try:
-            # Fetch the raw email source for complete parsing.
-            message = (
-                self.service
-                .users()
-                .messages()
-                .get(userId="me", id=message_id, format="raw")
-                .execute()
-            )
-            
-            # Fetch the full message metadata for additional details.
-            metadata_message = (
+            # Fetch the raw email source; it holds everything needed for parsing.
+            message = self._execute(
                 self.service
                 .users()
                 .messages()
-                .get(userId="me", id=message_id, format="full")
-                .execute()
+                .get(userId="me", id=message_id, format="raw"),
+                "messages.get"
             )
+            if self.raw_cache:
+                self.raw_cache.put(message)
 
             # Extract structured data from the fetched message.
-            extracted_data = self.extract_email_data(metadata_message, message.get("raw"))
+            extracted_data = self.extract_email_data_from_raw(message)
             return extracted_data
 
         except HttpError as error:
             print(f"An error occurred: {error}")
             return None
 
-    def extract_email_data(self, message: dict, raw_source: str) -> ExtractedEmailData:
+    def get_emails_by_message_ids(self, message_ids: List[str], batch_size: int = MAX_BATCH_REQUESTS) -> BatchFetchResult:
         """
-        Parses the raw message dictionary from the Gmail API into a structured format.
+        Fetches and parses many emails using the Gmail batch HTTP endpoint.
+
+        Each message is requested once in 'raw' format, so up to 100 messages
+        are fetched per round trip. Sub-requests that fail with a transient
+        error are resent on their own; the rest of the batch is not fetched again.
 
         Args:
-            message (dict): The message resource from the API (format='full').
-            raw_source (str): The raw, base64-encoded email source (format='raw').
+            message_ids (List[str]): The message IDs to fetch.
+            batch_size (int): The number of messages to request per round trip.
 
         Returns:
-            ExtractedEmailData: A dictionary containing structured email data.
+            BatchFetchResult: The parsed emails, and an error description for
+                              each message ID that could not be fetched or parsed.
         """
-        payload = message.get("payload", {})
-        headers = payload.get("headers", [])
-        
-        def get_header(name):
-            # Helper to find a header value by its name (case-insensitive).
-            return next((h["value"] for h in headers if h["name"].lower() == name.lower()), None)
+        result: BatchFetchResult = {"emails": [], "errors": {}}
+        raw_messages, errors = self.get_raw_messages_by_ids(message_ids, batch_size=batch_size)
+        result["errors"].update(errors)
 
-        def parse_recipients(header_value: str) -> list[RecipientTuple]:
-            # Parses recipient strings (e.g., "Name <email@example.com>") into tuples.
-            if not header_value:
-                return []
-            recipients = []
-            # Regex to handle both "Name <email>" and just "email" formats.
-            matches = re.findall(r'([^<,"\'\s]+(?:\s+[^<,"\'\s]+)*)\s*<([^>]+)>|(\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b)', header_value)
-            for match in matches:
-                if match[1]: # "Name <email>" format
-                    recipients.append((match[0].strip().replace('"', ''), match[1]))
-                elif match[2]: # "email" format
-                    recipients.append(("", match[2]))
-            return recipients
-
-        def parse_auth_results(header_value: str) -> Optional[EmailAuthenticationModel]:
-            # Parses the 'Authentication-Results' header for SPF, DKIM, and DMARC status.
-            if not header_value:
-                return None
-            
-            auth_results: EmailAuthenticationModel = {}
-            
-            # Regex to extract status and domain for each authentication method.
-            spf_match = re.search(r'spf=(\w+)\s.*header\.from=([\w\.\-]+)', header_value)
-            if spf_match:
-                auth_results["spf_status"] = spf_match.group(1)
-                auth_results["spf_domain"] = spf_match.group(2)
+        for message_id, raw_message in raw_messages.items():
+            try:
+                result["emails"].append(self.extract_email_data_from_raw(raw_message))
+            except Exception as e:
+                result["errors"][message_id] = f"Failed to parse message: {e}"
+
+        return result
+
+    def get_raw_messages_by_ids(self, message_ids: List[str], batch_size: int = MAX_BATCH_REQUESTS) -> Tuple[Dict[str, dict], Dict[str, ErrorDescription]]:
+        """
+        Fetches many unparsed format='raw' message resources through the batch endpoint.
+
+        Messages found in the raw cache are not downloaded again; only their
+        current labels are fetched, which costs a fraction of the bandwidth.
+
+        Args:
+            message_ids (List[str]): The message IDs to fetch.
+            batch_size (int): The number of messages to request per round trip.
+
+        Returns:
+            Tuple[Dict[str, dict], Dict[str, ErrorDescription]]: The message resources keyed by
+                message ID, and an error description for each ID that failed.
+        """
+        if not self.service:
+            print("Not connected. Call connect() first.")
+            return {}, {}
+
+        raw_messages: Dict[str, dict] = {}
+        errors: Dict[str, ErrorDescription] = {}
+        batch_size = max(1, min(batch_size, MAX_BATCH_REQUESTS))
+
+        if self.raw_cache:
+            cached = self.raw_cache.get_many(message_ids)
+            if cached:
+                # Sources never change, but labels may have since the message was cached.
+                label_ids, label_errors = self.get_label_ids_by_message_ids(list(cached), batch_size)
+                for message_id, labels in label_ids.items():
+                    cached[message_id]["labelIds"] = labels
+                    raw_messages[message_id] = cached[message_id]
+                errors.update(label_errors)
+                self.raw_cache.update_labels(label_ids)
+            message_ids = [message_id for message_id in message_ids if message_id not in cached]
+
+        for start in range(0, len(message_ids), batch_size):
+            request_builders = {
+                message_id: (
+                    lambda message_id=message_id: self.service
+                    .users()
+                    .messages()
+                    .get(userId="me", id=message_id, format="raw")
+                )
+                for message_id in message_ids[start:start + batch_size]
+            }
+            responses, batch_errors = self._execute_batch(request_builders)
+            raw_messages.update(responses)
+            errors.update(batch_errors)
+            if self.raw_cache and responses:
+                self.raw_cache.put_many(list(responses.values()))
+
+        return raw_messages, errors
 
-            dkim_match = re.search(r'dkim=(\w+)\s.*header\.d=([\w\.\-]+)', header_value)
-            if dkim_match:
-                auth_results["dkim_status"] = dkim_match.group(1)
-                auth_results["dkim_domain"] = dkim_match.group(2)
+    def get_label_ids_by_message_ids(self, message_ids: List[str], batch_size: int = MAX_BATCH_REQUESTS) -> Tuple[Dict[str, List[str]], Dict[str, ErrorDescription]]:
+        """
+        Fetches only the label IDs of many messages through the batch endpoint.
+
+        Each sub-request uses format='minimal' with a partial response of just
+        'id' and 'labelIds', so no headers or bodies are transferred.
+
+        Args:
+            message_ids (List[str]): The message IDs to look up.
+            batch_size (int): The number of messages to request per round trip.
+
+        Returns:
+            Tuple[Dict[str, List[str]], Dict[str, ErrorDescription]]: The label IDs keyed by
+                message ID, and an error description for each ID that failed.
+        """
+        if not self.service:
+            print("Not connected. Call connect() first.")
+            return {}, {}
+
+        label_ids: Dict[str, List[str]] = {}
+        errors: Dict[str, ErrorDescription] = {}
+        batch_size = max(1, min(batch_size, MAX_BATCH_REQUESTS))
+        for start in range(0, len(message_ids), batch_size):
+            request_builders = {
+                message_id: (
+                    lambda message_id=message_id: self.service
+                    .users()
+                    .messages()
+                    .get(userId="me", id=message_id, format="minimal", fields="id,labelIds")
+                )
+                for message_id in message_ids[start:start + batch_size]
+            }
+            responses, batch_errors = self._execute_batch(request_builders)
+            for message_id, response in responses.items():
+                label_ids[message_id] = response.get("labelIds", [])
+            errors.update(batch_errors)
+
+        return label_ids, errors
+
+    def get_threads_by_ids(self, thread_ids: List[str], batch_size: int = MAX_BATCH_REQUESTS) -> Tuple[Dict[str, dict], Dict[str, ErrorDescription]]:
+        """
+        Fetches whole threads, with every message in format='full', through the batch endpoint.
+
+        One threads.get call returns all messages of a thread, which is cheaper
+        than fetching a long thread message by message.
+
+        Args:
+            thread_ids (List[str]): The thread IDs to fetch.
+            batch_size (int): The number of threads to request per round trip.
+
+        Returns:
+            Tuple[Dict[str, dict], Dict[str, ErrorDescription]]: The thread resources keyed by
+                thread ID, and an error description for each ID that failed.
+        """
+        if not self.service:
+            print("Not connected. Call connect() first.")
+            return {}, {}
+
+        threads: Dict[str, dict] = {}
+        errors: Dict[str, ErrorDescription] = {}
+        batch_size = max(1, min(batch_size, MAX_BATCH_REQUESTS))
+        for start in range(0, len(thread_ids), batch_size):
+            request_builders = {
+                thread_id: (
+                    lambda thread_id=thread_id: self.service
+                    .users()
+                    .threads()
+                    .get(userId="me", id=thread_id, format="full")
+                )
+                for thread_id in thread_ids[start:start + batch_size]
+            }
+            responses, batch_errors = self._execute_batch(request_builders, method="threads.get")
+            threads.update(responses)
+            errors.update(batch_errors)
 
-            dmarc_match = re.search(r'dmarc=(\w+)', header_value)
-            if dmarc_match:
-                auth_results["dmarc_status"] = dmarc_match.group(1)
+        return threads, errors
 
-            return auth_results if auth_results else None
+    def _execute_batch(self, request_builders: Dict[str, Callable[[], Any]], method: str = "messages.get") -> Tuple[Dict[str, Any], Dict[str, ErrorDescription]]:
+        """
+        Executes API requests through the batch endpoint, retrying failed sub-requests.
+
+        Each batch is charged the summed quota cost of its sub-requests before it
+        is sent. Sub-requests that fail with a transient error are resent after
+        an exponential backoff; the others are reported as errors.
+
+        Args:
+            request_builders (Dict[str, Callable]): Maps a unique request ID to a
+                function that builds the (unexecuted) API request.
+            method (str): The API method of the sub-requests, used for their quota cost.
+
+        Returns:
+            Tuple[Dict[str, Any], Dict[str, ErrorDescription]]: The responses keyed by
+                request ID, and an error description for each request ID that failed.
+        """
+        responses: Dict[str, Any] = {}
+        errors: Dict[str, ErrorDescription] = {}
+        failed: Dict[str, Exception] = {}
+
+        def callback(request_id, response, exception):
+            if exception is not None:
+                failed[request_id] = exception
+            else:
+                responses[request_id] = response
+
+        pending = list(request_builders)
+        attempt = 0
+        while pending:
+            failed.clear()
+            for start in range(0, len(pending), MAX_BATCH_REQUESTS):
+                chunk = pending[start:start + MAX_BATCH_REQUESTS]
+                batch = self.service.new_batch_http_request(callback=callback)
+                for request_id in chunk:
+                    batch.add(request_builders[request_id](), request_id=request_id)
+                self.rate_limiter.acquire(QUOTA_COSTS[method] * len(chunk))
+                try:
+                    batch.execute()
+                except HttpError as error:
+                    # The batch envelope itself failed, so none of its sub-requests completed.
+                    for request_id in chunk:
+                        if request_id not in responses:
+                            failed[request_id] = error
+
+            # Only transient failures are retried; anything else is reported immediately.
+            pending = []
+            retrying = False
+            for request_id, error in failed.items():
+                if not is_retryable_error(error):
+                    errors[request_id] = ErrorDescription.from_exception(error)
+                elif attempt < self.rate_limiter.max_retries:
+                    pending.append(request_id)
+                    retrying = True
+                else:
+                    self.rate_limiter.record_failure()
+                    errors[request_id] = ErrorDescription.from_exception(error)
+
+            if retrying:
+                # Slow the shared rate once per round, not once per failed sub-request.
+                self.rate_limiter.record_error(next(e for e in failed.values() if is_retryable_error(e)))
+                self.rate_limiter.backoff(attempt)
+                attempt += 1
+            elif failed or responses:
+                self.rate_limiter.record_success()
+
+        return responses, errors
+
+    def extract_email_data_from_raw(self, message: dict, keep_raw: bool = False) -> ExtractedEmailData:
+        """
+        Parses a message fetched with format='raw' into a structured format.
+
+        Headers, bodies, and attachment descriptors are parsed locally from the
+        RFC 822 source; labels, thread ID, internal date, and snippet come from
+        the same API response, so no 'full' request is needed.
+
+        Args:
+            message (dict): The message resource from the API (format='raw').
+            keep_raw (bool): If True, the source is kept, compressed, in 'raw_source'.
+
+        Returns:
+            ExtractedEmailData: A dictionary containing structured email data.
+        """
+        return parse_raw_api_message(message, keep_raw=keep_raw)
+
+    def extract_email_data(self, message: dict, raw_source: Optional[str] = None) -> ExtractedEmailData:
+        """
+        Parses the raw message dictionary from the Gmail API into a structured format.
+
+        Args:
+            message (dict): The message resource from the API (format='full').
+            raw_source (Optional[str]): The raw, base64-encoded email source (format='raw').
+                                        If given, it is kept compressed in 'raw_source'.
+
+        Returns:
+            ExtractedEmailData: A dictionary containing structured email data.
+        """
+        payload = message.get("payload", {})
+        headers = HeaderIndex((h["name"], h["value"]) for h in payload.get("headers", []))
 
         def get_body_part(parts, mime_type):
             # Recursively searches for a message part with a specific MIME type.
@@ -260,8 +644,8 @@ class GmailAPI:
 
         # Extract all 'X-' headers.
         xheaders: list[EmailXHeaderModel] = [
-            {"message_id": message["id"], "header_name": h["name"], "header_value": h["value"]}
-            for h in headers if h["name"].lower().startswith("x-")
+            {"message_id": message["id"], "header_name": name, "header_value": value}
+            for name, value in headers.xheaders()
         ]
 
         # Extract all labels associated with the message.
@@ -270,58 +654,40 @@ class GmailAPI:
             for label in message.get("labelIds", [])
         ]
         
-        # Parse the 'Date' header into a datetime object.
-        sent_timestamp_str = get_header("Date")
-        sent_timestamp = None
-        if sent_timestamp_str:
-            try:
-                # Attempt to parse various common date formats.
-                sent_timestamp = datetime.datetime.fromisoformat(sent_timestamp_str.replace(" (UTC)", "+00:00").replace(" (GMT)", "+00:00").replace("T", " "))
-            except (ValueError, TypeError):
-                try:
-                    sent_timestamp = datetime.datetime.strptime(sent_timestamp_str, '%a, %d %b %Y %H:%M:%S %z')
-                except (ValueError, TypeError):
-                    sent_timestamp = None # Could not parse the date.
-
-        # Parse sender's name and email from the 'From' header.
-        sender_header = get_header("From")
-        sender_email = ""
-        sender_name = None
-        if sender_header:
-            match = re.search(r'<([^>]+)>', sender_header)
-            if match:
-                sender_email = match.group(1)
-                sender_name = sender_header.split('<')[0].strip().replace('"', '')
-            else:
-                sender_email = sender_header.strip()
+        # Parse the sender's name and email from the 'From' header.
+        sender_header = headers.get("From")
+        sender_email, sender_name = parse_sender(sender_header)
 
         # Assemble the final structured data dictionary.
         return {
             "message_id": message.get("id"),
             "thread_id": message.get("threadId"),
             "sender_email": sender_email,
-            "subject": get_header("Subject"),
+            "subject": headers.get("Subject"),
             "body_text": body_text,
             "body_html": body_html,
-            "sent_timestamp": sent_timestamp,
+            "sent_timestamp": parse_sent_timestamp(headers.get("Date")),
             "internal_date_ms": int(message.get("internalDate", 0)),
-            "date_received": get_header("Received"),
+            "date_received": headers.get("Received"),
             "mime_type": payload.get("mimeType"),
-            "content_transfer_encoding": get_header("Content-Transfer-Encoding"),
-            "to_recipients": parse_recipients(get_header("To")),
-            "cc_recipients": parse_recipients(get_header("Cc")),
-            "bcc_recipients": parse_recipients(get_header("Bcc")),
+            "content_transfer_encoding": headers.get("Content-Transfer-Encoding"),
+            "to_recipients": parse_recipients(headers.get("To")),
+            "cc_recipients": parse_recipients(headers.get("Cc")),
+            "bcc_recipients": parse_recipients(headers.get("Bcc")),
             "sender": sender_header,
             "sender_name": sender_name,
             "snippet": message.get("snippet"),
-            "raw_source": base64.urlsafe_b64decode(raw_source).decode('utf-8', errors='ignore') if raw_source else None,
+            "raw_source": compress_raw_source(message.get("id"), base64.urlsafe_b64decode(raw_source)) if raw_source else None,
             "attachments": attachments,
             "xheaders": xheaders,
             "labels": labels,
-            "authentication_results": parse_auth_results(get_header("Authentication-Results")),
+            "authentication_results": parse_auth_results(
+                headers.get_all("Authentication-Results"), headers.get_all("ARC-Authentication-Results")
+            ),
             "additional_parts": additional_parts,
-            "return_path": get_header("Return-Path"),
-            "header_sender": get_header("Sender"),
+            "routing_headers": parse_received_chain(message.get("id"), headers.get_all("Received")),
+            "return_path": headers.get("Return-Path"),
+            "header_sender": headers.get("Sender"),
         }
 
     def save_extracted_email_as_json(self, extracted_email: ExtractedEmailData):
@@ -338,7 +704,7 @@ class GmailAPI:
         filename = f"{message_id}.json"
         try:
             with open(filename, "w", encoding="utf-8") as f:
-                json.dump(extracted_email, f, indent=4, default=str, ensure_ascii=False)
+                json.dump(summarize_raw_source(extracted_email), f, indent=4, default=str, ensure_ascii=False)
             print(f"Successfully saved email data to {filename}")
         except Exception as e:
             print(f"An error occurred while saving to {filename}: {e}")
@@ -355,12 +721,12 @@ class GmailAPI:
             return
 
         try:
-            results = (
+            results = self._execute(
                 self.service
                 .users()
                 .messages()
-                .list(userId="me", q=query, maxResults=max_count)
-                .execute()
+                .list(userId="me", q=query, maxResults=max_count),
+                "messages.list"
             )
             messages = results.get("messages", [])
             if not messages:
@@ -368,12 +734,12 @@ class GmailAPI:
                 return
 
             for i in range(offset, len(messages)):
-                msg = (
+                msg = self._execute(
                     self.service
                     .users()
                     .messages()
-                    .get(userId="me", id=messages[i]["id"])
-                    .execute()
+                    .get(userId="me", id=messages[i]["id"]),
+                    "messages.get"
                 )
                 self.show_message(msg)
         except HttpError as error:
@@ -398,12 +764,12 @@ class GmailAPI:
         try:
             page_token = None
             while True:
-                results = (
+                results = self._execute(
                     self.service
                     .users()
                     .messages()
-                    .list(userId="me", q=query, maxResults=max_count, pageToken=page_token)
-                    .execute()
+                    .list(userId="me", q=query, maxResults=max_count, pageToken=page_token),
+                    "messages.list"
                 )
                 messages = results.get("messages", [])
                 if not messages:
@@ -422,6 +788,66 @@ class GmailAPI:
             print(f"An error occurred while fetching emails: {error}")
             return
 
+    def iter_message_id_pages(self, query: str, max_results_per_page: int = 500) -> Iterator[List[Dict[str, str]]]:
+        """
+        A generator that yields message IDs and thread IDs for a query, one page at a time.
+
+        Each page is yielded as soon as it arrives, so callers can start work on
+        the first page while later pages are still being listed.
+
+        Args:
+            query (str): The search query (e.g., "in:INBOX").
+            max_results_per_page (int): Maximum results to return per API page.
+
+        Yields:
+            List[Dict[str, str]]: One page of dictionaries, each with 'id' and 'threadId'.
+
+        Raises:
+            HttpError: If a page cannot be listed after retries.
+        """
+        for _, page in self.iter_message_id_pages_with_tokens(query, max_results_per_page):
+            yield page
+
+    def iter_message_id_pages_with_tokens(self, query: str, max_results_per_page: int = 500,
+                                          page_token: Optional[str] = None) -> Iterator[Tuple[Optional[str], List[Dict[str, str]]]]:
+        """
+        Like `iter_message_id_pages`, but can start at a page token and yields each page's token.
+
+        Args:
+            query (str): The search query (e.g., "in:INBOX").
+            max_results_per_page (int): Maximum results to return per API page.
+            page_token (Optional[str]): The token of the page to start at; None for the first page.
+
+        Yields:
+            Tuple[Optional[str], List[Dict[str, str]]]: The token that requested the
+                page (None for the first page) and the page itself.
+
+        Raises:
+            HttpError: If a page cannot be listed after retries.
+        """
+        if not self.service:
+            print("Not connected. Call connect() first.")
+            return
+
+        while True:
+            # Request a page of message IDs.
+            results = self._execute(
+                self.service
+                .users()
+                .messages()
+                .list(userId="me", q=query, maxResults=max_results_per_page, pageToken=page_token),
+                "messages.list"
+            )
+            yield page_token, [
+                {"id": message_info["id"], "threadId": message_info["threadId"]}
+                for message_info in results.get("messages", [])
+            ]
+
+            # Check for the next page.
+            page_token = results.get("nextPageToken")
+            if not page_token:
+                break
+
     def get_message_ids_and_thread_ids_by_query(self, query: str, max_results_per_page: int = 500) -> List[Dict[str, str]]:
         """
         Fetches all message IDs and thread IDs for a query, handling pagination.
@@ -433,41 +859,14 @@ class GmailAPI:
         Returns:
             List[Dict[str, str]]: A list of dictionaries, each with 'id' and 'threadId'.
         """
-        if not self.service:
-            print("Not connected. Call connect() first.")
-            return []
-
         all_message_ids_and_threads = []
-        page_token = None
-
         try:
-            while True:
-                # Request a page of message IDs.
-                results = (
-                    self.service
-                    .users()
-                    .messages()
-                    .list(userId="me", q=query, maxResults=max_results_per_page, pageToken=page_token)
-                    .execute()
-                )
-                messages = results.get("messages", [])
-                
-                for message_info in messages:
-                    all_message_ids_and_threads.append({
-                        "id": message_info["id"],
-                        "threadId": message_info["threadId"]
-                    })
-                
-                # Check for the next page.
-                page_token = results.get("nextPageToken")
-                if not page_token:
-                    break
-            
+            for page in self.iter_message_id_pages(query, max_results_per_page):
+                all_message_ids_and_threads.extend(page)
         except HttpError as error:
             print(f"An error occurred while fetching message IDs: {error}")
-        
-        return all_message_ids_and_threads
 
+        return all_message_ids_and_threads
 
     def show_snippets(self, query, max_count=100):
         """
@@ -478,12 +877,12 @@ class GmailAPI:
             return
 
         try:
-            results = (
+            results = self._execute(
                 self.service
                 .users()
                 .messages()
-                .list(userId="me", q=query, maxResults=max_count)
-                .execute()
+                .list(userId="me", q=query, maxResults=max_count),
+                "messages.list"
             )
             messages = results.get("messages", [])
             if not messages:
@@ -493,12 +892,12 @@ class GmailAPI:
             print("Snippets:")
             for message in messages:
                 # Fetch metadata only for efficiency.
-                msg = (
+                msg = self._execute(
                     self.service
                     .users()
                     .messages()
-                    .get(userId="me", id=message["id"], format="metadata")
-                    .execute()
+                    .get(userId="me", id=message["id"], format="metadata"),
+                    "messages.get"
                 )
                 print(f"ID: {msg['id']} - Snippet: {msg['snippet']}")
         except HttpError as error:
@@ -547,13 +946,8 @@ if __name__ == "__main__":
         print(f"\nGetting email by message ID: {message_id_input}")
         extracted_email = gmail.get_email_by_message_id(message_id_input)
         if extracted_email:
-            # Avoid printing the very long raw source by default.
-            raw_source_len = len(extracted_email.get("raw_source", ""))
-            extracted_email_copy = extracted_email.copy()
-            if raw_source_len > 0:
-                extracted_email_copy["raw_source"] = f"<Raw source of length {raw_source_len}>"
-            
-            print(json.dumps(extracted_email_copy, indent=4, default=str))
+            # Avoid printing the compressed raw source.
+            print(json.dumps(summarize_raw_source(extracted_email), indent=4, default=str))
 
             # Offer to save the extracted data to a file.
             save_input = input("\nSave this email data to a JSON file? (y/N): ")
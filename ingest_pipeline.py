@@ -0,0 +1,342 @@
+"""
+This module implements the concurrent fetch/parse/write pipeline used by `main.py`.
+
+Messages move through three stages connected by bounded queues:
+
+1.  **Fetch:** A pool of threads, each with its own `GmailAPI` service object,
+    downloads raw messages through the Gmail batch endpoint.
+2.  **Parse:** A pool of threads turns the raw API resources into
+    `ExtractedEmailData`, optionally saving attachment bodies to a `BlobStore`.
+    With `parse_processes`, the threads hand each chunk to a `ProcessParser`
+    instead, so parsing uses several cores instead of contending for the GIL.
+3.  **Write:** The calling thread is the single SQLite writer. It drains parsed
+    messages into `SQLiteDB` with `insert_messages` and commits them in
+    batched transactions.
+
+The bounded queues keep memory flat and apply back-pressure: when the writer
+falls behind, parsing and fetching pause until it catches up.
+
+Messages that fail at any stage travel down the queues with their error and
+are recorded in the `failed_messages` table in the same transaction as the
+batch, so they can be retried later instead of being lost.
+"""
+import queue
+import threading
+import time
+from typing import Iterable, List, Optional, Tuple, Callable
+
+from blob_store import BlobStore
+from gmail_api import GmailAPI, ErrorDescription, MAX_BATCH_REQUESTS
+from mail_parser import parse_raw_api_message
+from parse_worker import ProcessParser
+from sqlite_db import SQLiteDB, DEFAULT_INSERT_BATCH_SIZE
+from mailStructs import IngestStats
+
+# Default number of concurrent fetch threads (one Gmail service object each).
+DEFAULT_FETCH_WORKERS = 4
+
+# Default number of threads parsing raw messages.
+DEFAULT_PARSE_WORKERS = 2
+
+# Default number of parse processes; 0 parses in the parse threads themselves.
+DEFAULT_PARSE_PROCESSES = 0
+
+# Default number of batches each queue may hold before upstream stages wait.
+DEFAULT_QUEUE_DEPTH = 8
+
+# Default number of messages committed per SQLite transaction.
+DEFAULT_WRITE_BATCH_SIZE = DEFAULT_INSERT_BATCH_SIZE
+
+# How long (seconds) a stage waits on a queue before checking for shutdown.
+_POLL_INTERVAL = 0.5
+
+# Marks the end of a stage's input.
+_DONE = object()
+
+# A failed message: (message ID, stage, error class, error message).
+Failure = Tuple[str, str, str, str]
+
+
+class IngestPipeline:
+    """
+    Fetches, parses, and stores messages concurrently.
+    """
+    def __init__(self, gmail: GmailAPI, db: SQLiteDB,
+                 fetch_workers: int = DEFAULT_FETCH_WORKERS,
+                 parse_workers: int = DEFAULT_PARSE_WORKERS,
+                 queue_depth: int = DEFAULT_QUEUE_DEPTH,
+                 batch_size: int = MAX_BATCH_REQUESTS,
+                 write_batch_size: int = DEFAULT_WRITE_BATCH_SIZE,
+                 update_if_exists: bool = False,
+                 blob_store: Optional[BlobStore] = None,
+                 parse_processes: int = DEFAULT_PARSE_PROCESSES,
+                 keep_raw: bool = False):
+        """
+        Initializes the pipeline.
+
+        Args:
+            gmail (GmailAPI): A connected client; each fetch worker spawns its own copy.
+            db (SQLiteDB): An open database, written only from the thread calling `run()`.
+            fetch_workers (int): The number of concurrent fetch threads.
+            parse_workers (int): The number of parse threads.
+            queue_depth (int): The number of batches each queue may hold.
+            batch_size (int): The number of messages requested per Gmail batch call.
+            write_batch_size (int): The number of messages committed per transaction.
+            update_if_exists (bool): If True, replaces messages already in the database.
+            blob_store (Optional[BlobStore]): If given, attachment bodies are saved to it while parsing.
+            parse_processes (int): If above 0, messages are parsed in this many worker
+                processes, and at least as many parse threads feed them.
+            keep_raw (bool): If True, the compressed original source of each message
+                is stored in the 'email_raw' table.
+        """
+        self.gmail = gmail
+        self.db = db
+        self.fetch_workers = max(1, fetch_workers)
+        self.parse_processes = max(0, parse_processes)
+        self.parse_workers = max(1, parse_workers, self.parse_processes)
+        self.queue_depth = max(1, queue_depth)
+        self.batch_size = max(1, min(batch_size, MAX_BATCH_REQUESTS))
+        self.write_batch_size = max(1, write_batch_size)
+        self.update_if_exists = update_if_exists
+        self.blob_store = blob_store
+        self.keep_raw = keep_raw
+
+        self._stop = threading.Event()
+        self._stats_lock = threading.Lock()
+        self._stats: IngestStats = self._empty_stats()
+
+    @staticmethod
+    def _empty_stats() -> IngestStats:
+        return {
+            "fetched": 0,
+            "fetch_errors": 0,
+            "parse_errors": 0,
+            "written": 0,
+            "write_errors": 0,
+            "elapsed_seconds": 0.0,
+            "feed_error": None,
+        }
+
+    def _count(self, key: str, amount: int = 1):
+        """Increments a statistics counter from any thread."""
+        with self._stats_lock:
+            self._stats[key] += amount
+
+    def _count_feed_error(self, error: Exception):
+        """Records why reading the message IDs stopped early."""
+        with self._stats_lock:
+            self._stats["feed_error"] = f"{type(error).__name__}: {error}"
+
+    def _put(self, q: queue.Queue, item) -> bool:
+        """Puts an item on a bounded queue, giving up if the pipeline is stopping."""
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=_POLL_INTERVAL)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q: queue.Queue):
+        """Gets an item from a queue, returning the end marker if the pipeline is stopping."""
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=_POLL_INTERVAL)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _feed(self, message_ids: Iterable[str], id_queue: queue.Queue):
+        """Splits the message IDs into batches for the fetch workers."""
+        chunk: List[str] = []
+        try:
+            for message_id in message_ids:
+                chunk.append(message_id)
+                if len(chunk) >= self.batch_size:
+                    if not self._put(id_queue, chunk):
+                        return
+                    chunk = []
+        except Exception as e:
+            # The IDs already read are still ingested, but the rest were never planned,
+            # so the caller must not treat the run as complete.
+            print(f"Failed to read message IDs: {e}")
+            self._count_feed_error(e)
+        finally:
+            if chunk:
+                self._put(id_queue, chunk)
+            for _ in range(self.fetch_workers):
+                self._put(id_queue, _DONE)
+
+    def _fetch(self, id_queue: queue.Queue, raw_queue: queue.Queue):
+        """Downloads raw messages with a dedicated Gmail service object."""
+        try:
+            worker_gmail = self.gmail.spawn()
+        except Exception as e:
+            print(f"Failed to start a fetch worker: {e}")
+            self._stop.set()
+            return
+
+        while True:
+            chunk = self._get(id_queue)
+            if chunk is _DONE:
+                break
+            try:
+                raw_messages, errors = worker_gmail.get_raw_messages_by_ids(chunk, batch_size=self.batch_size)
+            except Exception as e:
+                # E.g. a dropped connection or a socket timeout: the whole chunk failed,
+                # but it is still recorded so it can be retried, and the worker goes on.
+                print(f"  Failed to fetch {len(chunk)} messages: {e}")
+                raw_messages = {}
+                errors = {message_id: ErrorDescription.from_exception(e) for message_id in chunk}
+            failures: List[Failure] = []
+            for message_id, error in errors.items():
+                print(f"  Failed to fetch message ID {message_id}: {error}")
+                failures.append((message_id, "fetch", error.error_class, str(error)))
+            self._count("fetched", len(raw_messages))
+            self._count("fetch_errors", len(errors))
+            if not self._put(raw_queue, (list(raw_messages.values()), failures)):
+                break
+
+    def _parse(self, raw_queue: queue.Queue, parsed_queue: queue.Queue, parser: Optional[ProcessParser]):
+        """Turns raw API message resources into ExtractedEmailData."""
+        while True:
+            item = self._get(raw_queue)
+            if item is _DONE:
+                break
+            chunk, failures = item
+            if parser:
+                try:
+                    parsed, parse_failures = parser.parse_chunk(chunk)
+                except Exception as e:
+                    # Worker deaths are handled by the parser; this is an unexpected error,
+                    # and the whole chunk can be retried later.
+                    print(f"  Failed to parse {len(chunk)} messages in a worker process: {e}")
+                    parsed = []
+                    parse_failures = [(raw_message.get("id"), "parse", type(e).__name__, str(e)) for raw_message in chunk]
+                for message_id, _, _, error in parse_failures:
+                    print(f"  Failed to parse message ID {message_id}: {error}")
+                self._count("parse_errors", len(parse_failures))
+                failures.extend(parse_failures)
+                if not self._put(parsed_queue, (parsed, failures)):
+                    break
+                continue
+
+            parsed = []
+            for raw_message in chunk:
+                try:
+                    parsed.append(parse_raw_api_message(raw_message, self.blob_store, self.keep_raw))
+                except Exception as e:
+                    print(f"  Failed to parse message ID {raw_message.get('id')}: {e}")
+                    self._count("parse_errors")
+                    failures.append((raw_message.get("id"), "parse", type(e).__name__, str(e)))
+            if not self._put(parsed_queue, (parsed, failures)):
+                break
+
+    def _close_stages(self, fetchers: List[threading.Thread], parsers: List[threading.Thread],
+                      raw_queue: queue.Queue, parsed_queue: queue.Queue):
+        """Signals each stage's end of input once the stage before it has finished."""
+        for thread in fetchers:
+            thread.join()
+        for _ in parsers:
+            self._put(raw_queue, _DONE)
+        for thread in parsers:
+            thread.join()
+        self._put(parsed_queue, _DONE)
+
+    def _commit(self, written_ids: List[str], failures: List[Failure], resolved_ids: List[str],
+                on_commit: Optional[Callable[[List[str]], None]]):
+        """Commits the batch along with its failure records, then reports the resolved messages."""
+        self.db.record_failed_messages(failures)
+        self.db.clear_failed_messages(written_ids)
+        self.db.conn.commit()
+        if on_commit:
+            on_commit(resolved_ids)
+
+    def run(self, message_ids: Iterable[str], on_commit: Optional[Callable[[List[str]], None]] = None) -> IngestStats:
+        """
+        Fetches, parses, and stores the given messages.
+
+        The calling thread acts as the SQLite writer, so `db` must have been
+        opened on it.
+
+        Args:
+            message_ids (Iterable[str]): The IDs of the messages to ingest.
+            on_commit (Optional[Callable[[List[str]], None]]): Called on the writer
+                thread after each commit with the IDs of the messages that were
+                stored or recorded as failed since the previous call. It is also
+                called with an empty list while the writer is idle.
+
+        Returns:
+            IngestStats: Counters and the elapsed time for the run. 'feed_error' is
+                set if reading `message_ids` failed, so not every message was ingested.
+        """
+        self._stop.clear()
+        self._stats = self._empty_stats()
+        start_time = time.monotonic()
+
+        id_queue: queue.Queue = queue.Queue(maxsize=self.queue_depth)
+        raw_queue: queue.Queue = queue.Queue(maxsize=self.queue_depth)
+        parsed_queue: queue.Queue = queue.Queue(maxsize=self.queue_depth)
+        parser = ProcessParser(self.parse_processes, self.blob_store, self.keep_raw) if self.parse_processes else None
+
+        feeder = threading.Thread(target=self._feed, args=(message_ids, id_queue), daemon=True)
+        fetchers = [
+            threading.Thread(target=self._fetch, args=(id_queue, raw_queue), daemon=True)
+            for _ in range(self.fetch_workers)
+        ]
+        parsers = [
+            threading.Thread(target=self._parse, args=(raw_queue, parsed_queue, parser), daemon=True)
+            for _ in range(self.parse_workers)
+        ]
+        closer = threading.Thread(
+            target=self._close_stages, args=(fetchers, parsers, raw_queue, parsed_queue), daemon=True
+        )
+        for thread in [feeder, *fetchers, *parsers, closer]:
+            thread.start()
+
+        written_ids: List[str] = []
+        failures: List[Failure] = []
+        resolved_ids: List[str] = []
+        try:
+            while True:
+                try:
+                    item = parsed_queue.get(timeout=_POLL_INTERVAL)
+                except queue.Empty:
+                    # Commit what we have while upstream stages are busy.
+                    self._commit(written_ids, failures, resolved_ids, on_commit)
+                    written_ids, failures, resolved_ids = [], [], []
+                    if self._stop.is_set():
+                        break
+                    continue
+                if item is _DONE:
+                    break
+
+                chunk, chunk_failures = item
+                failures.extend(chunk_failures)
+                resolved_ids.extend(failure[0] for failure in chunk_failures)
+                chunk_written, write_failures = self.db.insert_messages(
+                    chunk, update_if_exists=self.update_if_exists, batch_size=self.write_batch_size, commit=False
+                )
+                self._count("written", len(chunk_written))
+                self._count("write_errors", len(write_failures))
+                written_ids.extend(chunk_written)
+                failures.extend((message_id, "write", type(error).__name__, str(error))
+                                for message_id, error in write_failures)
+                resolved_ids.extend(email_data["message_id"] for email_data in chunk)
+
+                if len(resolved_ids) >= self.write_batch_size:
+                    self._commit(written_ids, failures, resolved_ids, on_commit)
+                    written_ids, failures, resolved_ids = [], [], []
+                    elapsed = time.monotonic() - start_time
+                    print(f"  Committed {self._stats['written']} messages ({self._stats['written'] / elapsed:.1f} msg/s)")
+        finally:
+            if self.db.conn:
+                self._commit(written_ids, failures, resolved_ids, on_commit)
+            self._stop.set()
+            closer.join()
+            feeder.join()
+            if parser:
+                parser.close()
+
+        self._stats["elapsed_seconds"] = time.monotonic() - start_time
+        return self._stats
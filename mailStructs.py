@@ -168,6 +168,9 @@ class EmailRoutingHeaderModel(TypedDict):
     header_name: str        # Typically 'Received'
     header_value: str       # The full content of the routing header
     hop_order: int          # The sequence, where 1 is the final hop.
+    from_host: Optional[str]   # The host the message was received from
+    by_host: Optional[str]     # The host that received it (the relay of this hop)
+    received_at: Optional[int] # When this hop received it, in Unix seconds (UTC)
 
 class EmailModel(TypedDict):
     """
@@ -210,6 +213,8 @@ class EmailAttachmentModel(TypedDict):
     filename: str
     mime_type: Optional[str]
     attachment_size: Optional[int]
+    content_sha256: Optional[str] # SHA-256 of the body, if stored in the blob store
+    blob_path: Optional[str]      # Path of the body relative to the blob store root
 
 
 class EmailXHeaderModel(TypedDict):
@@ -232,6 +237,17 @@ class EmailLabelModel(TypedDict):
     label_name: str
 
 
+class EmailRawModel(TypedDict):
+    """
+    Data model for the 'email_raw' table.
+    Stores the original RFC 822 source of a message, compressed.
+    """
+    message_id: str        # Primary Key, Foreign Key to EmailModel
+    codec: str             # 'zstd' or 'zlib', see compression.py
+    raw_size: int          # Size of the original source in bytes
+    raw_compressed: bytes
+
+
 # ==============================================================================
 # --- 3. API EXTRACTION INPUT FORMAT ---
 # ==============================================================================
@@ -242,6 +258,15 @@ class MessageMetadata(TypedDict):
     threadId: str
     snippet: str
 
+class HistoryChanges(TypedDict):
+    """
+    Mailbox changes reported by the Gmail history API since a stored historyId.
+    """
+    history_id: str                       # The mailbox historyId the changes lead up to
+    added: Dict[str, List[str]]           # New message_id -> its label IDs
+    deleted: List[str]                    # IDs of messages removed from the mailbox
+    label_updates: Dict[str, List[str]]   # Relabeled (older) message_id -> its label IDs
+
 class ExtractedEmailData(TypedDict):
     """
     Intermediate data structure used after parsing data from the Gmail API,
@@ -270,7 +295,7 @@ class ExtractedEmailData(TypedDict):
     sender: Optional[str] # The raw 'From' header
     sender_name: Optional[str]
     snippet: str 
-    raw_source: Optional[str] # The full, raw email source
+    raw_source: Optional[EmailRawModel] # The compressed original source, if it is kept
     return_path: Optional[str]
     header_sender: Optional[str]
 
@@ -295,11 +320,54 @@ class DBSaveResult(TypedDict):
     document_id: str
     collection: str
 
+class BatchFetchResult(TypedDict):
+    """
+    Result of fetching many messages through the Gmail batch endpoint.
+    """
+    emails: List[ExtractedEmailData]
+    errors: Dict[str, str] # message_id -> description of the failure
+
+class IngestStats(TypedDict):
+    """
+    Counters reported by the concurrent ingest pipeline for one run.
+    """
+    fetched: int          # Raw messages downloaded from the API
+    fetch_errors: int     # Messages that could not be downloaded
+    parse_errors: int     # Messages that could not be parsed
+    written: int          # Messages inserted or updated in the database
+    write_errors: int     # Messages skipped or rolled back by the writer
+    elapsed_seconds: float
+    feed_error: Optional[str]  # Why reading the message IDs stopped early, if it did
+
+class AccountConfig(TypedDict, total=False):
+    """
+    One mailbox in a multi-account manifest.
+    """
+    name: str                    # Unique account name, stored in the 'account' column
+    token_file: str              # OAuth token file of this mailbox
+    labels: Optional[List[str]]  # Labels to sync; all labels if omitted
+    db_path: Optional[str]       # Database of this account; defaults to <db-directory>/accounts/<name>/
+
+class AccountSyncResult(TypedDict):
+    """
+    The outcome of syncing one account in its worker process.
+    """
+    account: str
+    db_path: str
+    success: bool
+    messages_added: int   # Net change in stored messages
+    api_requests: int
+    quota_units: int
+    elapsed_seconds: float
+    error: Optional[str]
+
 # --- Publicly exposed types for import ---
 __all__ = [
     "ProximityScores", "KeywordDict", "ContactModel", "EmailAddressModel", 
     "ContactPhoneModel", "ContactAddressModel", "RecipientTuple", 
     "EmailAuthenticationModel", "EmailRoutingHeaderModel", "EmailModel", 
-    "EmailAttachmentModel", "EmailXHeaderModel", "EmailLabelModel", 
-    "MessageMetadata", "ExtractedEmailData", "DBSaveResult", "AdditionalPart"
+    "EmailAttachmentModel", "EmailXHeaderModel", "EmailLabelModel", "EmailRawModel",
+    "MessageMetadata", "ExtractedEmailData", "DBSaveResult", "AdditionalPart",
+    "BatchFetchResult", "IngestStats", "HistoryChanges", "AccountConfig",
+    "AccountSyncResult"
 ]
\ No newline at end of file
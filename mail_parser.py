@@ -0,0 +1,426 @@
+"""
+This module parses email data into the `ExtractedEmailData` structure.
+
+It builds a complete record from a single `format="raw"` Gmail API response:
+headers, bodies, and attachment descriptors are parsed locally from the
+RFC 822 source, while the Gmail-only fields (labels, thread ID, internal date,
+and snippet) are read from the same API response. It also holds the header
+helpers shared with the `format="full"` extraction in `gmail_api`.
+
+The module only depends on the standard library so it can be used without
+an API connection. Attachment bodies can be saved to a `BlobStore` while parsing,
+since the raw source already contains them, and the source itself can be kept
+compressed for the `email_raw` table.
+"""
+import base64
+import re
+import datetime
+from email import message_from_bytes
+from email.header import Header, decode_header, make_header
+from email.message import Message
+from email.utils import getaddresses, parsedate_to_datetime
+from typing import Optional, List, Tuple, Any, Dict, Iterable, Iterator
+
+from auth_results import parse_auth_results
+from blob_store import BlobStore
+from compression import compress
+from mailStructs import (
+    ExtractedEmailData, RecipientTuple, EmailAttachmentModel,
+    EmailXHeaderModel, EmailLabelModel, EmailRawModel, EmailRoutingHeaderModel, AdditionalPart
+)
+
+# Matches the line breaks of a folded (multi-line) header value.
+_FOLDING_WHITESPACE = re.compile(r'\r?\n(?=[ \t])')
+
+# Matches the address in angle brackets of a "Name <email>" header.
+_ANGLE_ADDRESS = re.compile(r'<([^>]+)>')
+
+# Parts of a Received header: "from X (comment) by Y with ESMTPS id Z; <date>".
+# Comments are removed first (twice, for one level of nesting), so the host
+# patterns never match text such as "(envelope-from <...>)".
+_COMMENT = re.compile(r'\([^()]*\)')
+_RECEIVED_FROM = re.compile(r'(?:^|\s)from\s+([^\s;]+)', re.IGNORECASE)
+_RECEIVED_BY = re.compile(r'(?:^|\s)by\s+([^\s;]+)', re.IGNORECASE)
+
+# Matches the canonical RFC 2822 date ("Mon, 1 Jan 2024 10:00:00 +0000"), which
+# nearly every mailer emits; anything else goes through the general parsers.
+_RFC2822_DATE = re.compile(
+    r'\s*(?:[A-Za-z]{3},\s*)?(\d{1,2})\s+([A-Za-z]{3})\s+(\d{4})\s+'
+    r'(\d{1,2}):(\d{2})(?::(\d{2}))?\s+([+-])(\d{2})(\d{2})'
+)
+_MONTHS = {name: number for number, name in enumerate(
+    ("jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"), start=1)}
+
+
+class HeaderIndex:
+    """
+    A case-insensitive multimap of decoded headers, built in one pass.
+
+    Lookups are dictionary hits instead of a scan over every header, which
+    matters for bulk mail carrying hundreds of headers. The original order
+    and spelling of the header names is kept for `items()`.
+    """
+    def __init__(self, headers: Iterable[Tuple[str, str]]):
+        """
+        Initializes the index.
+
+        Args:
+            headers (Iterable[Tuple[str, str]]): (name, decoded value) pairs in message order.
+        """
+        self._headers: List[Tuple[str, str]] = []
+        self._values: Dict[str, List[str]] = {}
+        for name, value in headers:
+            self._headers.append((name, value))
+            self._values.setdefault(name.lower(), []).append(value)
+
+    def get(self, name: str) -> Optional[str]:
+        """Returns the first value of a header, or None if it is missing."""
+        values = self._values.get(name.lower())
+        return values[0] if values else None
+
+    def get_all(self, name: str) -> List[str]:
+        """Returns every value of a header, in message order."""
+        return self._values.get(name.lower(), [])
+
+    def items(self) -> Iterator[Tuple[str, str]]:
+        """Yields every (name, value) pair in message order."""
+        return iter(self._headers)
+
+    def xheaders(self) -> List[Tuple[str, str]]:
+        """Returns the (name, value) pairs of all 'X-' headers."""
+        return [(name, value) for name, value in self._headers if name[:2] in ("X-", "x-")]
+
+
+def parse_recipients(header_value: str) -> list[RecipientTuple]:
+    """
+    Parses an RFC 5322 address list (e.g., "Name <email@example.com>, other@example.com") into tuples.
+
+    Args:
+        header_value (str): The value of a 'To', 'Cc', or 'Bcc' header.
+
+    Returns:
+        list[RecipientTuple]: A list of (display name, email address) tuples.
+    """
+    if not header_value:
+        return []
+    # getaddresses handles quoted names containing commas and skips group syntax;
+    # entries without an '@' are fragments of malformed lists, not addresses.
+    return [(name, address) for name, address in getaddresses([header_value]) if "@" in address]
+
+
+def parse_sent_timestamp(date_header: Optional[str]) -> Optional[datetime.datetime]:
+    """
+    Parses the 'Date' header into a datetime object.
+
+    Args:
+        date_header (Optional[str]): The value of the 'Date' header.
+
+    Returns:
+        Optional[datetime.datetime]: The parsed timestamp, or None if it could not be parsed.
+    """
+    if not date_header:
+        return None
+
+    match = _RFC2822_DATE.match(date_header)
+    month = _MONTHS.get(match.group(2).lower()) if match else None
+    if month:
+        day, _, year, hour, minute, second, sign, offset_hours, offset_minutes = match.groups()
+        offset = datetime.timedelta(hours=int(offset_hours), minutes=int(offset_minutes))
+        try:
+            return datetime.datetime(
+                int(year), month, int(day), int(hour), int(minute), int(second or 0),
+                tzinfo=datetime.timezone(-offset if sign == "-" else offset)
+            )
+        except ValueError:
+            pass  # Out-of-range fields; let the general parsers decide.
+
+    try:
+        # Other RFC 2822 forms (obsolete zone names, two-digit years, ...).
+        return parsedate_to_datetime(date_header)
+    except (ValueError, TypeError, IndexError):
+        pass
+    try:
+        # ISO 8601 dates sent by some automated mailers.
+        return datetime.datetime.fromisoformat(date_header.replace(" (UTC)", "+00:00").replace(" (GMT)", "+00:00").replace("T", " "))
+    except (ValueError, TypeError):
+        return None # Could not parse the date.
+
+
+def parse_received_chain(message_id: str, received_headers: List[str]) -> List[EmailRoutingHeaderModel]:
+    """
+    Parses every 'Received' header into a routing hop.
+
+    Args:
+        message_id (str): The message ID.
+        received_headers (List[str]): The 'Received' header values in message order,
+                                      i.e. the final hop first.
+
+    Returns:
+        List[EmailRoutingHeaderModel]: One hop per header, where hop_order 1 is the
+            final hop, with its hosts and its timestamp in Unix seconds.
+    """
+    hops: List[EmailRoutingHeaderModel] = []
+    for hop_order, header_value in enumerate(received_headers, start=1):
+        # The timestamp follows the last ';'; everything before it describes the hop.
+        route, _, date_text = header_value.rpartition(";")
+        if not route:
+            route, date_text = header_value, ""
+        route = _COMMENT.sub(" ", _COMMENT.sub(" ", route))
+        from_match = _RECEIVED_FROM.search(route)
+        by_match = _RECEIVED_BY.search(route)
+        received = parse_sent_timestamp(date_text.strip())
+        hops.append({
+            "message_id": message_id,
+            "header_name": "Received",
+            "header_value": header_value,
+            "hop_order": hop_order,
+            "from_host": from_match.group(1).lower() if from_match else None,
+            "by_host": by_match.group(1).lower() if by_match else None,
+            "received_at": int(received.timestamp()) if received and received.tzinfo else None,
+        })
+    return hops
+
+
+def parse_sender(sender_header: Optional[str]) -> Tuple[str, Optional[str]]:
+    """
+    Parses the sender's email and name from the 'From' header.
+
+    Args:
+        sender_header (Optional[str]): The value of the 'From' header.
+
+    Returns:
+        Tuple[str, Optional[str]]: The sender's email address and display name.
+    """
+    sender_email = ""
+    sender_name = None
+    if sender_header:
+        match = _ANGLE_ADDRESS.search(sender_header)
+        if match:
+            sender_email = match.group(1)
+            sender_name = sender_header.split('<')[0].strip().replace('"', '')
+        else:
+            sender_email = sender_header.strip()
+    return sender_email, sender_name
+
+
+def decode_header_value(value: Any) -> str:
+    """
+    Unfolds a raw header value and decodes any RFC 2047 encoded words.
+
+    Args:
+        value (Any): A header value as returned by `email.message.Message`,
+                     either a `str` or a `Header` for non-ASCII raw bytes.
+
+    Returns:
+        str: The decoded, single-line header value.
+    """
+    if isinstance(value, str) and "=?" not in value:
+        return _FOLDING_WHITESPACE.sub("", value)
+
+    try:
+        if isinstance(value, Header):
+            # Undeclared 8-bit header bytes are almost always UTF-8 in practice.
+            decoded = "".join(
+                text.decode("utf-8" if charset in (None, "unknown-8bit") else charset, errors="replace")
+                if isinstance(text, bytes) else text
+                for text, charset in decode_header(value)
+            )
+        else:
+            decoded = str(make_header(decode_header(value)))
+    except (LookupError, ValueError, UnicodeError):
+        decoded = str(value)
+    return _FOLDING_WHITESPACE.sub("", decoded)
+
+
+def _decode_part_text(part: Message) -> Optional[str]:
+    """Decodes the transfer-encoded body of a text part using its declared charset."""
+    payload = part.get_payload(decode=True)
+    if payload is None:
+        return None
+    charset = part.get_content_charset() or "utf-8"
+    try:
+        return payload.decode(charset, errors="replace")
+    except LookupError:
+        return payload.decode("utf-8", errors="replace")
+
+
+def _find_body_part(leaf_parts: List[Tuple[Message, str, Optional[str]]], mime_type: str) -> Optional[str]:
+    """Returns the decoded content of the first non-attachment part of the given MIME type."""
+    for part, part_type, filename in leaf_parts:
+        if part_type != mime_type or filename:
+            continue
+        text = _decode_part_text(part)
+        if text:
+            return text
+    return None
+
+
+def _attachment_from_part(part: Message, message_id: str, blob_store: Optional[BlobStore]) -> EmailAttachmentModel:
+    """Describes an attachment part, saving its body to the blob store if one is given."""
+    payload = part.get_payload(decode=True) or b""
+    attachment: EmailAttachmentModel = {
+        "message_id": message_id,
+        "filename": decode_header_value(part.get_filename()),
+        "mime_type": part.get_content_type(),
+        "attachment_size": len(payload),
+        "content_sha256": None,
+        "blob_path": None,
+    }
+    if blob_store is not None and payload:
+        stored = blob_store.put(payload)
+        if stored:
+            attachment["content_sha256"], attachment["blob_path"] = stored
+    return attachment
+
+
+def compress_raw_source(message_id: str, raw_bytes: bytes) -> EmailRawModel:
+    """
+    Compresses the original source of a message for the 'email_raw' table.
+
+    Args:
+        message_id (str): The message ID.
+        raw_bytes (bytes): The RFC 822 source, exactly as received.
+
+    Returns:
+        EmailRawModel: The compressed source and its codec.
+    """
+    codec, compressed = compress(raw_bytes)
+    return {"message_id": message_id, "codec": codec, "raw_size": len(raw_bytes), "raw_compressed": compressed}
+
+
+def summarize_raw_source(email_data: ExtractedEmailData) -> ExtractedEmailData:
+    """Returns a copy of the email data with the compressed source replaced by its size, for display or JSON."""
+    raw_source = email_data.get("raw_source")
+    if not raw_source:
+        return email_data
+    return {**email_data, "raw_source": f"<{raw_source['raw_size']} bytes, {raw_source['codec']}-compressed>"}
+
+
+def parse_raw_message(raw_bytes: bytes, message: dict, blob_store: Optional[BlobStore] = None,
+                      keep_raw: bool = False) -> ExtractedEmailData:
+    """
+    Parses raw RFC 822 message bytes into a structured format.
+
+    Args:
+        raw_bytes (bytes): The decoded email source.
+        message (dict): The message resource from the API (format='raw' or
+                        'minimal'), used for the ID, thread ID, labels,
+                        internal date, and snippet.
+        blob_store (Optional[BlobStore]): If given, attachment bodies are saved to it.
+        keep_raw (bool): If True, the source is kept, compressed, in 'raw_source'.
+
+    Returns:
+        ExtractedEmailData: A dictionary containing structured email data.
+    """
+    message_id = message.get("id")
+    parsed = message_from_bytes(raw_bytes)
+
+    headers = HeaderIndex((name, decode_header_value(value)) for name, value in parsed.items())
+
+    body_text = None
+    body_html = None
+    attachments: list[EmailAttachmentModel] = []
+    additional_parts: list[AdditionalPart] = []
+
+    if parsed.is_multipart():
+        # Walk the MIME tree once; each content type and filename lookup scans the part's headers.
+        leaf_parts = [
+            (part, part.get_content_type(), part.get_filename())
+            for part in parsed.walk() if not part.is_multipart()
+        ]
+
+        # Find primary text and HTML content.
+        body_text = _find_body_part(leaf_parts, "text/plain")
+        body_html = _find_body_part(leaf_parts, "text/html")
+
+        # Attachments can be nested at any depth (e.g., inside multipart/related).
+        attachments = [
+            _attachment_from_part(part, message_id, blob_store)
+            for part, _, filename in leaf_parts if filename
+        ]
+
+        # Identify other non-primary top-level parts.
+        for index, part in enumerate(parsed.get_payload()):
+            mime_type = part.get_content_type()
+            if part.get_filename() or mime_type in ("text/plain", "text/html"):
+                continue
+            payload = None if part.is_multipart() else part.get_payload(decode=True)
+            additional_parts.append({
+                "part_id": str(index),
+                "mime_type": mime_type,
+                "filename": "",
+                "size": len(payload) if payload else 0,
+            })
+    elif parsed.get_filename():
+        # The whole message is a single attachment.
+        attachments.append(_attachment_from_part(parsed, message_id, blob_store))
+    else:
+        # Handle single-part messages.
+        mime_type = parsed.get_content_type()
+        if mime_type == "text/plain":
+            body_text = _decode_part_text(parsed)
+        elif mime_type == "text/html":
+            body_html = _decode_part_text(parsed)
+
+    # Extract all 'X-' headers.
+    xheaders: list[EmailXHeaderModel] = [
+        {"message_id": message_id, "header_name": name, "header_value": value}
+        for name, value in headers.xheaders()
+    ]
+
+    # Extract all labels associated with the message.
+    labels: list[EmailLabelModel] = [
+        {"message_id": message_id, "label_name": label}
+        for label in message.get("labelIds", [])
+    ]
+
+    sender_header = headers.get("From")
+    sender_email, sender_name = parse_sender(sender_header)
+
+    # Assemble the final structured data dictionary.
+    return {
+        "message_id": message_id,
+        "thread_id": message.get("threadId"),
+        "sender_email": sender_email,
+        "subject": headers.get("Subject"),
+        "body_text": body_text,
+        "body_html": body_html,
+        "sent_timestamp": parse_sent_timestamp(headers.get("Date")),
+        "internal_date_ms": int(message.get("internalDate", 0)),
+        "date_received": headers.get("Received"),
+        "mime_type": parsed.get_content_type(),
+        "content_transfer_encoding": headers.get("Content-Transfer-Encoding"),
+        "to_recipients": parse_recipients(headers.get("To")),
+        "cc_recipients": parse_recipients(headers.get("Cc")),
+        "bcc_recipients": parse_recipients(headers.get("Bcc")),
+        "sender": sender_header,
+        "sender_name": sender_name,
+        "snippet": message.get("snippet"),
+        "raw_source": compress_raw_source(message_id, raw_bytes) if keep_raw else None,
+        "attachments": attachments,
+        "xheaders": xheaders,
+        "labels": labels,
+        "authentication_results": parse_auth_results(
+            headers.get_all("Authentication-Results"), headers.get_all("ARC-Authentication-Results")
+        ),
+        "additional_parts": additional_parts,
+        "routing_headers": parse_received_chain(message_id, headers.get_all("Received")),
+        "return_path": headers.get("Return-Path"),
+        "header_sender": headers.get("Sender"),
+    }
+
+
+def parse_raw_api_message(message: dict, blob_store: Optional[BlobStore] = None,
+                          keep_raw: bool = False) -> ExtractedEmailData:
+    """
+    Parses a `format="raw"` message resource from the Gmail API.
+
+    Args:
+        message (dict): The message resource, including the base64url-encoded 'raw' field.
+        blob_store (Optional[BlobStore]): If given, attachment bodies are saved to it.
+        keep_raw (bool): If True, the source is kept, compressed, in 'raw_source'.
+
+    Returns:
+        ExtractedEmailData: A dictionary containing structured email data.
+    """
+    return parse_raw_message(base64.urlsafe_b64decode(message["raw"]), message, blob_store, keep_raw)
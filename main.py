@@ -6,23 +6,814 @@ fetches emails based on specified labels, and inserts or updates them in a
 SQLite database. The application handles fetching all labels, filtering them,
 and processing messages in an idempotent manner to avoid duplicates unless an
 update is explicitly requested.
+
+After a successful run the mailbox historyId is stored in the database, so
+later runs only apply the messages added, deleted, or relabeled since then.
 """
 import typer
-from typing import List, Optional
+from typing import List, Optional, Set, Iterator, Dict, Tuple, Any
 import os
+import threading
+import time
+import contextlib
+import collections
+from concurrent.futures import ThreadPoolExecutor
+from googleapiclient.errors import HttpError
 
-from gmail_api import GmailAPI
-from sqlite_db import SQLiteDB
-from config import DATABASE_PATH
+from gmail_api import GmailAPI, ErrorDescription, MAX_BATCH_REQUESTS
+from fake_gmail import FakeGmailService
+from sqlite_db import SQLiteDB, PRAGMA_PROFILES, READ_ONLY_PROFILES
+from mailStructs import HistoryChanges, IngestStats, AccountConfig, AccountSyncResult, ExtractedEmailData
+from multi_account import load_manifest, run_accounts, account_db_path
+from ingest_pipeline import (
+    IngestPipeline, DEFAULT_FETCH_WORKERS, DEFAULT_PARSE_WORKERS, DEFAULT_PARSE_PROCESSES,
+    DEFAULT_QUEUE_DEPTH
+)
+from parse_worker import ProcessParser, Failure
+from raw_cache import RawMessageCache
+from mail_parser import parse_raw_api_message
+from blob_store import BlobStore, DEFAULT_MAX_CONCURRENT_WRITES
+from config import (
+    DATABASE_PATH, RAW_CACHE_DIR, RAW_CACHE_MAX_MB, ATTACHMENTS_DIR, MAX_ATTACHMENT_MB,
+    MAX_FAILED_ATTEMPTS, KEEP_RAW_SOURCE, WRITE_BATCH_SIZE, DB_PROFILE
+)
 
 # Initialize the Typer application
 app = typer.Typer()
 
+
+def print_ingest_stats(stats: IngestStats):
+    """Prints the counters of one pipeline run."""
+    if stats["elapsed_seconds"] > 0:
+        print(f"  {stats['written']} written, {stats['fetch_errors']} fetch errors, "
+              f"{stats['parse_errors']} parse errors in {stats['elapsed_seconds']:.1f}s "
+              f"({stats['written'] / stats['elapsed_seconds']:.1f} msg/s)")
+
+
+class FetchPlanner:
+    """
+    Streams the message IDs of the selected labels, yielding each message once.
+
+    Labels are listed page by page while the pipeline consumes the IDs, so
+    fetching starts on the first page. A message carrying several selected
+    labels is listed once per label but yielded only once; its labels come from
+    its own labelIds when fetched. Only the IDs seen so far are kept in memory.
+
+    The planner also tracks which listed pages have been fully committed, so
+    an interrupted scan can resume each label from its first unfinished page
+    instead of listing everything again.
+    """
+    def __init__(self, gmail: GmailAPI, labels_to_process: List[str], existing_ids: Set[str], update: bool,
+                 resume_from: Optional[Dict[str, Tuple[Optional[str], bool]]] = None):
+        self.gmail = gmail
+        self.labels_to_process = labels_to_process
+        self.existing_ids = existing_ids
+        self.update = update
+        self.resume_from = resume_from or {}
+
+        self.listed_ids: Set[str] = set()
+        self.total_listed = 0
+        self.planned = 0
+        self.failed_labels: List[str] = []
+
+        # Checkpoint tracking, shared by the listing thread and the writer thread.
+        self._lock = threading.Lock()
+        self._pages: Dict[str, List[list]] = {}  # label -> [page token, messages not yet committed]
+        self._message_pages: Dict[str, Tuple[str, list]] = {}
+        self._last_message_ids: Dict[str, str] = {}
+        self._listed_labels: Set[str] = set()
+        self._changed_labels: Set[str] = set()
+
+    def _list_label(self, lbl: str, start_token: Optional[str]) -> Iterator[str]:
+        label_count = 0
+        first_seen = 0
+        for page_token, page in self.gmail.iter_message_id_pages_with_tokens(f"in:{lbl}", page_token=start_token):
+            to_fetch = []
+            for message_info in page:
+                message_id = message_info['id']
+                label_count += 1
+                if message_id in self.listed_ids:
+                    continue
+                self.listed_ids.add(message_id)
+                first_seen += 1
+
+                # Skip messages already in the database unless we're in update mode.
+                if self.update or message_id not in self.existing_ids:
+                    to_fetch.append(message_id)
+
+            # Register the page before its messages reach the pipeline.
+            page_entry = [page_token, len(to_fetch)]
+            with self._lock:
+                self._pages.setdefault(lbl, []).append(page_entry)
+                for message_id in to_fetch:
+                    self._message_pages[message_id] = (lbl, page_entry)
+                self._changed_labels.add(lbl)
+
+            self.planned += len(to_fetch)
+            yield from to_fetch
+
+        self.total_listed += label_count
+        print(f"  Listed {lbl}: {label_count} messages ({first_seen} not listed under an earlier label)")
+
+    def __iter__(self) -> Iterator[str]:
+        for lbl in self.labels_to_process:
+            start_token, completed = self.resume_from.get(lbl, (None, False))
+            if completed:
+                print(f"  Skipping {lbl}: already finished by an interrupted earlier scan.")
+                continue
+            if start_token:
+                print(f"  Resuming {lbl} from its first unfinished page.")
+            try:
+                try:
+                    yield from self._list_label(lbl, start_token)
+                except HttpError as error:
+                    if not start_token or error.resp.status != 400:
+                        raise
+                    # Saved page tokens can expire; start the label over instead.
+                    print(f"  Saved page token for {lbl} was rejected; listing it from the start.")
+                    with self._lock:
+                        self._pages.pop(lbl, None)
+                    yield from self._list_label(lbl, None)
+            except HttpError as error:
+                print(f"  An error occurred while listing label {lbl}: {error}")
+                self.failed_labels.append(lbl)
+                continue
+
+            with self._lock:
+                self._listed_labels.add(lbl)
+                self._changed_labels.add(lbl)
+
+    def resolve(self, message_ids: List[str]) -> List[Tuple[str, Optional[str], Optional[str], bool]]:
+        """
+        Marks messages as committed (stored or recorded as failed) and returns new label checkpoints.
+
+        Args:
+            message_ids (List[str]): The IDs of the messages committed since the last call.
+
+        Returns:
+            List[Tuple]: (label, page token, last committed message ID, completed)
+                for each label whose checkpoint moved.
+        """
+        with self._lock:
+            for message_id in message_ids:
+                located = self._message_pages.pop(message_id, None)
+                if located:
+                    lbl, page_entry = located
+                    page_entry[1] -= 1
+                    self._last_message_ids[lbl] = message_id
+                    self._changed_labels.add(lbl)
+
+            checkpoints = []
+            for lbl in self._changed_labels:
+                pages = self._pages.get(lbl, [])
+                # Drop fully committed pages; the first page left is where listing resumes.
+                while len(pages) > 1 and pages[0][1] == 0:
+                    pages.pop(0)
+                completed = lbl in self._listed_labels and all(page[1] == 0 for page in pages)
+                page_token = pages[0][0] if pages and not completed else None
+                checkpoints.append((lbl, page_token, self._last_message_ids.get(lbl), completed))
+            self._changed_labels.clear()
+        return checkpoints
+
+    def print_summary(self):
+        """Prints how many messages were listed, planned, and deduplicated."""
+        unique = len(self.listed_ids)
+        print(f"Listed {self.total_listed} label entries for {unique} unique messages "
+              f"({self.total_listed - unique} duplicate downloads avoided); "
+              f"{self.planned} fetched, {unique - self.planned} already in the database.")
+        if self.failed_labels:
+            print(f"Listing failed for: {', '.join(self.failed_labels)}")
+
+
+def print_failed_summary(db: SQLiteDB):
+    """Reports how many failed messages are waiting to be retried."""
+    retryable = len(db.get_failed_message_ids(MAX_FAILED_ATTEMPTS))
+    if retryable:
+        print(f"{retryable} failed messages are queued; run with --retry-failed to fetch them again.")
+
+
+def run_full_scan(gmail: GmailAPI, db: SQLiteDB, pipeline: IngestPipeline,
+                  labels_to_process: List[str], update: bool, scan_key: str) -> bool:
+    """
+    Lists every message of the selected labels and ingests those not yet in the database.
+
+    Progress is checkpointed per label as batches are committed, and a scan
+    of the same selection interrupted earlier resumes from those checkpoints.
+    Messages that fail are queued in `failed_messages` rather than failing the scan.
+
+    Args:
+        scan_key (str): The sync checkpoint key of the label selection, which
+            the listing checkpoints are stored under.
+
+    Returns:
+        bool: True if every selected label was listed to the end.
+    """
+    # --- Fetch Existing Message IDs for Idempotency ---
+    # To avoid re-inserting emails, get all existing IDs from the DB first.
+    existing_ids = set()
+    if not update:
+        print("\nFetching existing message IDs from the database for comparison...")
+        rows = db.query_db("SELECT message_id FROM emails")
+        if rows:
+            existing_ids = {row[0] for row in rows}
+        print(f"Found {len(existing_ids)} existing messages to skip.")
+
+    # --- List Labels and Fetch Each Message Once, Concurrently ---
+    planner = FetchPlanner(gmail, labels_to_process, existing_ids, update, resume_from=db.get_ingest_checkpoints(scan_key))
+    print(f"\nListing {len(labels_to_process)} labels and fetching with {pipeline.fetch_workers} workers...")
+    stats = pipeline.run(
+        planner, on_commit=lambda message_ids: db.save_ingest_checkpoints(scan_key, planner.resolve(message_ids))
+    )
+    db.save_ingest_checkpoints(scan_key, planner.resolve([]))
+    planner.print_summary()
+    print_ingest_stats(stats)
+    print(f"--- Finished. Processed {stats['written']} new/updated emails. ---")
+    print_failed_summary(db)
+
+    if stats["feed_error"]:
+        # Labels not listed yet must not be skipped: keep the checkpoints for a resume.
+        print(f"Listing stopped early ({stats['feed_error']}); the scan can be resumed.")
+        return False
+    if planner.failed_labels:
+        return False
+    db.clear_ingest_checkpoints(scan_key)
+    return True
+
+
+def run_thread_scan(gmail: GmailAPI, db: SQLiteDB, pipeline: IngestPipeline,
+                    labels_to_process: List[str], update: bool, scan_key: str) -> bool:
+    """
+    Lists the selected labels and ingests whole threads with one threads.get call each.
+
+    Listed messages are grouped by thread ID. Threads whose listed messages are
+    all stored already are skipped, and every other thread is fetched in full
+    and each of its messages stored, including replies outside the selected
+    labels. A threads.get call costs as much quota as two messages.get calls,
+    so threads with a single listed message go through the regular pipeline.
+
+    The thread scan lists everything again, so once it succeeds, the
+    checkpoints an interrupted full scan of the selection left are cleared.
+
+    Args:
+        scan_key (str): The sync checkpoint key of the label selection.
+
+    Returns:
+        bool: True if every selected label was listed to the end; failed
+              messages are queued in `failed_messages`.
+    """
+    existing_ids = set()
+    if not update:
+        print("\nFetching existing message IDs from the database for comparison...")
+        rows = db.query_db("SELECT message_id FROM emails")
+        if rows:
+            existing_ids = {row[0] for row in rows}
+        print(f"Found {len(existing_ids)} existing messages to skip.")
+
+    # --- Group the Listed Messages by Thread ---
+    print(f"\nListing {len(labels_to_process)} labels...")
+    thread_messages: Dict[str, Set[str]] = {}
+    failed_labels = []
+    for lbl in labels_to_process:
+        try:
+            for page in gmail.iter_message_id_pages(f"in:{lbl}"):
+                for message_info in page:
+                    thread_messages.setdefault(message_info['threadId'], set()).add(message_info['id'])
+        except Exception as error:
+            print(f"  An error occurred while listing label {lbl}: {error}")
+            failed_labels.append(lbl)
+
+    pending_threads = [
+        thread_id for thread_id, message_ids in thread_messages.items()
+        if update or not message_ids <= existing_ids
+    ]
+    multi_threads = [thread_id for thread_id in pending_threads if len(thread_messages[thread_id]) > 1]
+    single_ids = [next(iter(thread_messages[thread_id])) for thread_id in pending_threads if len(thread_messages[thread_id]) == 1]
+    print(f"Found {len(thread_messages)} threads: {len(thread_messages) - len(pending_threads)} already stored, "
+          f"{len(multi_threads)} fetched whole, {len(single_ids)} single messages.")
+
+    # --- Fetch Whole Threads Concurrently; Write on This Thread ---
+    stats: IngestStats = {
+        "fetched": 0, "fetch_errors": 0, "parse_errors": 0,
+        "written": 0, "write_errors": 0, "elapsed_seconds": 0.0, "feed_error": None,
+    }
+    start_time = time.monotonic()
+    worker_state = threading.local()
+
+    def fetch_threads(chunk: List[str]):
+        # Each thread needs its own service object.
+        if not hasattr(worker_state, "gmail"):
+            worker_state.gmail = gmail.spawn()
+        try:
+            return worker_state.gmail.get_threads_by_ids(chunk, batch_size=pipeline.batch_size)
+        except Exception as e:
+            # E.g. a dropped connection: the chunk's messages are queued for a retry.
+            return {}, {thread_id: ErrorDescription.from_exception(e) for thread_id in chunk}
+
+    chunks = [multi_threads[start:start + pipeline.batch_size] for start in range(0, len(multi_threads), pipeline.batch_size)]
+    # Only a few chunks are in flight at once, so fetched threads never pile up in memory.
+    window = pipeline.fetch_workers * 2
+    with ThreadPoolExecutor(max_workers=pipeline.fetch_workers) as executor:
+        for window_start in range(0, len(chunks), window):
+            for threads, errors in executor.map(fetch_threads, chunks[window_start:window_start + window]):
+                failures = []
+                parsed = []
+                for thread_id, error in errors.items():
+                    print(f"  Failed to fetch thread ID {thread_id}: {error}")
+                    stats["fetch_errors"] += len(thread_messages[thread_id])
+                    # The listed messages can be retried one by one later.
+                    failures.extend((message_id, "fetch", error.error_class, str(error)) for message_id in thread_messages[thread_id])
+                for thread in threads.values():
+                    for message in thread.get("messages", []):
+                        if not update and message["id"] in existing_ids:
+                            continue
+                        stats["fetched"] += 1
+                        try:
+                            # threads.get has no 'raw' format, so the 'full' payload is parsed.
+                            email_data = gmail.extract_email_data(message, None)
+                        except Exception as e:
+                            print(f"  Failed to parse message ID {message.get('id')}: {e}")
+                            stats["parse_errors"] += 1
+                            failures.append((message["id"], "parse", type(e).__name__, str(e)))
+                            continue
+                        parsed.append(email_data)
+                written_ids, write_failures = db.insert_messages(
+                    parsed, update_if_exists=update, batch_size=pipeline.write_batch_size, commit=False
+                )
+                stats["written"] += len(written_ids)
+                stats["write_errors"] += len(write_failures)
+                failures.extend((message_id, "write", type(error).__name__, str(error)) for message_id, error in write_failures)
+                db.record_failed_messages(failures)
+                db.clear_failed_messages(written_ids)
+                db.conn.commit()
+    stats["elapsed_seconds"] = time.monotonic() - start_time
+    if multi_threads:
+        print_ingest_stats(stats)
+
+    # --- Fetch Single-Message Threads Through the Pipeline ---
+    single_stats = pipeline.run(single_ids) if single_ids else None
+    if single_stats:
+        print_ingest_stats(single_stats)
+
+    print_failed_summary(db)
+    if failed_labels or (single_stats and single_stats["feed_error"]):
+        return False
+    db.clear_ingest_checkpoints(scan_key)
+    return True
+
+
+def run_incremental_sync(gmail: GmailAPI, db: SQLiteDB, pipeline: IngestPipeline,
+                         changes: HistoryChanges, labels_to_process: List[str]) -> bool:
+    """
+    Applies the mailbox changes reported by the history API to the database.
+
+    New messages (and older messages that gained a selected label) are
+    ingested, deleted messages are removed, and relabeled messages have their
+    labels replaced.
+
+    Returns:
+        bool: True once the changes were applied; messages that failed to
+              fetch are queued in `failed_messages`. False if the deletions
+              could not be applied, so they are applied again next run.
+    """
+    print(f"\nApplying {len(changes['added'])} added, {len(changes['deleted'])} deleted, "
+          f"and {len(changes['label_updates'])} relabeled messages...")
+
+    # Messages carry label IDs, while the selected labels are names.
+    label_map = gmail.get_label_map()
+    selected_labels = set(labels_to_process)
+
+    def in_selected_labels(label_ids: List[str]) -> bool:
+        return any(label_map.get(label_id, label_id) in selected_labels for label_id in label_ids)
+
+    rows = db.query_db("SELECT message_id FROM emails")
+    existing_ids = {row[0] for row in rows} if rows else set()
+
+    # --- Deletions ---
+    # All in one transaction; if it fails, the checkpoint must not advance past them.
+    success = True
+    deleted_ids = [message_id for message_id in changes["deleted"] if message_id in existing_ids]
+    if deleted_ids:
+        removed = db.delete_emails(deleted_ids)
+        if removed is None:
+            success = False
+        else:
+            print(f"Removed {removed} deleted messages.")
+            existing_ids.difference_update(deleted_ids)
+    if success and gmail.raw_cache and changes["deleted"]:
+        # Otherwise a reparse from the cache would bring deleted messages back.
+        gmail.raw_cache.delete_many(changes["deleted"])
+
+    # --- Label Changes on Stored Messages ---
+    inserted, deleted = db.sync_message_labels({
+        message_id: label_ids for message_id, label_ids in changes["label_updates"].items()
+        if message_id in existing_ids
+    })
+    print(f"Label rows: {inserted} added, {deleted} removed.")
+
+    # --- New Messages ---
+    # Older messages that were relabeled into a selected label are ingested too.
+    candidates = {**changes["label_updates"], **changes["added"]}
+    ids_to_fetch = [
+        message_id for message_id, label_ids in candidates.items()
+        if message_id not in existing_ids and in_selected_labels(label_ids)
+    ]
+    if not ids_to_fetch:
+        print("No new messages to fetch.")
+        return success
+
+    print(f"Fetching {len(ids_to_fetch)} emails with {pipeline.fetch_workers} workers...")
+    stats = pipeline.run(ids_to_fetch)
+    print_ingest_stats(stats)
+    print_failed_summary(db)
+    # Failed messages are queued in failed_messages, so the checkpoint can still advance.
+    return success
+
+
+def run_label_refresh(gmail: GmailAPI, db: SQLiteDB, workers: int, batch_size: int) -> bool:
+    """
+    Refreshes the labels of every stored message without downloading bodies.
+
+    Label IDs are fetched in batches with a minimal partial response, using one
+    Gmail connection per worker thread. Only label rows that changed are
+    written, and the label flags of those messages are recomputed.
+
+    Returns:
+        bool: True if the labels of every stored message were fetched.
+    """
+    rows = db.query_db("SELECT message_id FROM emails")
+    message_ids = [row[0] for row in rows] if rows else []
+    print(f"\nRefreshing labels of {len(message_ids)} stored messages with {workers} workers...")
+
+    worker_state = threading.local()
+
+    def fetch_labels(chunk: List[str]):
+        # Each thread needs its own service object.
+        if not hasattr(worker_state, "gmail"):
+            worker_state.gmail = gmail.spawn()
+        try:
+            return worker_state.gmail.get_label_ids_by_message_ids(chunk, batch_size=batch_size)
+        except Exception as e:
+            # E.g. a dropped connection: count the chunk as failed rather than abort the refresh.
+            return {}, {message_id: ErrorDescription.from_exception(e) for message_id in chunk}
+
+    # The writes happen on this thread, which owns the database connection.
+    chunk_size = batch_size * 10
+    chunks = [message_ids[start:start + chunk_size] for start in range(0, len(message_ids), chunk_size)]
+    total_inserted = total_deleted = total_errors = 0
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for label_ids, errors in executor.map(fetch_labels, chunks):
+            inserted, deleted = db.sync_message_labels(label_ids)
+            total_inserted += inserted
+            total_deleted += deleted
+            total_errors += len(errors)
+            for message_id, error in errors.items():
+                print(f"  Failed to fetch labels for message ID {message_id}: {error}")
+
+    print(f"Label rows: {total_inserted} added, {total_deleted} removed; {total_errors} messages failed.")
+    return total_errors == 0
+
+
+def run_retry_failed(db: SQLiteDB, pipeline: IngestPipeline) -> bool:
+    """
+    Fetches the messages queued in `failed_messages` again.
+
+    Messages that succeed leave the queue; those that fail again have their
+    attempt count raised and are dropped from retries after MAX_FAILED_ATTEMPTS.
+
+    Returns:
+        bool: True if every retried message was stored.
+    """
+    message_ids = db.get_failed_message_ids(MAX_FAILED_ATTEMPTS)
+    if not message_ids:
+        print("\nNo failed messages to retry.")
+        return True
+
+    print(f"\nRetrying {len(message_ids)} failed messages with {pipeline.fetch_workers} workers...")
+    stats = pipeline.run(message_ids)
+    print_ingest_stats(stats)
+    print_failed_summary(db)
+    return stats["written"] == len(message_ids)
+
+
+def iter_parsed_cache_batches(raw_cache: RawMessageCache, blob_store: Optional[BlobStore] = None,
+                              parse_processes: int = 0, keep_raw: bool = False) -> Iterator[Tuple[List[ExtractedEmailData], List[Failure]]]:
+    """
+    Parses every cached message, batch by batch.
+
+    Args:
+        raw_cache (RawMessageCache): The cache to read.
+        blob_store (Optional[BlobStore]): If given, attachment bodies are saved to it.
+        parse_processes (int): If above 0, batches are parsed in this many worker processes.
+        keep_raw (bool): If True, the compressed source is kept for the 'email_raw' table.
+
+    Yields:
+        Tuple[List[ExtractedEmailData], List[Failure]]: The parsed messages of a batch and
+            the (message ID, stage, error class, error message) of those that failed.
+    """
+    if not parse_processes:
+        for batch in raw_cache.iter_messages():
+            parsed, failures = [], []
+            for raw_message in batch:
+                try:
+                    parsed.append(parse_raw_api_message(raw_message, blob_store, keep_raw))
+                except Exception as e:
+                    failures.append((raw_message.get("id"), "parse", type(e).__name__, str(e)))
+            yield parsed, failures
+        return
+
+    def batch_result(message_ids: List[str], future) -> Tuple[List[ExtractedEmailData], List[Failure]]:
+        # An unexpected error fails only its own batch; the reparse goes on.
+        try:
+            return future.result()
+        except Exception as e:
+            return [], [(message_id, "parse", type(e).__name__, str(e)) for message_id in message_ids]
+
+    parser = ProcessParser(parse_processes, blob_store, keep_raw)
+    try:
+        with ThreadPoolExecutor(max_workers=parse_processes) as executor:
+            # Keep a couple of batches per worker in flight, so workers stay busy
+            # without the whole cache being read into memory.
+            in_flight = collections.deque()
+            for batch in raw_cache.iter_messages():
+                message_ids = [raw_message.get("id") for raw_message in batch]
+                in_flight.append((message_ids, executor.submit(parser.parse_chunk, batch)))
+                if len(in_flight) >= parse_processes * 2:
+                    yield batch_result(*in_flight.popleft())
+            while in_flight:
+                yield batch_result(*in_flight.popleft())
+    finally:
+        parser.close()
+
+
+def run_reparse_from_cache(db: SQLiteDB, raw_cache: RawMessageCache, blob_store: Optional[BlobStore] = None,
+                           parse_processes: int = 0, keep_raw: bool = False,
+                           write_batch_size: int = WRITE_BATCH_SIZE) -> bool:
+    """
+    Rebuilds the stored messages from the raw cache, without any API calls.
+
+    Every cached message is parsed again and replaces its database row, so
+    parser and schema changes can be applied at disk speed.
+
+    Args:
+        db (SQLiteDB): The open database.
+        raw_cache (RawMessageCache): The cache to read.
+        blob_store (Optional[BlobStore]): If given, attachment bodies are saved to it.
+        parse_processes (int): If above 0, messages are parsed in this many worker processes.
+        keep_raw (bool): If True, the compressed source of each message is stored in 'email_raw'.
+        write_batch_size (int): The number of messages committed per transaction.
+
+    Returns:
+        bool: True if every cached message was parsed and stored.
+    """
+    print(f"\nReparsing {raw_cache.count()} cached messages...")
+    stats: IngestStats = {
+        "fetched": 0, "fetch_errors": 0, "parse_errors": 0,
+        "written": 0, "write_errors": 0, "elapsed_seconds": 0.0, "feed_error": None,
+    }
+    start_time = time.monotonic()
+    pending: List[ExtractedEmailData] = []
+    for parsed, failures in iter_parsed_cache_batches(raw_cache, blob_store, parse_processes, keep_raw):
+        stats["fetched"] += len(parsed) + len(failures)
+        for message_id, _, _, error in failures:
+            print(f"  Failed to parse message ID {message_id}: {error}")
+        stats["parse_errors"] += len(failures)
+        pending.extend(parsed)
+        if len(pending) >= write_batch_size:
+            written_ids, write_failures = db.insert_messages(pending, update_if_exists=True, batch_size=write_batch_size)
+            stats["written"] += len(written_ids)
+            stats["write_errors"] += len(write_failures)
+            for message_id, error in write_failures:
+                print(f"  Failed to write message ID {message_id}: {error}")
+            pending = []
+    written_ids, write_failures = db.insert_messages(pending, update_if_exists=True, batch_size=write_batch_size)
+    stats["written"] += len(written_ids)
+    stats["write_errors"] += len(write_failures)
+    for message_id, error in write_failures:
+        print(f"  Failed to write message ID {message_id}: {error}")
+
+    stats["elapsed_seconds"] = time.monotonic() - start_time
+    print_ingest_stats(stats)
+    return not (stats["parse_errors"] or stats["write_errors"])
+
+
+def select_labels(gmail: GmailAPI, label: Optional[List[str]]) -> Optional[List[str]]:
+    """
+    Determines which labels to process.
+
+    Args:
+        gmail (GmailAPI): A connected client.
+        label (Optional[List[str]]): The labels requested by the user, or None for all labels.
+
+    Returns:
+        Optional[List[str]]: The label names to process, or None if there are none.
+    """
+    print("Fetching all available labels from Gmail...")
+    all_available_labels = gmail.list_tags()
+    if not all_available_labels:
+        print("Could not retrieve any labels from Gmail. Exiting.")
+        return None
+
+    # Exclude special "Delete_Status" labels from processing.
+    filtered_labels = [l for l in all_available_labels if "Delete_Status" not in l]
+
+    labels_to_process = []
+    if label:
+        # If user provides specific labels, validate them.
+        valid_user_labels = []
+        invalid_user_labels = []
+        for l in label:
+            if l in filtered_labels:
+                valid_user_labels.append(l)
+            else:
+                invalid_user_labels.append(l)
+        
+        if invalid_user_labels:
+            print(f"Warning: The following requested labels do not exist or were excluded: {', '.join(invalid_user_labels)}")
+        
+        if not valid_user_labels:
+            print("None of the requested labels are available for processing. Exiting.")
+            return None
+        labels_to_process = valid_user_labels
+    else:
+        # If no labels are specified, process all available (and non-excluded) labels.
+        labels_to_process = filtered_labels
+    
+    print(f"\nLabels to be processed: {', '.join(labels_to_process)}")
+    return labels_to_process
+
+
+def sync_mailbox(gmail: GmailAPI, db: SQLiteDB, pipeline: IngestPipeline, labels_to_process: List[str],
+                 labels_selected: bool, update: bool, full_scan: bool, by_thread: bool) -> bool:
+    """
+    Brings the database up to date with the mailbox and saves the sync checkpoint.
+
+    An incremental sync from the stored historyId is used when possible;
+    otherwise (or when asked) every message of the selected labels is listed.
+
+    Args:
+        labels_selected (bool): True if the user chose the labels, so the checkpoint
+            only covers that selection.
+
+    Returns:
+        bool: True if the sync completed; failed messages are queued separately.
+    """
+    # --- Choose Between an Incremental Sync and a Full Scan ---
+    # Checkpoints are kept per label selection, since a sync only covers those labels.
+    checkpoint_key = "history_id" if not labels_selected else "history_id:" + ",".join(sorted(labels_to_process))
+    scan_start_key = "scan_start:" + checkpoint_key
+    resuming_scan = bool(db.get_ingest_checkpoints(checkpoint_key))
+    changes = None
+    if resuming_scan:
+        print("\nResuming an interrupted full scan.")
+    elif not (update or full_scan):
+        stored_history_id = db.get_sync_state(checkpoint_key)
+        if stored_history_id:
+            print(f"\nFetching mailbox changes since history ID {stored_history_id}...")
+            changes = gmail.get_history_changes(stored_history_id)
+            if changes is None:
+                print("Falling back to a full scan.")
+
+    # --- Process Messages ---
+    if changes is not None:
+        new_history_id = changes["history_id"]
+        success = run_incremental_sync(gmail, db, pipeline, changes, labels_to_process)
+    else:
+        # Record the historyId before listing so changes made during the scan are picked up next run.
+        # A resumed scan keeps the historyId from when it first started.
+        new_history_id = db.get_sync_state(scan_start_key) if resuming_scan else None
+        if not new_history_id:
+            profile = gmail.get_profile()
+            new_history_id = profile.get("historyId") if profile else None
+            if new_history_id:
+                db.set_sync_state(scan_start_key, str(new_history_id))
+        if by_thread:
+            success = run_thread_scan(gmail, db, pipeline, labels_to_process, update, checkpoint_key)
+        else:
+            success = run_full_scan(gmail, db, pipeline, labels_to_process, update, checkpoint_key)
+        if success:
+            db.delete_sync_state(scan_start_key)
+
+    # --- Save the Sync Checkpoint ---
+    if not success:
+        print("\nSome labels could not be listed or deletions applied; the sync checkpoint was not advanced.")
+        return False
+    if new_history_id:
+        db.set_sync_state(checkpoint_key, str(new_history_id))
+        print(f"\nSaved sync checkpoint at history ID {new_history_id}.")
+    return True
+
+
+def sync_account(account: AccountConfig, options: Dict[str, Any]) -> AccountSyncResult:
+    """
+    Syncs one account of a multi-account manifest into its own database.
+
+    Runs in a worker process; its output goes to a sync.log file next to the
+    account's database so accounts do not interleave on the console.
+
+    Args:
+        account (AccountConfig): The account to sync.
+        options (Dict[str, Any]): The sync options given on the command line.
+
+    Returns:
+        AccountSyncResult: The outcome and throughput of the sync.
+    """
+    db_path = account_db_path(account, options["db_directory"])
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    result: AccountSyncResult = {
+        "account": account["name"], "db_path": db_path, "success": False, "messages_added": 0,
+        "api_requests": 0, "quota_units": 0, "elapsed_seconds": 0.0, "error": None,
+    }
+    start_time = time.monotonic()
+
+    log_path = os.path.join(os.path.dirname(os.path.abspath(db_path)), "sync.log")
+    with open(log_path, "a", encoding="utf-8") as log, contextlib.redirect_stdout(log):
+        raw_cache = RawMessageCache(
+            os.path.join(options["cache_dir"], account["name"]), max_bytes=options["cache_size_mb"] * 1024 ** 2
+        ) if options["cache_dir"] else None
+        blob_store = BlobStore(
+            options["attachments_dir"], max_blob_bytes=options["max_attachment_mb"] * 1024 ** 2,
+            max_concurrent_writes=options["attachment_writers"]
+        ) if options["attachments_dir"] else None
+        service = None
+        if options["fake_gmail"]:
+            service = FakeGmailService.synthetic(int(options["fake_gmail"]), latency=options["fake_latency"])
+        gmail = GmailAPI(token_file=account["token_file"], service=service, raw_cache=raw_cache)
+        db = SQLiteDB(db_path, profile=options["db_profile"])
+        try:
+            print(f"\n=== Syncing account '{account['name']}' ===")
+            gmail.connect()
+            db.open_db()
+            count_before = db.query_db("SELECT COUNT(*) FROM emails")[0][0]
+
+            label = account.get("labels") or options["label"]
+            labels_to_process = select_labels(gmail, label)
+            if not labels_to_process:
+                result["error"] = "No labels to process."
+                return result
+
+            pipeline = IngestPipeline(
+                gmail, db,
+                fetch_workers=options["workers"],
+                parse_workers=options["parse_workers"],
+                parse_processes=options["parse_processes"],
+                keep_raw=options["keep_raw"],
+                queue_depth=options["queue_depth"],
+                batch_size=options["batch_size"],
+                write_batch_size=options["write_batch_size"],
+                update_if_exists=options["update"],
+                blob_store=blob_store,
+            )
+            result["success"] = sync_mailbox(
+                gmail, db, pipeline, labels_to_process, bool(label),
+                options["update"], options["full_scan"], options["by_thread"]
+            )
+            result["messages_added"] = db.query_db("SELECT COUNT(*) FROM emails")[0][0] - count_before
+            if not result["success"]:
+                result["error"] = f"Some labels could not be listed or deletions applied; see {log_path}."
+        except Exception as e:
+            print(f"An unexpected error occurred: {e}")
+            result["error"] = str(e)
+        finally:
+            limiter_stats = gmail.rate_limiter.stats()
+            result["api_requests"] = limiter_stats["requests"]
+            result["quota_units"] = limiter_stats["units"]
+            result["elapsed_seconds"] = time.monotonic() - start_time
+            db.close_db()
+            if raw_cache:
+                raw_cache.close()
+            gmail.disconnect()
+    return result
+
+
 @app.command()
 def main(
     update: bool = typer.Option(False, "--update", "-u", help="Update existing messages in the database. Default is to only insert new messages."),
     label: Optional[List[str]] = typer.Option(None, "--label", "-l", help="Specify one or more labels to process. If not provided, all labels will be processed."),
-    db_directory: str = typer.Option(DATABASE_PATH, "--db-directory", "-d", help="The directory where the mail_database.db file will be stored.")
+    db_directory: str = typer.Option(DATABASE_PATH, "--db-directory", "-d", help="The directory where the mail_database.db file will be stored."),
+    batch_size: int = typer.Option(MAX_BATCH_REQUESTS, "--batch-size", "-b", help="Number of messages to fetch per Gmail batch request."),
+    workers: int = typer.Option(DEFAULT_FETCH_WORKERS, "--workers", "-w", help="Number of concurrent fetch workers, each with its own Gmail connection."),
+    parse_workers: int = typer.Option(DEFAULT_PARSE_WORKERS, "--parse-workers", help="Number of workers parsing fetched messages."),
+    parse_processes: int = typer.Option(DEFAULT_PARSE_PROCESSES, "--parse-processes", help="Parse messages in this many worker processes to use several CPU cores (0 parses in threads)."),
+    queue_depth: int = typer.Option(DEFAULT_QUEUE_DEPTH, "--queue-depth", "-q", help="Number of batches each pipeline queue may hold before upstream stages wait."),
+    write_batch_size: int = typer.Option(WRITE_BATCH_SIZE, "--write-batch-size", help="Number of messages written to SQLite per transaction."),
+    db_profile: str = typer.Option(DB_PROFILE, "--db-profile", help="SQLite PRAGMA profile: 'default' or 'ingest' (WAL, synchronous=NORMAL, large cache)."),
+    full_scan: bool = typer.Option(False, "--full-scan", help="List every message instead of applying changes since the last successful run."),
+    labels_only: bool = typer.Option(False, "--labels-only", help="Only refresh the labels of stored messages, without downloading bodies."),
+    fake_gmail: Optional[str] = typer.Option(None, "--fake-gmail", help="Run offline against a fixture directory, or a number of synthetic messages, instead of Gmail."),
+    fake_latency: float = typer.Option(0.0, "--fake-latency", help="Seconds of simulated latency per request when using --fake-gmail."),
+    cache_dir: str = typer.Option(RAW_CACHE_DIR, "--cache-dir", help="Keep a local cache of raw messages under this directory, so the database can be rebuilt without downloading again."),
+    cache_size_mb: int = typer.Option(RAW_CACHE_MAX_MB, "--cache-size-mb", help="Maximum size of the raw message cache in megabytes."),
+    reparse_from_cache: bool = typer.Option(False, "--reparse-from-cache", help="Rebuild the stored messages from the raw cache without contacting Gmail."),
+    attachments_dir: str = typer.Option(ATTACHMENTS_DIR, "--attachments-dir", help="Save attachment bodies, deduplicated by SHA-256, under this directory."),
+    max_attachment_mb: int = typer.Option(MAX_ATTACHMENT_MB, "--max-attachment-mb", help="Attachments larger than this many megabytes are not saved."),
+    attachment_writers: int = typer.Option(DEFAULT_MAX_CONCURRENT_WRITES, "--attachment-writers", help="Number of attachment bodies written to disk at the same time."),
+    keep_raw: bool = typer.Option(KEEP_RAW_SOURCE, "--keep-raw/--no-keep-raw", help="Store the compressed original source of every message in the 'email_raw' table."),
+    retry_failed: bool = typer.Option(False, "--retry-failed", help="Only fetch the messages that failed in earlier runs again."),
+    by_thread: bool = typer.Option(False, "--by-thread", help="On a full scan, fetch whole threads with one call each instead of message by message."),
+    accounts: Optional[str] = typer.Option(None, "--accounts", help="Sync every account in this JSON manifest, one worker process each."),
+    shared_db: bool = typer.Option(False, "--shared-db", help="With --accounts, also merge all accounts into one database with an 'account' column."),
+    account_processes: int = typer.Option(4, "--account-processes", help="With --accounts, the number of accounts synced at the same time."),
+    logout: bool = typer.Option(False, "--logout", help="Remove the stored Gmail token and exit; the next run will ask for authorization again.")
 ):
     """
     Connects to Gmail, fetches emails by label, and inserts them into a SQLite database.
@@ -30,104 +821,123 @@ def main(
     # Construct the full path to the database file.
     db_path = os.path.join(db_directory, "mail_database.db")
     
+    if logout:
+        if GmailAPI().logout():
+            print("Removed the stored Gmail token.")
+        else:
+            print("No stored Gmail token to remove.")
+        return
+
+    # Syncing writes to the database, so read-only profiles cannot be used here.
+    if db_profile not in PRAGMA_PROFILES or db_profile in READ_ONLY_PROFILES:
+        writable_profiles = [name for name in PRAGMA_PROFILES if name not in READ_ONLY_PROFILES]
+        print(f"Unknown or read-only database profile '{db_profile}'; use one of {', '.join(writable_profiles)}.")
+        return
+
+    if accounts:
+        options = {
+            "db_directory": db_directory, "label": label, "update": update, "full_scan": full_scan,
+            "by_thread": by_thread, "workers": workers, "parse_workers": parse_workers,
+            "parse_processes": parse_processes, "keep_raw": keep_raw, "write_batch_size": write_batch_size,
+            "db_profile": db_profile,
+            "queue_depth": queue_depth, "batch_size": batch_size, "cache_dir": cache_dir,
+            "cache_size_mb": cache_size_mb, "attachments_dir": attachments_dir,
+            "max_attachment_mb": max_attachment_mb, "attachment_writers": attachment_writers,
+            "fake_gmail": fake_gmail if fake_gmail and fake_gmail.isdigit() else None,
+            "fake_latency": fake_latency,
+        }
+        run_accounts(
+            load_manifest(accounts), sync_account, options, account_processes,
+            shared_db_path=db_path if shared_db else "", authorize=not options["fake_gmail"]
+        )
+        return
+
     # Instantiate the API and database handler classes.
-    gmail = GmailAPI()
-    db = SQLiteDB(db_path)
+    raw_cache = RawMessageCache(cache_dir, max_bytes=cache_size_mb * 1024 ** 2) if cache_dir else None
+    blob_store = BlobStore(
+        attachments_dir, max_blob_bytes=max_attachment_mb * 1024 ** 2, max_concurrent_writes=attachment_writers
+    ) if attachments_dir else None
+    if fake_gmail:
+        if fake_gmail.isdigit():
+            service = FakeGmailService.synthetic(int(fake_gmail), latency=fake_latency)
+        else:
+            service = FakeGmailService.from_directory(fake_gmail, latency=fake_latency)
+        gmail = GmailAPI(service=service, raw_cache=raw_cache)
+    else:
+        gmail = GmailAPI(raw_cache=raw_cache)
+
+    db = SQLiteDB(db_path, profile=db_profile)
 
     try:
+        if reparse_from_cache:
+            if not raw_cache:
+                print("--reparse-from-cache needs a cache directory. Exiting.")
+                return
+            print("Opening database connection...")
+            db.open_db()
+            run_reparse_from_cache(db, raw_cache, blob_store, parse_processes, keep_raw, write_batch_size)
+            if blob_store:
+                blob_store.print_stats()
+            return
+
         # --- 1. Connect to Services ---
         print("Connecting to Gmail API...")
+        connect_start = time.monotonic()
         gmail.connect()
+        print(f"Connected in {(time.monotonic() - connect_start) * 1000:.0f} ms.")
         print("Opening database connection...")
         db.open_db()
 
         # --- 2. Determine Labels to Process ---
-        print("Fetching all available labels from Gmail...")
-        all_available_labels = gmail.list_tags()
-        if not all_available_labels:
-            print("Could not retrieve any labels from Gmail. Exiting.")
+        labels_to_process = select_labels(gmail, label)
+        if not labels_to_process:
             return
 
-        # Exclude special "Delete_Status" labels from processing.
-        filtered_labels = [l for l in all_available_labels if "Delete_Status" not in l]
-
-        labels_to_process = []
-        if label:
-            # If user provides specific labels, validate them.
-            valid_user_labels = []
-            invalid_user_labels = []
-            for l in label:
-                if l in filtered_labels:
-                    valid_user_labels.append(l)
-                else:
-                    invalid_user_labels.append(l)
-            
-            if invalid_user_labels:
-                print(f"Warning: The following requested labels do not exist or were excluded: {', '.join(invalid_user_labels)}")
-            
-            if not valid_user_labels:
-                print("None of the requested labels are available for processing. Exiting.")
-                return
-            labels_to_process = valid_user_labels
-        else:
-            # If no labels are specified, process all available (and non-excluded) labels.
-            labels_to_process = filtered_labels
-        
-        print(f"\nLabels to be processed: {', '.join(labels_to_process)}")
-
-        # --- 3. Fetch Existing Message IDs for Idempotency ---
-        # To avoid re-inserting emails, get all existing IDs from the DB first.
-        existing_ids = set()
-        if not update:
-            print("\nFetching existing message IDs from the database for comparison...")
-            rows = db.query_db("SELECT message_id FROM emails")
-            if rows:
-                existing_ids = {row[0] for row in rows}
-            print(f"Found {len(existing_ids)} existing messages to skip.")
-
-        # --- 4. Iterate Through Labels and Process Messages ---
-        for lbl in labels_to_process:
-            print(f"\n--- Processing Label: {lbl} ---")
-            query = f"in:{lbl}"
-            
-            # Get all message IDs for the current label from the Gmail API.
-            message_infos = gmail.get_message_ids_and_thread_ids_by_query(query)
-            if not message_infos:
-                print("No messages found for this label.")
-                continue
-            
-            print(f"Found {len(message_infos)} total messages for this label. Comparing with database...")
-            new_messages_found = 0
-            
-            # Iterate through each message ID found.
-            for message_info in message_infos:
-                message_id = message_info['id']
-                
-                # Skip this message if it's already in the database and we're not in update mode.
-                if not update and message_id in existing_ids:
-                    continue
-                
-                # Fetch the full email data from the Gmail API.
-                print(f"  Fetching full email for message ID: {message_id}")
-                email_data = gmail.get_email_by_message_id(message_id)
-                
-                # Insert or update the message in the SQLite database.
-                if email_data:
-                    db.insert_message(email_data, update_if_exists=update)
-                    new_messages_found += 1
-
-            print(f"--- Finished for label: {lbl}. Processed {new_messages_found} new/updated emails. ---")
+        if labels_only:
+            run_label_refresh(gmail, db, workers, batch_size)
+            gmail.rate_limiter.print_stats()
+            return
+
+        pipeline = IngestPipeline(
+            gmail, db,
+            fetch_workers=workers,
+            parse_workers=parse_workers,
+            parse_processes=parse_processes,
+            keep_raw=keep_raw,
+            queue_depth=queue_depth,
+            batch_size=batch_size,
+            write_batch_size=write_batch_size,
+            # Retried messages may have been stored since they failed, so they are replaced.
+            update_if_exists=update or retry_failed,
+            blob_store=blob_store,
+        )
+
+        if retry_failed:
+            run_retry_failed(db, pipeline)
+            gmail.rate_limiter.print_stats()
+            return
+
+        # --- 3. Sync Messages and Save the Sync Checkpoint ---
+        sync_mailbox(gmail, db, pipeline, labels_to_process, bool(label), update, full_scan, by_thread)
+
+        # Report throttling so concurrency can be tuned to sit just under the quota.
+        gmail.rate_limiter.print_stats()
+        if blob_store:
+            blob_store.print_stats()
 
     except Exception as e:
         # Catch any unexpected errors during the main process.
         print(f"An unexpected error occurred: {e}")
     finally:
-        # --- 5. Clean Up ---
+        # --- 4. Clean Up ---
         # Ensure connections are closed properly.
         print("\nClosing database connection.")
         db.close_db()
-        print("Disconnecting from Gmail API.")
-        gmail.disconnect()
+        if raw_cache:
+            raw_cache.close()
+        if not reparse_from_cache:
+            print("Disconnecting from Gmail API.")
+            gmail.disconnect()
 
 if __name__ == "__main__":
     # Run the Typer application.
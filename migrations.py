@@ -0,0 +1,352 @@
+"""
+This module upgrades the schema of existing SQLite databases, step by step.
+
+The schema version is kept in `PRAGMA user_version`. `SQLiteDB.create_tables`
+creates new databases directly at the latest version; older databases are
+brought up to date by `migrate`, which applies every step above their version
+in order. Each step runs in one transaction together with the version bump, so
+a failed step leaves the database at the previous version and is retried on
+the next open.
+
+Steps that rebuild large tables cannot run in a single transaction without
+locking the database for minutes and keeping both copies on disk until the
+commit. Those steps use `rebuild_table_in_chunks`, which moves rows to the new
+table a chunk per transaction, deleting them from the old one as it goes, so
+the pages they free are reused by the copy. An interrupted rebuild resumes
+where it stopped.
+"""
+import datetime
+import re
+import sqlite3
+from typing import Callable, List, Tuple
+
+# Rows moved per transaction by `rebuild_table_in_chunks`.
+REBUILD_CHUNK_ROWS = 20000
+
+# Suffix of the table a rebuild copies rows into.
+_REBUILD_SUFFIX = "_rebuild"
+
+# Messages added to the full-text index per transaction when indexing an existing database.
+SEARCH_BACKFILL_CHUNK_ROWS = 5000
+
+# The sync_state key holding the last emails rowid indexed by an unfinished backfill.
+_SEARCH_BACKFILL_KEY = "search_index_backfill_rowid"
+
+# The table name of a "CREATE TABLE [IF NOT EXISTS] name (" statement.
+_CREATE_TABLE_NAME = re.compile(r'^\s*CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?["`\[]?\w+["`\]]?', re.IGNORECASE)
+
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    """Returns the schema version stored in the database header."""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def set_schema_version(conn: sqlite3.Connection, version: int):
+    """Stores the schema version; inside a transaction, it is only kept if the transaction commits."""
+    conn.execute(f"PRAGMA user_version = {int(version)}")
+
+
+def add_column_if_missing(conn: sqlite3.Connection, table: str, column: str, definition: str):
+    """
+    Adds a column to an existing table unless it is already there.
+
+    `CREATE TABLE IF NOT EXISTS` leaves tables of older databases unchanged,
+    so new columns are added separately.
+
+    Args:
+        conn (sqlite3.Connection): The connection to execute on.
+        table (str): The table name.
+        column (str): The column name.
+        definition (str): The column type and constraints.
+    """
+    columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+    if column not in columns:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+def rebuild_table_in_chunks(conn: sqlite3.Connection, table: str, create_sql: str,
+                            chunk_rows: int = REBUILD_CHUNK_ROWS):
+    """
+    Rebuilds a table with a new definition, moving its rows a chunk at a time.
+
+    Rows are copied in rowid order, keeping their rowids, into a new table,
+    and deleted from the old one in the same transaction. Columns the tables
+    share are copied. When the old table is empty it is dropped and the new
+    one takes its name. Indexes of the old table are dropped with it, so the
+    caller creates them again. If a rebuild was interrupted, calling this
+    again continues it.
+
+    Args:
+        conn (sqlite3.Connection): A connection with no open transaction.
+        table (str): The table to rebuild.
+        create_sql (str): A CREATE TABLE statement for the new table; its table
+                          name is replaced by the name of the temporary copy.
+        chunk_rows (int): The number of rows moved per transaction.
+    """
+    new_table = table + _REBUILD_SUFFIX
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (new_table,)).fetchone():
+        conn.execute(_CREATE_TABLE_NAME.sub(f"CREATE TABLE {new_table}", create_sql, count=1))
+        conn.commit()
+
+    old_info = conn.execute(f"PRAGMA table_info({table})").fetchall()
+    new_columns = {row[1] for row in conn.execute(f"PRAGMA table_info({new_table})")}
+    columns = [row[1] for row in old_info if row[1] in new_columns]
+    # Keep row IDs; an INTEGER PRIMARY KEY column already is the rowid.
+    primary_key = [row for row in old_info if row[5]]
+    if not (len(primary_key) == 1 and primary_key[0][2].upper() == "INTEGER"):
+        columns.insert(0, "rowid")
+    column_list = ", ".join(columns)
+
+    while True:
+        conn.execute("BEGIN")
+        bound = conn.execute(
+            f"SELECT rowid FROM {table} ORDER BY rowid LIMIT 1 OFFSET ?", (max(1, chunk_rows) - 1,)
+        ).fetchone()
+        if bound:
+            conn.execute(f"INSERT INTO {new_table} ({column_list}) SELECT {column_list} FROM {table} WHERE rowid <= ?", bound)
+            conn.execute(f"DELETE FROM {table} WHERE rowid <= ?", bound)
+            conn.commit()
+            continue
+        # Fewer than a chunk left: move the rest and swap the tables in the same transaction.
+        conn.execute(f"INSERT INTO {new_table} ({column_list}) SELECT {column_list} FROM {table}")
+        conn.execute(f"DROP TABLE {table}")
+        conn.execute(f"ALTER TABLE {new_table} RENAME TO {table}")
+        conn.commit()
+        return
+
+
+def create_search_index(conn: sqlite3.Connection, tokenizer: str) -> bool:
+    """
+    Creates the full-text index of emails and the triggers that keep it in sync.
+
+    `emails_fts` is an external-content FTS5 table over subject, sender_email,
+    and body_text: it stores only the index and reads the text from `emails`,
+    matched on rowid. The rowid of `emails` is its INTEGER PRIMARY KEY doc_id,
+    which VACUUM keeps, so the index stays valid. Triggers update it on every
+    insert, update, and delete, so the insert path needs no changes.
+
+    Args:
+        conn (sqlite3.Connection): The connection to execute on.
+        tokenizer (str): The FTS5 tokenizer used if the index does not exist yet.
+                         'trigram' falls back to 'unicode61' on SQLite before 3.34.
+
+    Returns:
+        bool: True if the index exists, False if SQLite was built without FTS5.
+    """
+    try:
+        conn.execute(f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS emails_fts USING fts5(
+                subject, sender_email, body_text,
+                content='emails', content_rowid='rowid', tokenize='{tokenizer}'
+            )""")
+    except sqlite3.OperationalError as e:
+        if "no such tokenizer" in str(e) and tokenizer != "unicode61":
+            print(f"SQLite has no '{tokenizer}' tokenizer; the search index matches whole words instead.")
+            return create_search_index(conn, "unicode61")
+        if "no such module" in str(e):
+            print("SQLite was built without FTS5; searches scan the emails table instead.")
+            return False
+        raise
+    create_search_triggers(conn)
+    return True
+
+
+def create_search_triggers(conn: sqlite3.Connection):
+    """Creates the triggers that keep `emails_fts` in sync with `emails`, unless they exist."""
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS emails_fts_insert AFTER INSERT ON emails BEGIN
+            INSERT INTO emails_fts (rowid, subject, sender_email, body_text)
+            VALUES (new.rowid, new.subject, new.sender_email, new.body_text);
+        END""")
+    # Removing an entry needs the values it was indexed with, i.e. the old row.
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS emails_fts_delete AFTER DELETE ON emails BEGIN
+            INSERT INTO emails_fts (emails_fts, rowid, subject, sender_email, body_text)
+            VALUES ('delete', old.rowid, old.subject, old.sender_email, old.body_text);
+        END""")
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS emails_fts_update AFTER UPDATE OF subject, sender_email, body_text ON emails BEGIN
+            INSERT INTO emails_fts (emails_fts, rowid, subject, sender_email, body_text)
+            VALUES ('delete', old.rowid, old.subject, old.sender_email, old.body_text);
+            INSERT INTO emails_fts (rowid, subject, sender_email, body_text)
+            VALUES (new.rowid, new.subject, new.sender_email, new.body_text);
+        END""")
+
+
+def _add_late_columns(conn: sqlite3.Connection):
+    """Version 1: adds the columns introduced after the tables were first released."""
+    for table, column, definition in [
+        ("email_address", "is_medical", "INTEGER"),
+        ("email_address", "is_financial", "INTEGER"),
+        ("emails", "is_labeled_spam", "INTEGER DEFAULT 0"),
+        ("emails", "is_labeled_promotions", "INTEGER DEFAULT 0"),
+        ("emails", "is_labeled_social", "INTEGER DEFAULT 0"),
+        ("emails", "is_labeled_forums", "INTEGER DEFAULT 0"),
+        ("emails", "is_labeled_personal", "INTEGER DEFAULT 0"),
+        # The mailbox a message belongs to, in a database shared by several accounts.
+        ("emails", "account", "TEXT"),
+        ("email_attachments", "content_sha256", "TEXT"),
+        ("email_attachments", "blob_path", "TEXT"),
+        # The parsed hosts and timestamp of each 'Received' hop.
+        ("email_routing_headers", "from_host", "TEXT"),
+        ("email_routing_headers", "by_host", "TEXT"),
+        ("email_routing_headers", "received_at", "INTEGER"),
+    ]:
+        add_column_if_missing(conn, table, column, definition)
+
+
+def _drop_child_autoincrement(conn: sqlite3.Connection):
+    """
+    Version 2: rebuilds the per-message tables without AUTOINCREMENT.
+
+    AUTOINCREMENT makes every insert also update `sqlite_sequence`; nothing
+    refers to these row IDs, so plain INTEGER PRIMARY KEY row IDs suffice.
+    """
+    for table in ("email_attachments", "email_xheaders", "email_labels",
+                  "email_routing_headers", "email_authentication"):
+        row = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()
+        if row and "AUTOINCREMENT" in row[0].upper():
+            create_sql = re.sub(r'\s+AUTOINCREMENT\b', '', row[0], flags=re.IGNORECASE)
+            rebuild_table_in_chunks(conn, table, create_sql)
+
+
+def _index_existing_messages(conn: sqlite3.Connection):
+    """
+    Version 3: adds the messages stored before the full-text index existed to it.
+
+    The index and its triggers are created by `create_tables` before migrating.
+    Messages are indexed in rowid order, a chunk per transaction, and the last
+    indexed rowid is saved in `sync_state` with each chunk, so an interrupted
+    backfill resumes without indexing a message twice.
+    """
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'emails_fts'").fetchone():
+        return
+    row = conn.execute("SELECT state_value FROM sync_state WHERE state_key = ?", (_SEARCH_BACKFILL_KEY,)).fetchone()
+    last_rowid = int(row[0]) if row else 0
+    while True:
+        conn.execute("BEGIN")
+        bound = conn.execute(
+            "SELECT MAX(rowid) FROM (SELECT rowid FROM emails WHERE rowid > ? ORDER BY rowid LIMIT ?)",
+            (last_rowid, SEARCH_BACKFILL_CHUNK_ROWS)
+        ).fetchone()[0]
+        if bound is None:
+            conn.execute("DELETE FROM sync_state WHERE state_key = ?", (_SEARCH_BACKFILL_KEY,))
+            conn.commit()
+            return
+        conn.execute("""
+            INSERT INTO emails_fts (rowid, subject, sender_email, body_text)
+            SELECT rowid, subject, sender_email, body_text FROM emails WHERE rowid > ? AND rowid <= ?
+        """, (last_rowid, bound))
+        conn.execute(
+            "INSERT OR REPLACE INTO sync_state (state_key, state_value, updated_at) VALUES (?, ?, ?)",
+            (_SEARCH_BACKFILL_KEY, str(bound), datetime.datetime.now(datetime.timezone.utc).isoformat())
+        )
+        conn.commit()
+        last_rowid = bound
+
+
+def _key_scan_checkpoints(conn: sqlite3.Connection):
+    """
+    Version 4: keys the full-scan checkpoints by label selection.
+
+    Checkpoints used to be shared by every selection, so a scan of other labels
+    would resume from them. Existing checkpoints cannot be assigned to a
+    selection and are dropped; an interrupted scan starts over.
+    """
+    conn.execute("DROP TABLE IF EXISTS ingest_checkpoints")
+    conn.execute("""
+        CREATE TABLE ingest_checkpoints (
+            scan_key TEXT NOT NULL,
+            label TEXT NOT NULL,
+            page_token TEXT,
+            last_message_id TEXT,
+            completed INTEGER DEFAULT 0,
+            updated_at TEXT,
+            PRIMARY KEY (scan_key, label)
+        )""")
+
+
+def _add_emails_doc_id(conn: sqlite3.Connection):
+    """
+    Version 5: gives emails a stable INTEGER PRIMARY KEY, doc_id, for the search index.
+
+    The search index refers to emails by rowid. Without an INTEGER PRIMARY KEY,
+    VACUUM may renumber the rowids and silently break the index; an INTEGER
+    PRIMARY KEY is the rowid and is kept. message_id becomes a UNIQUE key, so
+    the foreign keys of the per-message tables still refer to it.
+
+    Rows keep their rowids as doc_id, so the index stays valid. Its triggers
+    are dropped during the rebuild, which would otherwise remove every moved
+    row from the index, and foreign keys are off, so moving a row does not
+    cascade to its related rows.
+    """
+    row = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'emails'").fetchone()
+    rebuilding = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", ("emails" + _REBUILD_SUFFIX,)
+    ).fetchone()
+    if not row or (re.search(r'\bdoc_id\b', row[0]) and not rebuilding):
+        return
+    create_sql = re.sub(
+        r'\bmessage_id\s+TEXT\s+PRIMARY\s+KEY\b', "doc_id INTEGER PRIMARY KEY,\n            message_id TEXT NOT NULL UNIQUE",
+        row[0], count=1, flags=re.IGNORECASE
+    )
+
+    for trigger in ("emails_fts_insert", "emails_fts_delete", "emails_fts_update"):
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    conn.commit()
+    foreign_keys = conn.execute("PRAGMA foreign_keys").fetchone()[0]
+    conn.execute("PRAGMA foreign_keys = OFF")
+    try:
+        rebuild_table_in_chunks(conn, "emails", create_sql)
+    finally:
+        conn.execute(f"PRAGMA foreign_keys = {int(foreign_keys)}")
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'emails_fts'").fetchone():
+        create_search_triggers(conn)
+        conn.commit()
+
+
+# The migration steps in order, as (version, description, apply, chunked). A chunked
+# step manages its own transactions; the others run in a transaction with the version bump.
+MIGRATIONS: List[Tuple[int, str, Callable[[sqlite3.Connection], None], bool]] = [
+    (1, "Add columns introduced after the first release", _add_late_columns, False),
+    (2, "Rebuild per-message tables without AUTOINCREMENT", _drop_child_autoincrement, True),
+    (3, "Add stored messages to the full-text search index", _index_existing_messages, True),
+    (4, "Key full-scan checkpoints by label selection", _key_scan_checkpoints, False),
+    (5, "Give emails a stable INTEGER PRIMARY KEY for the search index", _add_emails_doc_id, True),
+]
+
+# The schema version of a database created by the current code.
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """
+    Applies every migration step above the database's schema version, in order.
+
+    Args:
+        conn (sqlite3.Connection): An open connection; any pending transaction is committed first.
+
+    Returns:
+        int: The schema version after migrating.
+    """
+    conn.commit()
+    version = get_schema_version(conn)
+    for step_version, description, apply, chunked in MIGRATIONS:
+        if step_version <= version:
+            continue
+        print(f"Migrating database to schema version {step_version}: {description}...")
+        if chunked:
+            apply(conn)
+            set_schema_version(conn, step_version)
+            conn.commit()
+        else:
+            conn.execute("BEGIN")
+            try:
+                apply(conn)
+                set_schema_version(conn, step_version)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        version = step_version
+    return version
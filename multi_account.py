@@ -0,0 +1,151 @@
+"""
+This module syncs several Gmail accounts in parallel, one worker process each.
+
+Accounts are listed in a JSON manifest:
+
+    {
+        "accounts": [
+            {"name": "personal", "token_file": "tokens/personal.json"},
+            {"name": "work", "token_file": "tokens/work.json", "labels": ["INBOX"]}
+        ]
+    }
+
+Each account always syncs into its own database, so Gmail quota (which is
+per user) and SQLite writes never contend between accounts. In shared mode,
+the parent process is the single writer of one combined database: it merges
+each account's database into it, tagged with an `account` column, as soon as
+that account finishes.
+"""
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List, Dict, Any, Callable
+
+from credential_store import CredentialStore
+from mailStructs import AccountConfig, AccountSyncResult
+from sqlite_db import SQLiteDB, DEFAULT_PROFILE
+from config import GMAIL_SCOPES, CLIENT_SECRET_FILE
+
+
+def load_manifest(manifest_path: str) -> List[AccountConfig]:
+    """
+    Reads and validates an accounts manifest.
+
+    Args:
+        manifest_path (str): The path of the JSON manifest; either a list of
+            accounts or an object with an "accounts" list.
+
+    Returns:
+        List[AccountConfig]: The accounts.
+
+    Raises:
+        ValueError: If an account is missing its name or token file, or names repeat.
+    """
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    accounts = manifest.get("accounts", []) if isinstance(manifest, dict) else manifest
+
+    names = set()
+    for account in accounts:
+        if not account.get("name") or not account.get("token_file"):
+            raise ValueError(f"Every account needs a 'name' and a 'token_file': {account}")
+        if account["name"] in names:
+            raise ValueError(f"Duplicate account name: {account['name']}")
+        names.add(account["name"])
+    return accounts
+
+
+def account_db_path(account: AccountConfig, db_directory: str) -> str:
+    """Returns the path of an account's own database."""
+    return account.get("db_path") or os.path.join(db_directory, "accounts", account["name"], "mail_database.db")
+
+
+def authorize_accounts(accounts: List[AccountConfig]):
+    """
+    Makes sure every account has a usable token before the workers start.
+
+    Authorization needs a browser, so it runs here one account at a time
+    instead of in the worker processes.
+    """
+    for account in accounts:
+        store = CredentialStore(account["token_file"], GMAIL_SCOPES)
+        creds = store.load()
+        if creds and creds.refresh_token:
+            continue
+        print(f"Authorize the Gmail account for '{account['name']}' in the browser...")
+        store.get_credentials(CLIENT_SECRET_FILE)
+
+
+def print_account_summary(results: List[AccountSyncResult], wall_seconds: float):
+    """Prints the throughput of each account and of the whole run."""
+    print("\n--- Multi-Account Sync Summary ---")
+    print(f"{'Account':<20} {'Status':<8} {'Added':>8} {'Requests':>9} {'Seconds':>9} {'Msg/s':>8}")
+    for result in results:
+        rate = result["messages_added"] / result["elapsed_seconds"] if result["elapsed_seconds"] else 0.0
+        status = "ok" if result["success"] else "failed"
+        print(f"{result['account']:<20} {status:<8} {result['messages_added']:>8} {result['api_requests']:>9} "
+              f"{result['elapsed_seconds']:>9.1f} {rate:>8.1f}")
+        if result["error"]:
+            print(f"    {result['error']}")
+    total = sum(result["messages_added"] for result in results)
+    print(f"Total: {total} messages in {wall_seconds:.1f}s ({total / wall_seconds if wall_seconds else 0.0:.1f} msg/s)")
+
+
+def run_accounts(accounts: List[AccountConfig], sync_account: Callable[[AccountConfig, Dict[str, Any]], AccountSyncResult],
+                 options: Dict[str, Any], max_processes: int, shared_db_path: str = "",
+                 authorize: bool = True) -> List[AccountSyncResult]:
+    """
+    Syncs every account in its own process, optionally merging them into a shared database.
+
+    Args:
+        accounts (List[AccountConfig]): The accounts from the manifest.
+        sync_account (Callable): Syncs one account; must be a module-level function
+            so it can run in a worker process.
+        options (Dict[str, Any]): Sync options passed to every worker.
+        max_processes (int): The maximum number of accounts synced at once.
+        shared_db_path (str): If set, every account is merged into this database.
+        authorize (bool): If True, accounts without a usable token are authorized first.
+
+    Returns:
+        List[AccountSyncResult]: The result of each account, in completion order.
+    """
+    if authorize:
+        authorize_accounts(accounts)
+
+    shared_db = None
+    if shared_db_path:
+        shared_db = SQLiteDB(shared_db_path, profile=options.get("db_profile", DEFAULT_PROFILE))
+        shared_db.open_db()
+
+    results: List[AccountSyncResult] = []
+    start_time = time.monotonic()
+    try:
+        with ProcessPoolExecutor(max_workers=max(1, min(max_processes, len(accounts)))) as executor:
+            futures = {executor.submit(sync_account, account, options): account for account in accounts}
+            for future in as_completed(futures):
+                account = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {
+                        "account": account["name"], "db_path": account_db_path(account, options["db_directory"]),
+                        "success": False, "messages_added": 0, "api_requests": 0, "quota_units": 0,
+                        "elapsed_seconds": 0.0, "error": f"Worker process failed: {e}",
+                    }
+                results.append(result)
+                print(f"Finished account '{result['account']}': {result['messages_added']} messages added "
+                      f"in {result['elapsed_seconds']:.1f}s.")
+
+                # The parent is the only writer of the shared database.
+                if shared_db and os.path.exists(result["db_path"]):
+                    merge_start = time.monotonic()
+                    copied = shared_db.merge_account_database(result["db_path"], result["account"])
+                    print(f"Merged {copied} messages of '{result['account']}' into the shared database "
+                          f"in {time.monotonic() - merge_start:.1f}s.")
+    finally:
+        if shared_db:
+            shared_db.close_db()
+
+    print_account_summary(results, time.monotonic() - start_time)
+    return results
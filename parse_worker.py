@@ -0,0 +1,194 @@
+"""
+This module runs message parsing in a pool of worker processes.
+
+Parsing raw messages (base64 and MIME decoding, charset conversion, header
+handling) is CPU-bound, so parse threads are capped at one core by the GIL.
+`ProcessParser` hands whole chunks of raw API resources to worker processes
+and gets back picklable `ExtractedEmailData`.
+
+A chunk crosses the process boundary once, pickled as compact tuples that
+carry the base64url 'raw' text exactly as received; workers decode it
+themselves, so the parent never holds a decoded copy and the rest of the API
+resource (payload metadata, size estimates) is not shipped at all. Workers
+save attachment bodies to their own `BlobStore` over the same directory and
+report its counters back with each chunk.
+
+A worker that dies (e.g. killed for running out of memory on a huge message)
+breaks the whole process pool, so the pool is replaced and the chunks that
+were in it are parsed again. A chunk that breaks the new pool as well is
+parsed message by message, so only the message that kills its worker fails.
+"""
+import base64
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional, List, Dict, Tuple, Any
+
+from blob_store import BlobStore
+from mail_parser import parse_raw_message
+from mailStructs import ExtractedEmailData
+
+# A message as shipped to a worker: (id, threadId, labelIds, internalDate, snippet, raw).
+CompactMessage = Tuple[str, Optional[str], List[str], str, Optional[str], str]
+
+# A failed message: (message ID, stage, error class, error message).
+Failure = Tuple[str, str, str, str]
+
+# The blob store of the current worker process, set by `_init_worker`.
+_worker_blob_store: Optional[BlobStore] = None
+
+# Whether the current worker process keeps the compressed source, set by `_init_worker`.
+_worker_keep_raw = False
+
+
+def _init_worker(blob_root: Optional[str], max_blob_bytes: int, max_concurrent_writes: int, keep_raw: bool):
+    """Opens the worker's own blob store; its lock cannot be shared across processes."""
+    global _worker_blob_store, _worker_keep_raw
+    _worker_keep_raw = keep_raw
+    if blob_root:
+        _worker_blob_store = BlobStore(blob_root, max_blob_bytes=max_blob_bytes,
+                                       max_concurrent_writes=max_concurrent_writes)
+
+
+def _compact(raw_message: Dict[str, Any]) -> CompactMessage:
+    """Keeps only the fields `parse_raw_message` reads from a 'raw' API resource."""
+    return (raw_message.get("id"), raw_message.get("threadId"), raw_message.get("labelIds", []),
+            raw_message.get("internalDate", "0"), raw_message.get("snippet"), raw_message["raw"])
+
+
+def _parse_chunk(chunk: List[CompactMessage]) -> Tuple[List[ExtractedEmailData], List[Failure], Dict[str, int]]:
+    """Parses a chunk in a worker process; returns the parsed messages, failures, and blob counters."""
+    blob_stats_before = _worker_blob_store.stats() if _worker_blob_store else {}
+    parsed = []
+    failures: List[Failure] = []
+    for message_id, thread_id, label_ids, internal_date, snippet, raw in chunk:
+        message = {"id": message_id, "threadId": thread_id, "labelIds": label_ids,
+                   "internalDate": internal_date, "snippet": snippet}
+        try:
+            parsed.append(parse_raw_message(base64.urlsafe_b64decode(raw), message, _worker_blob_store, _worker_keep_raw))
+        except Exception as e:
+            failures.append((message_id, "parse", type(e).__name__, str(e)))
+    blob_stats = {}
+    if _worker_blob_store:
+        blob_stats = {key: value - blob_stats_before[key] for key, value in _worker_blob_store.stats().items()}
+    return parsed, failures, blob_stats
+
+
+class ProcessParser:
+    """
+    Parses chunks of raw API messages in worker processes.
+    """
+    def __init__(self, processes: int, blob_store: Optional[BlobStore] = None, keep_raw: bool = False):
+        """
+        Starts the worker pool.
+
+        Args:
+            processes (int): The number of worker processes.
+            blob_store (Optional[BlobStore]): If given, workers save attachment bodies
+                to the same directory, and their counters are added to this store.
+            keep_raw (bool): If True, workers also compress the original source, so only
+                the compressed copy is sent back.
+        """
+        self.processes = max(1, processes)
+        self.blob_store = blob_store
+        self.keep_raw = keep_raw
+        self._lock = threading.Lock()
+        self._executor = self._new_executor()
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        """Starts a pool of worker processes."""
+        # Spawned workers do not inherit the parent's threads, locks, or open connections.
+        return ProcessPoolExecutor(
+            max_workers=self.processes,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(
+                self.blob_store.root if self.blob_store else None,
+                self.blob_store.max_blob_bytes if self.blob_store else 0,
+                self.blob_store.max_concurrent_writes if self.blob_store else 1,
+                self.keep_raw,
+            ),
+        )
+
+    def _replace_executor(self, broken: ProcessPoolExecutor):
+        """Replaces a broken pool, unless another thread has already done so."""
+        with self._lock:
+            if self._executor is broken:
+                print("  A parse worker process died; restarting the worker pool.")
+                broken.shutdown(wait=False, cancel_futures=True)
+                self._executor = self._new_executor()
+
+    def _run(self, chunk: List[CompactMessage], retries: int) -> Tuple[List[ExtractedEmailData], List[Failure]]:
+        """
+        Parses a compact chunk in a worker process, replacing the pool if it breaks.
+
+        Raises:
+            BrokenProcessPool: If the pool broke more than `retries` times.
+        """
+        while True:
+            executor = self._executor
+            try:
+                parsed, failures, blob_stats = executor.submit(_parse_chunk, chunk).result()
+            except BrokenProcessPool:
+                self._replace_executor(executor)
+                if retries <= 0:
+                    raise
+                retries -= 1
+                continue
+            except RuntimeError:
+                # Submitted to a pool another thread had just shut down; try the new one.
+                if executor is self._executor:
+                    raise
+                continue
+            if self.blob_store:
+                self.blob_store.add_stats(blob_stats)
+            return parsed, failures
+
+    def parse_chunk(self, raw_messages: List[Dict[str, Any]]) -> Tuple[List[ExtractedEmailData], List[Failure]]:
+        """
+        Parses a chunk of 'raw' API resources in a worker process, waiting for the result.
+
+        Call it from several threads to keep every worker busy. If a worker dies,
+        the pool is restarted and the chunk parsed again; if the chunk kills its
+        worker again, its messages are parsed one at a time, so only the message
+        that kills its worker is reported as failed.
+
+        Args:
+            raw_messages (List[Dict[str, Any]]): Message resources fetched with format='raw'.
+
+        Returns:
+            Tuple[List[ExtractedEmailData], List[Failure]]: The parsed messages and the
+                messages that could not be parsed.
+        """
+        failures: List[Failure] = []
+        chunk: List[CompactMessage] = []
+        for raw_message in raw_messages:
+            if "raw" in raw_message:
+                chunk.append(_compact(raw_message))
+            else:
+                failures.append((raw_message.get("id"), "parse", "KeyError", "The message resource has no 'raw' field."))
+        if not chunk:
+            return [], failures
+
+        try:
+            parsed, chunk_failures = self._run(chunk, retries=1)
+            return parsed, failures + chunk_failures
+        except BrokenProcessPool:
+            pass
+
+        parsed = []
+        for message in chunk:
+            try:
+                message_parsed, message_failures = self._run([message], retries=0)
+            except BrokenProcessPool as e:
+                message_parsed = []
+                message_failures = [(message[0], "parse", type(e).__name__, "The worker process died while parsing this message.")]
+            parsed.extend(message_parsed)
+            failures.extend(message_failures)
+        return parsed, failures
+
+    def close(self):
+        """Shuts the worker processes down."""
+        with self._lock:
+            self._executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,227 @@
+"""
+This module provides a quota-aware rate limiter for Gmail API calls.
+
+Gmail meters each user in quota units per second, and every method has a fixed
+unit cost (a batch request costs the sum of its parts). `QuotaRateLimiter` is a
+thread-safe token bucket that charges each call its cost before it is sent, so
+all fetch workers share one budget. When Gmail still pushes back with a 429, a
+rate-limit 403, or a 5xx error, the call is retried with exponential backoff
+and jitter, and the sending rate is halved and then recovered gradually.
+
+Throttling statistics are kept so concurrency can be tuned to sit just under
+the quota ceiling.
+"""
+import random
+import threading
+import time
+from typing import Callable, Any, Dict
+
+from googleapiclient.errors import HttpError
+
+from config import GMAIL_QUOTA_UNITS_PER_SECOND
+
+# Quota units charged by Gmail for each API method.
+QUOTA_COSTS: Dict[str, int] = {
+    "labels.list": 1,
+    "getProfile": 1,
+    "history.list": 2,
+    "messages.list": 5,
+    "messages.get": 5,
+    "messages.attachments.get": 5,
+    "threads.list": 10,
+    "threads.get": 10,
+}
+
+# HTTP statuses that indicate a transient failure worth retrying.
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+def is_retryable_error(error: Exception) -> bool:
+    """
+    Returns True if an API error is transient (rate limiting or a server error).
+
+    Args:
+        error (Exception): The exception raised for a request or sub-request.
+    """
+    if not isinstance(error, HttpError):
+        return False
+    status = error.resp.status if error.resp is not None else None
+    if status in RETRYABLE_STATUSES:
+        return True
+    # Gmail reports per-user rate limiting as a 403 with a specific reason.
+    return status == 403 and "ratelimitexceeded" in str(error).lower()
+
+
+def is_throttling_error(error: Exception) -> bool:
+    """Returns True if an API error means the quota was exceeded (as opposed to a server error)."""
+    if not isinstance(error, HttpError) or error.resp is None:
+        return False
+    return error.resp.status == 429 or (error.resp.status == 403 and is_retryable_error(error))
+
+
+class QuotaRateLimiter:
+    """
+    A thread-safe token bucket measured in Gmail quota units, with adaptive backoff.
+    """
+    def __init__(self, units_per_second: float = GMAIL_QUOTA_UNITS_PER_SECOND,
+                 max_retries: int = 5, base_delay: float = 1.0, max_delay: float = 64.0):
+        """
+        Initializes the rate limiter.
+
+        Args:
+            units_per_second (float): The quota budget to stay under.
+            max_retries (int): How many times a throttled or failed call is retried.
+            base_delay (float): The initial backoff delay in seconds; doubles per retry.
+            max_delay (float): The upper bound on a single backoff delay in seconds.
+        """
+        self.max_rate = units_per_second
+        self.min_rate = units_per_second / 16
+        self.rate = units_per_second
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self._lock = threading.Lock()
+        self._tokens = float(units_per_second)
+        self._last_refill = time.monotonic()
+
+        self._stats = {
+            "requests": 0,
+            "units": 0,
+            "throttled": 0,
+            "server_errors": 0,
+            "retries": 0,
+            "failures": 0,
+            "wait_seconds": 0.0,
+            "backoff_seconds": 0.0,
+        }
+
+    def _refill(self):
+        """Adds the tokens earned since the last refill. Must be called with the lock held."""
+        now = time.monotonic()
+        self._tokens = min(self.rate, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def acquire(self, units: int):
+        """
+        Blocks until the given number of quota units may be spent.
+
+        A request costing more than one second of budget (e.g., a large batch)
+        is let through once the bucket is full and leaves the bucket in debt,
+        which later callers wait out.
+
+        Args:
+            units (int): The quota cost of the request about to be sent.
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                needed = min(units, self.rate)
+                if self._tokens >= needed:
+                    self._tokens -= units
+                    self._stats["requests"] += 1
+                    self._stats["units"] += units
+                    self._stats["wait_seconds"] += waited
+                    return
+                delay = (needed - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def record_success(self):
+        """Recovers the sending rate by a small step after a successful call."""
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 50)
+
+    def record_error(self, error: Exception):
+        """
+        Records a transient failure, halving the sending rate if it was a quota error.
+
+        Args:
+            error (Exception): The error returned for a request or sub-request.
+        """
+        with self._lock:
+            if is_throttling_error(error):
+                self._stats["throttled"] += 1
+                self.rate = max(self.min_rate, self.rate / 2)
+                self._tokens = min(self._tokens, self.rate)
+            else:
+                self._stats["server_errors"] += 1
+
+    def backoff(self, attempt: int):
+        """
+        Sleeps for an exponentially growing, randomly jittered delay.
+
+        Args:
+            attempt (int): The zero-based retry number.
+        """
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        with self._lock:
+            self._stats["retries"] += 1
+            self._stats["backoff_seconds"] += delay
+        time.sleep(delay)
+
+    def record_failure(self):
+        """Counts a call that was given up on after exhausting its retries."""
+        with self._lock:
+            self._stats["failures"] += 1
+
+    def execute(self, request_fn: Callable[[], Any], units: int) -> Any:
+        """
+        Sends a request within the quota budget, retrying transient errors.
+
+        Args:
+            request_fn (Callable[[], Any]): Sends the request and returns its response.
+            units (int): The quota cost of the request.
+
+        Returns:
+            Any: The response of the request.
+
+        Raises:
+            HttpError: If the request fails with a non-transient error, or still
+                       fails after the maximum number of retries.
+        """
+        attempt = 0
+        while True:
+            self.acquire(units)
+            try:
+                response = request_fn()
+            except HttpError as error:
+                if not is_retryable_error(error):
+                    raise
+                self.record_error(error)
+                if attempt >= self.max_retries:
+                    self.record_failure()
+                    raise
+                self.backoff(attempt)
+                attempt += 1
+                continue
+            self.record_success()
+            return response
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns a snapshot of the throttling statistics.
+
+        Returns:
+            Dict[str, Any]: Request and quota unit counts, throttling and retry
+                            counts, time spent waiting, and the current rate.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["current_rate"] = self.rate
+        return stats
+
+    def print_stats(self):
+        """Prints the throttling statistics in a readable form."""
+        stats = self.stats()
+        print("\n--- Gmail API Quota Usage ---")
+        print(f"Requests:        {stats['requests']} ({stats['units']} quota units)")
+        print(f"Throttled:       {stats['throttled']} (server errors: {stats['server_errors']})")
+        print(f"Retries:         {stats['retries']} (gave up: {stats['failures']})")
+        print(f"Time waiting:    {stats['wait_seconds']:.1f}s for quota, {stats['backoff_seconds']:.1f}s in backoff")
+        print(f"Current rate:    {stats['current_rate']:.0f} of {self.max_rate:.0f} units/s")
+
+
+# One limiter per process, shared by every GmailAPI client of the same user.
+shared_rate_limiter = QuotaRateLimiter()
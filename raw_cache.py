@@ -0,0 +1,295 @@
+"""
+This module provides a persistent on-disk cache of raw Gmail message resources.
+
+Every `format="raw"` response fetched from Gmail can be kept locally so the
+database can be rebuilt after a parser or schema change without downloading
+the mailbox again. The cache is content-addressed: each RFC 822 source is
+compressed and stored once under the SHA-256 of its bytes, while a small
+SQLite index maps message IDs to their blob and to the rest of the API
+resource (labels, thread ID, etc.). Labels change after a message is cached,
+so callers refresh them instead of trusting the cached labelIds.
+
+The cache has a size cap; when it is exceeded, the least recently used
+messages are evicted. The cache is safe to share between fetch threads.
+"""
+import base64
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional, List, Dict, Iterator
+
+from compression import compress, decompress
+
+# Default cap on the total size of the compressed blobs.
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+# Fraction of the cap the cache is trimmed down to when it overflows,
+# so eviction does not run again on every write.
+_EVICTION_TARGET = 0.9
+
+# Message IDs per "IN (...)" list, below SQLite's bound-parameter limit.
+_IN_CHUNK_SIZE = 500
+
+
+class RawMessageCache:
+    """
+    A size-capped, LRU-evicted store of compressed raw message resources.
+    """
+    def __init__(self, cache_dir: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        """
+        Opens (or creates) the cache.
+
+        Args:
+            cache_dir (str): The directory holding the index and the blobs.
+            max_bytes (int): The maximum total size of the compressed blobs.
+        """
+        self.cache_dir = cache_dir
+        self.blob_dir = os.path.join(cache_dir, "blobs")
+        self.max_bytes = max_bytes
+        os.makedirs(self.blob_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(os.path.join(cache_dir, "index.db"), check_same_thread=False)
+        # The cache can always be refetched, so durability is traded for speed.
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS cached_messages (
+                message_id TEXT PRIMARY KEY,
+                history_id TEXT,
+                content_hash TEXT NOT NULL,
+                metadata TEXT NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS cached_blobs (
+                content_hash TEXT PRIMARY KEY,
+                codec TEXT NOT NULL,
+                compressed_size INTEGER NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_cached_messages_access ON cached_messages (last_access)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_cached_messages_hash ON cached_messages (content_hash)")
+        self.conn.commit()
+        self._total_bytes = self.conn.execute("SELECT COALESCE(SUM(compressed_size), 0) FROM cached_blobs").fetchone()[0]
+
+    def _blob_path(self, content_hash: str) -> str:
+        return os.path.join(self.blob_dir, content_hash[:2], content_hash)
+
+    def _read_blob(self, content_hash: str, codec: str) -> str:
+        """Returns the base64url-encoded source, as found in the API 'raw' field."""
+        with open(self._blob_path(content_hash), "rb") as f:
+            return base64.urlsafe_b64encode(decompress(f.read(), codec)).decode("ascii")
+
+    def _build_message(self, row) -> Optional[dict]:
+        """Rebuilds an API message resource from an index row, or None if its blob is missing."""
+        metadata, content_hash, codec = row
+        message = json.loads(metadata)
+        try:
+            message["raw"] = self._read_blob(content_hash, codec)
+        except (OSError, ValueError) as e:
+            print(f"Cached blob for message ID {message.get('id')} is unreadable: {e}")
+            return None
+        return message
+
+    def get(self, message_id: str) -> Optional[dict]:
+        """
+        Returns a cached message resource.
+
+        Args:
+            message_id (str): The message ID.
+
+        Returns:
+            Optional[dict]: The 'raw' message resource, or None on a cache miss.
+        """
+        return self.get_many([message_id]).get(message_id)
+
+    def get_many(self, message_ids: List[str]) -> Dict[str, dict]:
+        """
+        Returns the cached resources of many messages, marking them as recently used.
+
+        Args:
+            message_ids (List[str]): The message IDs.
+
+        Returns:
+            Dict[str, dict]: The cached 'raw' message resources keyed by message ID.
+        """
+        if not message_ids:
+            return {}
+        placeholders = ", ".join("?" for _ in message_ids)
+        with self._lock:
+            rows = self.conn.execute(f"""
+                SELECT m.message_id, m.metadata, m.content_hash, b.codec
+                FROM cached_messages m JOIN cached_blobs b ON b.content_hash = m.content_hash
+                WHERE m.message_id IN ({placeholders})
+            """, message_ids).fetchall()
+
+        found: Dict[str, dict] = {}
+        for message_id, metadata, content_hash, codec in rows:
+            message = self._build_message((metadata, content_hash, codec))
+            if message is not None:
+                found[message_id] = message
+
+        if found:
+            now = time.time()
+            with self._lock:
+                self.conn.executemany(
+                    "UPDATE cached_messages SET last_access = ? WHERE message_id = ?",
+                    [(now, message_id) for message_id in found]
+                )
+                self.conn.commit()
+        return found
+
+    def put_many(self, messages: List[dict]):
+        """
+        Stores 'raw' message resources, replacing older entries for the same messages.
+
+        Args:
+            messages (List[dict]): Message resources including the 'raw' field.
+        """
+        now = time.time()
+        entries = []
+        new_blobs = []
+        for message in messages:
+            raw_bytes = base64.urlsafe_b64decode(message["raw"])
+            content_hash = hashlib.sha256(raw_bytes).hexdigest()
+            metadata = json.dumps({key: value for key, value in message.items() if key != "raw"})
+            entries.append((message["id"], message.get("historyId"), content_hash, metadata, now))
+            new_blobs.append((content_hash, raw_bytes))
+
+        with self._lock:
+            for content_hash, raw_bytes in new_blobs:
+                if self.conn.execute("SELECT 1 FROM cached_blobs WHERE content_hash = ?", (content_hash,)).fetchone():
+                    continue
+                codec, data = compress(raw_bytes)
+                path = self._blob_path(content_hash)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                temp_path = f"{path}.{threading.get_ident()}.tmp"
+                with open(temp_path, "wb") as f:
+                    f.write(data)
+                os.replace(temp_path, path)
+                self.conn.execute(
+                    "INSERT INTO cached_blobs (content_hash, codec, compressed_size) VALUES (?, ?, ?)",
+                    (content_hash, codec, len(data))
+                )
+                self._total_bytes += len(data)
+            self.conn.executemany("""
+                INSERT OR REPLACE INTO cached_messages (message_id, history_id, content_hash, metadata, last_access)
+                VALUES (?, ?, ?, ?, ?)
+            """, entries)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+            self.conn.commit()
+
+    def put(self, message: dict):
+        """Stores a single 'raw' message resource."""
+        self.put_many([message])
+
+    def update_labels(self, label_updates: Dict[str, List[str]]):
+        """
+        Refreshes the cached label IDs of messages without touching their sources.
+
+        Args:
+            label_updates (Dict[str, List[str]]): The current label IDs keyed by message ID.
+        """
+        with self._lock:
+            rows = self.conn.execute(
+                f"SELECT message_id, metadata FROM cached_messages WHERE message_id IN ({', '.join('?' for _ in label_updates)})",
+                list(label_updates)
+            ).fetchall() if label_updates else []
+            updates = []
+            for message_id, metadata in rows:
+                message = json.loads(metadata)
+                message["labelIds"] = label_updates[message_id]
+                updates.append((json.dumps(message), message_id))
+            self.conn.executemany("UPDATE cached_messages SET metadata = ? WHERE message_id = ?", updates)
+            self.conn.commit()
+
+    def delete_many(self, message_ids: List[str]):
+        """
+        Removes messages from the cache, e.g. after they were deleted from the mailbox.
+
+        Args:
+            message_ids (List[str]): The message IDs; IDs that are not cached are ignored.
+        """
+        with self._lock:
+            for start in range(0, len(message_ids), _IN_CHUNK_SIZE):
+                chunk = message_ids[start:start + _IN_CHUNK_SIZE]
+                rows = self.conn.execute(
+                    f"SELECT message_id, content_hash FROM cached_messages WHERE message_id IN ({', '.join('?' for _ in chunk)})",
+                    chunk
+                ).fetchall()
+                for message_id, content_hash in rows:
+                    self._remove_entry(message_id, content_hash)
+            self.conn.commit()
+
+    def _remove_entry(self, message_id: str, content_hash: str):
+        """Removes one message, and its blob if no other message shares it. Must be called with the lock held."""
+        self.conn.execute("DELETE FROM cached_messages WHERE message_id = ?", (message_id,))
+        # Blobs are shared by identical sources; only delete unreferenced ones.
+        if self.conn.execute("SELECT 1 FROM cached_messages WHERE content_hash = ? LIMIT 1", (content_hash,)).fetchone():
+            return
+        size = self.conn.execute(
+            "SELECT compressed_size FROM cached_blobs WHERE content_hash = ?", (content_hash,)
+        ).fetchone()
+        self.conn.execute("DELETE FROM cached_blobs WHERE content_hash = ?", (content_hash,))
+        if size:
+            self._total_bytes -= size[0]
+        try:
+            os.remove(self._blob_path(content_hash))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        """Removes least recently used messages until the cache is under its cap. Must be called with the lock held."""
+        target = self.max_bytes * _EVICTION_TARGET
+        cursor = self.conn.execute("SELECT message_id, content_hash FROM cached_messages ORDER BY last_access")
+        evicted = 0
+        for message_id, content_hash in cursor.fetchall():
+            if self._total_bytes <= target:
+                break
+            self._remove_entry(message_id, content_hash)
+            evicted += 1
+        if evicted:
+            print(f"Raw cache over {self.max_bytes / 1024 ** 2:.0f} MB; evicted {evicted} least recently used messages.")
+
+    def iter_messages(self, batch_size: int = 500) -> Iterator[List[dict]]:
+        """
+        Yields every cached message resource, in batches, without touching the LRU order.
+
+        Args:
+            batch_size (int): The number of messages per yielded batch.
+
+        Yields:
+            List[dict]: A batch of 'raw' message resources.
+        """
+        last_id = ""
+        while True:
+            with self._lock:
+                rows = self.conn.execute("""
+                    SELECT m.message_id, m.metadata, m.content_hash, b.codec
+                    FROM cached_messages m JOIN cached_blobs b ON b.content_hash = m.content_hash
+                    WHERE m.message_id > ? ORDER BY m.message_id LIMIT ?
+                """, (last_id, batch_size)).fetchall()
+            if not rows:
+                return
+            last_id = rows[-1][0]
+            batch = [message for message in (self._build_message(row[1:]) for row in rows) if message is not None]
+            if batch:
+                yield batch
+
+    def count(self) -> int:
+        """Returns the number of cached messages."""
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM cached_messages").fetchone()[0]
+
+    def close(self):
+        """Closes the cache index."""
+        with self._lock:
+            if self.conn:
+                self.conn.close()
+                self.conn = None
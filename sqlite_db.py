@@ -18,11 +18,16 @@ import json
 import datetime
 import os
 import random
-from typing import Dict, Any, List, Optional
+import urllib.parse
+from typing import Dict, Any, List, Optional, Tuple
 import pandas as pd
 import pickle
 from email.utils import parseaddr, formataddr
 
+from compression import decompress
+from migrations import migrate, set_schema_version, create_search_index, LATEST_VERSION
+from config import FTS_TOKENIZER
+
 from mailStructs import (
     ExtractedEmailData, EmailAddressModel, ContactModel, EmailModel,
     EmailAttachmentModel, EmailXHeaderModel, EmailLabelModel,
@@ -34,6 +39,126 @@ import numpy as np
 from spacy.tokens import DocBin
 from scipy.special import softmax
 
+# A dictionary mapping label names to their corresponding column in the emails table.
+# Note: Gmail's promotions label is 'CATEGORY_PROMOTIONS', etc.
+# Every write of email_labels recomputes the flags of the messages it touched.
+LABEL_FLAG_COLUMNS = {
+    'SPAM': 'is_labeled_spam',
+    'CATEGORY_PROMOTIONS': 'is_labeled_promotions',
+    'CATEGORY_SOCIAL': 'is_labeled_social',
+    'CATEGORY_FORUMS': 'is_labeled_forums',
+    'CATEGORY_PERSONAL': 'is_labeled_personal'
+}
+
+# Tables holding rows that belong to a single message, keyed by message_id.
+MESSAGE_CHILD_TABLES = [
+    'email_attachments', 'email_xheaders', 'email_labels',
+    'email_routing_headers', 'email_authentication', 'email_raw'
+]
+
+# Number of values bound per "IN (...)" clause, well under SQLite's variable limit.
+SQL_IN_CHUNK_SIZE = 500
+
+# Default number of messages written per transaction by insert_messages().
+DEFAULT_INSERT_BATCH_SIZE = 500
+
+# Named sets of PRAGMAs applied by open_db(). "default" keeps SQLite's own settings.
+# "ingest" trades durability of the last few commits on power loss (never
+# consistency) for far fewer fsyncs: WAL appends instead of rewriting pages,
+# synchronous=NORMAL syncs only at checkpoints, and a larger autocheckpoint
+# interval makes those rarer. "query" opens the file read-only and memory-maps
+# it, so reads are served from the page cache without copying.
+PRAGMA_PROFILES: Dict[str, Dict[str, Any]] = {
+    "default": {},
+    "ingest": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -256 * 1024,       # Negative values are KiB: 256 MiB.
+        "temp_store": "MEMORY",
+        "wal_autocheckpoint": 10000,     # Pages (about 40 MB at 4 KiB pages).
+    },
+    "query": {
+        "mmap_size": 8 * 1024 ** 3,      # Capped by SQLite's compile-time maximum.
+        "cache_size": -64 * 1024,
+        "temp_store": "MEMORY",
+    },
+}
+
+# Profiles that open the database read-only; open_db() does not create tables for them.
+READ_ONLY_PROFILES = {"query"}
+
+DEFAULT_PROFILE = "default"
+
+# Secondary indexes created by create_tables(), as (name, table, columns).
+# Every child table is indexed on message_id, so the ON DELETE CASCADE from
+# emails and the per-message deletes of insert_message() are lookups instead of
+# full scans. email_labels is indexed both ways, each index covering the pair.
+INDEXES = [
+    ("idx_email_attachments_message_id", "email_attachments", "message_id"),
+    ("idx_email_attachments_sha256", "email_attachments", "content_sha256"),
+    ("idx_email_xheaders_message_id", "email_xheaders", "message_id"),
+    ("idx_email_labels_message_id", "email_labels", "message_id, label_name"),
+    ("idx_email_labels_label_name", "email_labels", "label_name, message_id"),
+    ("idx_email_routing_headers_message_id", "email_routing_headers", "message_id, hop_order"),
+    ("idx_email_routing_headers_received_at", "email_routing_headers", "received_at"),
+    ("idx_email_authentication_message_id", "email_authentication", "message_id"),
+    ("idx_email_address_contact_id", "email_address", "contact_id"),
+    ("idx_emails_sender_email", "emails", "sender_email"),
+    ("idx_emails_thread_id", "emails", "thread_id"),
+    ("idx_emails_internal_date_ms", "emails", "internal_date_ms"),
+    ("idx_emails_account", "emails", "account"),
+]
+
+# Search terms shorter than this are matched with LIKE; the trigram tokenizer
+# cannot match them.
+SEARCH_MIN_TERM_CHARS = 3
+
+# Column weights of the bm25 ranking of search results: subject, sender_email, body_text.
+SEARCH_RANK_WEIGHTS = (10.0, 5.0, 1.0)
+
+# Senders of SPAM-labeled or unauthenticated messages that are not linked to a contact.
+# The candidate messages are found through the label index rather than by scanning emails.
+SPAM_SENDERS_QUERY = """
+    SELECT DISTINCT e.sender_email
+    FROM emails e
+    LEFT JOIN email_address ea ON e.sender_email = ea.email
+    WHERE (ea.contact_id IS NULL OR ea.contact_id = '')
+      AND e.message_id IN (
+        SELECT message_id FROM email_labels WHERE label_name = 'SPAM'
+        UNION
+        SELECT message_id FROM email_authentication
+        WHERE spf_status = 'failed' OR dkim_status = 'failed' OR dmarc_status = 'failed'
+      )
+"""
+
+# Statements run by the methods and the menu below, shared with HOT_QUERIES so
+# the checked plans are those of the statements actually run.
+DELETE_EMAIL_QUERY = "DELETE FROM emails WHERE message_id = ?"
+DELETE_EMAILS_QUERY = "DELETE FROM emails WHERE message_id IN ({placeholders})"
+LABEL_MESSAGE_IDS_QUERY = "SELECT message_id FROM email_labels WHERE label_name = ?"
+LABEL_EXPORT_QUERY = (
+    "SELECT e.message_id, e.body_text, e.body_html FROM emails e "
+    "JOIN email_labels el ON e.message_id = el.message_id WHERE el.label_name = ?"
+)
+SENDER_EXPORT_QUERY = "SELECT message_id, body_text, body_html FROM emails WHERE sender_email = ?"
+
+# Frequent queries and the index each must use, as (description, SQL, index name).
+# check_query_plans() verifies them with EXPLAIN QUERY PLAN. The cascade deletes
+# are not shown in the plan of a DELETE, so their lookups are checked separately.
+HOT_QUERIES = [
+    ("Delete a message (delete_email)", DELETE_EMAIL_QUERY, "sqlite_autoindex_emails_1"),
+    ("Delete messages (delete_emails)", DELETE_EMAILS_QUERY.format(placeholders="?, ?"), "sqlite_autoindex_emails_1"),
+    *((f"Cascade delete from {table}", f"SELECT 1 FROM {table} WHERE message_id = ?", f"idx_{table}_message_id")
+      for table in ("email_attachments", "email_xheaders", "email_labels", "email_routing_headers", "email_authentication")),
+    ("Messages with a label (random_msg_ids)", LABEL_MESSAGE_IDS_QUERY, "idx_email_labels_label_name"),
+    ("Label export", LABEL_EXPORT_QUERY, "idx_email_labels_label_name"),
+    ("Unlinked SPAM senders", SPAM_SENDERS_QUERY, "idx_email_labels_label_name"),
+    ("Sender export", SENDER_EXPORT_QUERY, "idx_emails_sender_email"),
+    ("Messages of a thread", "SELECT message_id FROM emails WHERE thread_id = ?", "idx_emails_thread_id"),
+    ("Most recent messages",
+     "SELECT message_id, subject FROM emails ORDER BY internal_date_ms DESC LIMIT 100", "idx_emails_internal_date_ms"),
+]
+
 def remove_html(html_string: str) -> str:
     """A simple function to remove HTML tags from a string."""
     return re.sub(r'<[^>]+>', '', html_string)
@@ -42,15 +167,22 @@ class SQLiteDB:
     """
     A handler for all SQLite database operations related to email storage.
     """
-    def __init__(self, db_path: str):
+    def __init__(self, db_path: str, profile: str = DEFAULT_PROFILE):
         """
         Initializes the SQLiteDB handler.
 
         Args:
             db_path (str): The file path for the SQLite database.
+            profile (str): The name of the PRAGMA profile applied when the database
+                           is opened: 'default', 'ingest', or 'query' (read-only).
         """
+        if profile not in PRAGMA_PROFILES:
+            raise ValueError(f"Unknown database profile '{profile}'; expected one of {', '.join(PRAGMA_PROFILES)}.")
         self.db_path = db_path
+        self.profile = profile
         self.conn = None
+        # The exception that made the last insert_message() call fail, if any.
+        self.last_insert_error: Optional[Exception] = None
 
         self.nlp = spacy.load("en_core_web_md")
         self.category_names = []
@@ -61,28 +193,44 @@ class SQLiteDB:
         """
         Opens the database connection and creates tables if they don't exist.
         
-        Ensures the directory for the database file exists before connecting.
+        Ensures the directory for the database file exists before connecting,
+        then applies the PRAGMAs of the handler's profile. A read-only profile
+        opens an existing database through a 'mode=ro' URI and leaves its
+        schema as it is.
         """
-        # Ensure the directory for the database file exists.
-        db_dir = os.path.dirname(self.db_path)
-        if db_dir:
-            os.makedirs(db_dir, exist_ok=True)
-            
-        self.conn = sqlite3.connect(self.db_path)
+        if self.profile in READ_ONLY_PROFILES:
+            db_uri = "file:" + urllib.parse.quote(os.path.abspath(self.db_path)) + "?mode=ro"
+            self.conn = sqlite3.connect(db_uri, uri=True)
+        else:
+            # Ensure the directory for the database file exists.
+            db_dir = os.path.dirname(self.db_path)
+            if db_dir:
+                os.makedirs(db_dir, exist_ok=True)
+            self.conn = sqlite3.connect(self.db_path)
+
         # Enable foreign key support.
         self.conn.execute("PRAGMA foreign_keys = ON")
-        self.create_tables()
+        for pragma, value in PRAGMA_PROFILES[self.profile].items():
+            self.conn.execute(f"PRAGMA {pragma} = {value}")
+
+        if self.profile not in READ_ONLY_PROFILES:
+            self.create_tables()
 
     def create_tables(self):
         """
         Creates all necessary tables based on the mailStructs data models.
         
         This method is idempotent; it will not recreate tables that already exist.
+        New databases are created at the latest schema version; existing ones
+        are upgraded by the steps in `migrations.py`.
         """
         if not self.conn:
             return
 
         cursor = self.conn.cursor()
+        is_new_database = not cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'emails'"
+        ).fetchone()
 
         # --- Table: contacts ---
         # Stores information about individual contacts.
@@ -132,7 +280,8 @@ class SQLiteDB:
         # The central table for storing core email content.
         cursor.execute("""
         CREATE TABLE IF NOT EXISTS emails (
-            message_id TEXT PRIMARY KEY,
+            doc_id INTEGER PRIMARY KEY,  -- The rowid the search index refers to; kept by VACUUM.
+            message_id TEXT NOT NULL UNIQUE,
             thread_id TEXT,
             sender_email TEXT,
             subject TEXT,
@@ -155,6 +304,7 @@ class SQLiteDB:
             is_labeled_social INTEGER DEFAULT 0,
             is_labeled_forums INTEGER DEFAULT 0,
             is_labeled_personal INTEGER DEFAULT 0,
+            account TEXT,
             FOREIGN KEY (sender_email) REFERENCES email_address (email)
         )"""
         )
@@ -163,11 +313,13 @@ class SQLiteDB:
         # Stores metadata about email attachments.
         cursor.execute("""
         CREATE TABLE IF NOT EXISTS email_attachments (
-            attachment_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            attachment_id INTEGER PRIMARY KEY,
             message_id TEXT,
             filename TEXT,
             mime_type TEXT,
             attachment_size INTEGER,
+            content_sha256 TEXT,
+            blob_path TEXT,
             FOREIGN KEY (message_id) REFERENCES emails (message_id) ON DELETE CASCADE
         )"""
         )
@@ -176,7 +328,7 @@ class SQLiteDB:
         # Stores non-standard 'X-' headers from emails.
         cursor.execute("""
         CREATE TABLE IF NOT EXISTS email_xheaders (
-            xheader_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            xheader_id INTEGER PRIMARY KEY,
             message_id TEXT,
             header_name TEXT,
             header_value TEXT,
@@ -188,7 +340,7 @@ class SQLiteDB:
         # Links emails to their assigned Gmail labels.
         cursor.execute("""
         CREATE TABLE IF NOT EXISTS email_labels (
-            label_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            label_id INTEGER PRIMARY KEY,
             message_id TEXT,
             label_name TEXT,
             FOREIGN KEY (message_id) REFERENCES emails (message_id) ON DELETE CASCADE
@@ -199,11 +351,14 @@ class SQLiteDB:
         # Stores sequential 'Received:' headers to trace an email's path.
         cursor.execute("""
         CREATE TABLE IF NOT EXISTS email_routing_headers (
-            route_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            route_id INTEGER PRIMARY KEY,
             message_id TEXT,
             header_name TEXT,
             header_value TEXT,
             hop_order INTEGER,
+            from_host TEXT,
+            by_host TEXT,
+            received_at INTEGER,
             FOREIGN KEY (message_id) REFERENCES emails (message_id) ON DELETE CASCADE
         )"""
         )
@@ -212,7 +367,7 @@ class SQLiteDB:
         # Stores SPF, DKIM, and DMARC authentication results.
         cursor.execute("""
         CREATE TABLE IF NOT EXISTS email_authentication (
-            auth_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            auth_id INTEGER PRIMARY KEY,
             message_id TEXT,
             spf_status TEXT,
             spf_domain TEXT,
@@ -224,9 +379,95 @@ class SQLiteDB:
             FOREIGN KEY (message_id) REFERENCES emails (message_id) ON DELETE CASCADE
         )"""
         )
+
+        # --- Table: email_raw ---
+        # Stores the original RFC 822 source of a message, compressed (see compression.py).
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS email_raw (
+            message_id TEXT PRIMARY KEY,
+            codec TEXT NOT NULL,
+            raw_size INTEGER,
+            raw_compressed BLOB NOT NULL,
+            FOREIGN KEY (message_id) REFERENCES emails (message_id) ON DELETE CASCADE
+        )"""
+        )
+
+        # --- Table: sync_state ---
+        # Stores sync checkpoints, such as the mailbox historyId of the last successful run.
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS sync_state (
+            state_key TEXT PRIMARY KEY,
+            state_value TEXT,
+            updated_at TEXT
+        )"""
+        )
+
+        # --- Table: ingest_checkpoints ---
+        # Stores how far a full scan has listed each label, so an interrupted scan can resume.
+        # Checkpoints are kept per label selection, under the selection's sync checkpoint key.
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ingest_checkpoints (
+            scan_key TEXT NOT NULL,
+            label TEXT NOT NULL,
+            page_token TEXT,
+            last_message_id TEXT,
+            completed INTEGER DEFAULT 0,
+            updated_at TEXT,
+            PRIMARY KEY (scan_key, label)
+        )"""
+        )
+
+        # --- Table: failed_messages ---
+        # Stores messages that could not be fetched, parsed, or stored, for a later retry.
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS failed_messages (
+            message_id TEXT PRIMARY KEY,
+            stage TEXT,
+            error_class TEXT,
+            error_message TEXT,
+            attempts INTEGER DEFAULT 1,
+            first_failed_at TEXT,
+            last_failed_at TEXT
+        )"""
+        )
+
+        # --- Full-Text Search Index ---
+        # An external-content FTS5 table over emails, kept in sync by triggers.
+        create_search_index(self.conn, FTS_TOKENIZER)
+
+        # --- Schema Version ---
+        # New databases are created at the latest version; older ones are migrated.
+        if is_new_database:
+            set_schema_version(self.conn, LATEST_VERSION)
+        self.conn.commit()
+        migrate(self.conn)
+
+        # --- Secondary Indexes ---
+        for index_name, table, columns in INDEXES:
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {table} ({columns})")
         
         self.conn.commit()
 
+    def check_query_plans(self) -> List[Tuple[str, bool, str]]:
+        """
+        Checks with EXPLAIN QUERY PLAN that each of the HOT_QUERIES uses its index.
+
+        Returns:
+            List[Tuple[str, bool, str]]: (description, uses the expected index, query plan)
+                for each query; the plan lists one step per line.
+        """
+        if not self.conn:
+            print("Database connection is not open.")
+            return []
+
+        results = []
+        for description, query, index_name in HOT_QUERIES:
+            # Placeholders are bound to NULL; the plan does not depend on the values.
+            plan_rows = self.conn.execute(f"EXPLAIN QUERY PLAN {query}", (None,) * query.count("?")).fetchall()
+            plan = "\n".join(row[-1] for row in plan_rows)
+            results.append((description, f"INDEX {index_name}" in plan, plan))
+        return results
+
     def create_label_dataframe(self) -> pd.DataFrame | None:
         """
         Generates a DataFrame where the first column is 'message_id' and subsequent
@@ -284,6 +525,66 @@ class SQLiteDB:
             print(f"An error occurred: {e}")
             return None
 
+    def routing_delay_report(self) -> Tuple[pd.DataFrame, pd.DataFrame] | None:
+        """
+        Computes delivery delays from the parsed 'Received' hops of every message.
+
+        A hop's delay is the time between the previous hop's timestamp and its own,
+        charged to the relay that received it (`by_host`). The end-to-end delay is
+        the time from the 'Date' header to the final hop. Everything is computed on
+        whole columns at once, so the report stays fast on large archives.
+
+        Returns:
+            A tuple (relay_delays, end_to_end) of DataFrames, or None if an error occurs:
+            relay_delays has one row per relay with its hop count and the median, 95th
+            percentile, mean, and maximum delay in seconds, slowest first; end_to_end
+            describes the end-to-end delay in seconds over all messages.
+        """
+        if not self.conn:
+            print("Database connection is not open.")
+            return None
+
+        try:
+            hops_df = pd.read_sql_query("""
+                SELECT message_id, hop_order, by_host, received_at
+                FROM email_routing_headers
+                WHERE received_at IS NOT NULL
+            """, self.conn)
+            if hops_df.empty:
+                print("No parsed routing headers found in the database.")
+                return None
+
+            # Oldest hop first within each message (hop_order 1 is the final hop).
+            hops_df = hops_df.sort_values(["message_id", "hop_order"], ascending=[True, False])
+            hops_df["delay_s"] = hops_df.groupby("message_id")["received_at"].diff()
+            # Clock skew between relays can make a hop look negative; it is not a delay.
+            hop_delays = hops_df.dropna(subset=["delay_s"])
+            hop_delays = hop_delays[hop_delays["delay_s"] >= 0]
+
+            relay_delays = (
+                hop_delays.groupby(hop_delays["by_host"].fillna("(unknown)"))["delay_s"]
+                .agg(hops="count", median_s="median", p95_s=lambda d: d.quantile(0.95), mean_s="mean", max_s="max")
+                .sort_values("p95_s", ascending=False)
+            )
+
+            final_hops = hops_df.drop_duplicates("message_id", keep="last").set_index("message_id")["received_at"]
+            sent_df = pd.read_sql_query(
+                "SELECT message_id, sent_timestamp FROM emails WHERE sent_timestamp IS NOT NULL", self.conn
+            ).set_index("message_id")
+            sent_at = pd.to_datetime(sent_df["sent_timestamp"], utc=True, errors="coerce", format="mixed")
+            sent_epoch = (sent_at - pd.Timestamp(0, tz="UTC")) // pd.Timedelta(seconds=1)
+            end_to_end = (final_hops - sent_epoch).dropna()
+            end_to_end = end_to_end[end_to_end >= 0].describe(percentiles=[0.5, 0.95]).to_frame("end_to_end_s")
+
+            return relay_delays, end_to_end
+
+        except sqlite3.Error as e:
+            print(f"Database error: {e}")
+            return None
+        except Exception as e:
+            print(f"An error occurred: {e}")
+            return None
+
     def get_sender_emails_not_in_contacts(self) -> List[str]:
         """
         Retrieves sender emails that are not yet linked to a contact.
@@ -374,22 +675,8 @@ class SQLiteDB:
         if not self.conn:
             return
 
-        query = """
-        SELECT DISTINCT e.sender_email
-        FROM emails e
-        LEFT JOIN email_address ea ON e.sender_email = ea.email
-        LEFT JOIN email_labels el ON e.message_id = el.message_id
-        LEFT JOIN email_authentication auth ON e.message_id = auth.message_id
-        WHERE (ea.contact_id IS NULL OR ea.contact_id = '')
-          AND (
-            el.label_name = 'SPAM'
-            OR auth.spf_status = 'failed'
-            OR auth.dkim_status = 'failed'
-            OR auth.dmarc_status = 'failed'
-          )
-        """
         cursor = self.conn.cursor()
-        cursor.execute(query)
+        cursor.execute(SPAM_SENDERS_QUERY)
         spam_senders = [row[0] for row in cursor.fetchall()]
 
         if not spam_senders:
@@ -818,7 +1105,7 @@ class SQLiteDB:
             print(f"An unexpected error occurred: {e}")
             return None
 
-    def insert_message(self, email_data: ExtractedEmailData, update_if_exists: bool = True):
+    def insert_message(self, email_data: ExtractedEmailData, update_if_exists: bool = True, commit: bool = True) -> bool:
         """
         Inserts or updates a message and all its related data into the database.
 
@@ -829,108 +1116,615 @@ class SQLiteDB:
             email_data (ExtractedEmailData): The dictionary of parsed email data.
             update_if_exists (bool): If True, replaces existing message data.
                                      If False, skips insertion if the message ID exists.
+            commit (bool): If True, commits the message in its own transaction.
+                           If False, the message is written inside a savepoint of
+                           the open transaction and the caller commits the batch;
+                           a failure rolls back only this message.
+
+        Returns:
+            bool: True if the message was written, False if it was skipped or failed.
+                  After a failure, the error is kept in `last_insert_error`.
         """
         if not self.conn:
             print("Database connection is not open.")
-            return
+            return False
 
         cursor = self.conn.cursor()
         message_id = email_data.get("message_id")
+        self.last_insert_error = None
 
         # If not updating, check for existence and skip if found.
         if not update_if_exists:
             cursor.execute("SELECT 1 FROM emails WHERE message_id = ?", (message_id,))
             if cursor.fetchone():
                 print(f"Message {message_id} already exists. Skipping insertion.")
-                return
+                return False
+
+        if not commit:
+            # Open the batch transaction first so releasing the savepoint does not commit it.
+            if not self.conn.in_transaction:
+                cursor.execute("BEGIN")
+            cursor.execute("SAVEPOINT insert_message")
 
         try:
-            # --- 1. Ensure Email Addresses Exist ---
-            # Gather all unique email addresses from the message and add them to the
-            # email_address table if they don't already exist.
-            all_recipients = (
-                [(email_data.get('sender_name'), email_data.get('sender_email'))] +
-                email_data.get('to_recipients', []) +
-                email_data.get('cc_recipients', []) +
-                email_data.get('bcc_recipients', [])
-            )
-            for name, email in set(tuple(i) for i in all_recipients if i and i[1]):
-                cursor.execute("INSERT OR IGNORE INTO email_address (email, display_name) VALUES (?, ?)", (email, name))
-
-            # --- 2. Insert or Replace the Main Email Record ---
-            email_model_data = {
-                "message_id": message_id,
-                "thread_id": email_data.get("thread_id"),
-                "sender_email": email_data.get("sender_email"),
-                "subject": email_data.get("subject"),
-                "body_text": email_data.get("body_text"),
-                "body_html": email_data.get("body_html"),
-                "sent_timestamp": email_data.get("sent_timestamp"),
-                "internal_date_ms": email_data.get("internal_date_ms"),
-                "date_received": email_data.get("date_received"),
-                "mime_type": email_data.get("mime_type"),
-                "content_transfer_encoding": email_data.get("content_transfer_encoding"),
-                "charset": email_data.get("charset"),
-                "to_recipients": json.dumps(email_data.get("to_recipients", [])),
-                "cc_recipients": json.dumps(email_data.get("cc_recipients", [])),
-                "bcc_recipients": json.dumps(email_data.get("bcc_recipients", [])),
-                "return_path": email_data.get("return_path"),
-                "header_sender": email_data.get("header_sender"),
-            }
-            cursor.execute("""
-                INSERT OR REPLACE INTO emails (message_id, thread_id, sender_email, subject, body_text, body_html, sent_timestamp, internal_date_ms, date_received, mime_type, content_transfer_encoding, charset, to_recipients, cc_recipients, bcc_recipients, return_path, header_sender)
-                VALUES (:message_id, :thread_id, :sender_email, :subject, :body_text, :body_html, :sent_timestamp, :internal_date_ms, :date_received, :mime_type, :content_transfer_encoding, :charset, :to_recipients, :cc_recipients, :bcc_recipients, :return_path, :header_sender)
-            """, email_model_data)
-            
-            # --- 3. Insert Related Data (deleting old records first for idempotency) ---
-            
-            # Attachments
-            cursor.execute("DELETE FROM email_attachments WHERE message_id = ?", (message_id,))
-            for att in email_data.get("attachments", []):
-                cursor.execute("INSERT INTO email_attachments (message_id, filename, mime_type, attachment_size) VALUES (?, ?, ?, ?)",
-                               (message_id, att.get("filename"), att.get("mime_type"), att.get("attachment_size")))
-
-            # X-Headers
-            cursor.execute("DELETE FROM email_xheaders WHERE message_id = ?", (message_id,))
-            for xh in email_data.get("xheaders", []):
-                cursor.execute("INSERT INTO email_xheaders (message_id, header_name, header_value) VALUES (?, ?, ?)",
-                               (message_id, xh.get("header_name"), xh.get("header_value")))
-            
-            # Labels
-            cursor.execute("DELETE FROM email_labels WHERE message_id = ?", (message_id,))
-            for label in email_data.get("labels", []):
-                cursor.execute("INSERT INTO email_labels (message_id, label_name) VALUES (?, ?)",
-                               (message_id, label.get("label_name")))
-            
-            # Routing Headers
-            cursor.execute("DELETE FROM email_routing_headers WHERE message_id = ?", (message_id,))
-            for rh in email_data.get("routing_headers", []):
-                cursor.execute("INSERT INTO email_routing_headers (message_id, header_name, header_value, hop_order) VALUES (?, ?, ?, ?)",
-                               (message_id, rh.get("header_name"), rh.get("header_value"), rh.get("hop_order")))
-
-            # Authentication Results
-            auth_data = email_data.get("authentication_results")
-            if auth_data:
-                cursor.execute("DELETE FROM email_authentication WHERE message_id = ?", (message_id,))
-                cursor.execute("""
-                    INSERT INTO email_authentication (message_id, spf_status, spf_domain, dkim_status, dkim_domain, dkim_selector, dmarc_status, dmarc_policy)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    message_id,
-                    auth_data.get("spf_status"), auth_data.get("spf_domain"),
-                    auth_data.get("dkim_status"), auth_data.get("dkim_domain"), auth_data.get("dkim_selector"),
-                    auth_data.get("dmarc_status"), auth_data.get("dmarc_policy")
-                ))
-
-            # Commit the transaction.
-            self.conn.commit()
+            self._write_messages(cursor, [email_data])
+
+            # Commit the transaction, or leave it open for the caller's batch.
+            if commit:
+                self.conn.commit()
+            else:
+                cursor.execute("RELEASE SAVEPOINT insert_message")
             print(f"Successfully inserted/updated message {message_id}")
+            return True
 
         except Exception as e:
-            # If any error occurs, roll back the entire transaction.
+            # If any error occurs, roll back this message's changes.
             if self.conn:
-                self.conn.rollback()
+                if commit:
+                    self.conn.rollback()
+                else:
+                    cursor.execute("ROLLBACK TO SAVEPOINT insert_message")
+                    cursor.execute("RELEASE SAVEPOINT insert_message")
+            self.last_insert_error = e
             print(f"Failed to insert message {message_id}: {e}")
+            return False
+
+    def insert_messages(self, batch: List[ExtractedEmailData], update_if_exists: bool = True,
+                        batch_size: int = DEFAULT_INSERT_BATCH_SIZE,
+                        commit: bool = True) -> Tuple[List[str], List[Tuple[str, Exception]]]:
+        """
+        Inserts or updates many messages, writing each table with one statement per chunk.
+
+        Messages are written `batch_size` at a time with `executemany`, so a chunk
+        costs a handful of statements and, with `commit`, a single disk sync. If a
+        chunk fails, it is written again message by message so that only the
+        messages that fail are rolled back. Nothing is printed per message.
+
+        Args:
+            batch (List[ExtractedEmailData]): The parsed messages. If a message ID
+                                              appears more than once, the last copy wins.
+            update_if_exists (bool): If True, replaces existing message data.
+                                     If False, messages already stored are skipped.
+            batch_size (int): The number of messages written per transaction (or per
+                              savepoint, when the caller commits).
+            commit (bool): If True, each chunk is committed in its own transaction.
+                           If False, the chunks are written inside savepoints of the
+                           open transaction and the caller commits.
+
+        Returns:
+            Tuple[List[str], List[Tuple[str, Exception]]]: The IDs of the messages
+                written, and (message ID, error) for each message that failed.
+                Skipped messages appear in neither list.
+        """
+        if not self.conn:
+            print("Database connection is not open.")
+            return [], [(email_data.get("message_id"), sqlite3.ProgrammingError("Database connection is not open."))
+                        for email_data in batch]
+
+        cursor = self.conn.cursor()
+        messages = list({email_data.get("message_id"): email_data for email_data in batch}.values())
+        if not update_if_exists:
+            existing_ids = set()
+            message_ids = [email_data.get("message_id") for email_data in messages]
+            for start in range(0, len(message_ids), SQL_IN_CHUNK_SIZE):
+                chunk_ids = message_ids[start:start + SQL_IN_CHUNK_SIZE]
+                placeholders = ",".join("?" * len(chunk_ids))
+                cursor.execute(f"SELECT message_id FROM emails WHERE message_id IN ({placeholders})", chunk_ids)
+                existing_ids.update(row[0] for row in cursor.fetchall())
+            messages = [email_data for email_data in messages if email_data.get("message_id") not in existing_ids]
+
+        written_ids: List[str] = []
+        failures: List[Tuple[str, Exception]] = []
+        batch_size = max(1, batch_size)
+        for start in range(0, len(messages), batch_size):
+            chunk = messages[start:start + batch_size]
+            # Open the transaction first so releasing the savepoint does not commit it.
+            if not self.conn.in_transaction:
+                cursor.execute("BEGIN")
+            cursor.execute("SAVEPOINT insert_messages")
+            try:
+                self._write_messages(cursor, chunk)
+                cursor.execute("RELEASE SAVEPOINT insert_messages")
+                written_ids.extend(email_data.get("message_id") for email_data in chunk)
+            except Exception:
+                cursor.execute("ROLLBACK TO SAVEPOINT insert_messages")
+                cursor.execute("RELEASE SAVEPOINT insert_messages")
+                # Write the chunk again one message at a time to isolate the failures.
+                for email_data in chunk:
+                    cursor.execute("SAVEPOINT insert_message")
+                    try:
+                        self._write_messages(cursor, [email_data])
+                        written_ids.append(email_data.get("message_id"))
+                    except Exception as e:
+                        cursor.execute("ROLLBACK TO SAVEPOINT insert_message")
+                        failures.append((email_data.get("message_id"), e))
+                    cursor.execute("RELEASE SAVEPOINT insert_message")
+            if commit:
+                self.conn.commit()
+
+        return written_ids, failures
+
+    def _write_messages(self, cursor: sqlite3.Cursor, messages: List[ExtractedEmailData]):
+        """
+        Writes messages and all their related rows, one `executemany` per statement.
+
+        Related rows of messages already stored are deleted and written again, so
+        the write is idempotent; new messages skip the deletes, since foreign keys
+        guarantee they have no related rows yet. The `is_labeled_*` flags are
+        recomputed from the written labels. The caller handles the transaction
+        and any rollback.
+
+        Args:
+            cursor (sqlite3.Cursor): The cursor to execute on.
+            messages (List[ExtractedEmailData]): The messages, each with a unique ID.
+        """
+        # --- 1. Ensure Email Addresses Exist ---
+        # Gather all unique email addresses from the messages and add them to the
+        # email_address table if they don't already exist.
+        all_recipients = set()
+        for email_data in messages:
+            all_recipients.add((email_data.get('sender_name'), email_data.get('sender_email')))
+            for recipient in (email_data.get('to_recipients', []) + email_data.get('cc_recipients', []) +
+                              email_data.get('bcc_recipients', [])):
+                if recipient:
+                    all_recipients.add(tuple(recipient))
+        cursor.executemany("INSERT OR IGNORE INTO email_address (email, display_name) VALUES (?, ?)",
+                           [(email, name) for name, email in all_recipients if email])
+
+        # --- 2. Insert or Update the Main Email Records ---
+        stored_ids = set()
+        message_ids = [email_data.get("message_id") for email_data in messages]
+        for start in range(0, len(message_ids), SQL_IN_CHUNK_SIZE):
+            chunk_ids = message_ids[start:start + SQL_IN_CHUNK_SIZE]
+            placeholders = ",".join("?" * len(chunk_ids))
+            cursor.execute(f"SELECT message_id FROM emails WHERE message_id IN ({placeholders})", chunk_ids)
+            stored_ids.update((row[0],) for row in cursor.fetchall())
+
+        email_rows = [{
+            "message_id": email_data.get("message_id"),
+            "thread_id": email_data.get("thread_id"),
+            "sender_email": email_data.get("sender_email"),
+            "subject": email_data.get("subject"),
+            "body_text": email_data.get("body_text"),
+            "body_html": email_data.get("body_html"),
+            "sent_timestamp": email_data.get("sent_timestamp"),
+            "internal_date_ms": email_data.get("internal_date_ms"),
+            "date_received": email_data.get("date_received"),
+            "mime_type": email_data.get("mime_type"),
+            "content_transfer_encoding": email_data.get("content_transfer_encoding"),
+            "charset": email_data.get("charset"),
+            "to_recipients": json.dumps(email_data.get("to_recipients", [])),
+            "cc_recipients": json.dumps(email_data.get("cc_recipients", [])),
+            "bcc_recipients": json.dumps(email_data.get("bcc_recipients", [])),
+            "return_path": email_data.get("return_path"),
+            "header_sender": email_data.get("header_sender"),
+        } for email_data in messages]
+        # An upsert rather than INSERT OR REPLACE: replacing deletes the row, and the
+        # cascade would drop related rows that are not rewritten here, such as email_raw.
+        cursor.executemany("""
+            INSERT INTO emails (message_id, thread_id, sender_email, subject, body_text, body_html, sent_timestamp, internal_date_ms, date_received, mime_type, content_transfer_encoding, charset, to_recipients, cc_recipients, bcc_recipients, return_path, header_sender)
+            VALUES (:message_id, :thread_id, :sender_email, :subject, :body_text, :body_html, :sent_timestamp, :internal_date_ms, :date_received, :mime_type, :content_transfer_encoding, :charset, :to_recipients, :cc_recipients, :bcc_recipients, :return_path, :header_sender)
+            ON CONFLICT(message_id) DO UPDATE SET
+                thread_id = excluded.thread_id, sender_email = excluded.sender_email, subject = excluded.subject,
+                body_text = excluded.body_text, body_html = excluded.body_html, sent_timestamp = excluded.sent_timestamp,
+                internal_date_ms = excluded.internal_date_ms, date_received = excluded.date_received,
+                mime_type = excluded.mime_type, content_transfer_encoding = excluded.content_transfer_encoding,
+                charset = excluded.charset, to_recipients = excluded.to_recipients, cc_recipients = excluded.cc_recipients,
+                bcc_recipients = excluded.bcc_recipients, return_path = excluded.return_path,
+                header_sender = excluded.header_sender
+        """, email_rows)
+
+        # --- 3. Insert Related Data (deleting old records first for idempotency) ---
+
+        # Attachments
+        cursor.executemany("DELETE FROM email_attachments WHERE message_id = ?", stored_ids)
+        cursor.executemany(
+            "INSERT INTO email_attachments (message_id, filename, mime_type, attachment_size, content_sha256, blob_path) VALUES (?, ?, ?, ?, ?, ?)",
+            [(email_data.get("message_id"), att.get("filename"), att.get("mime_type"), att.get("attachment_size"),
+              att.get("content_sha256"), att.get("blob_path"))
+             for email_data in messages for att in email_data.get("attachments", [])]
+        )
+
+        # X-Headers
+        cursor.executemany("DELETE FROM email_xheaders WHERE message_id = ?", stored_ids)
+        cursor.executemany(
+            "INSERT INTO email_xheaders (message_id, header_name, header_value) VALUES (?, ?, ?)",
+            [(email_data.get("message_id"), xh.get("header_name"), xh.get("header_value"))
+             for email_data in messages for xh in email_data.get("xheaders", [])]
+        )
+
+        # Labels
+        cursor.executemany("DELETE FROM email_labels WHERE message_id = ?", stored_ids)
+        cursor.executemany(
+            "INSERT INTO email_labels (message_id, label_name) VALUES (?, ?)",
+            [(email_data.get("message_id"), label.get("label_name"))
+             for email_data in messages for label in email_data.get("labels", [])]
+        )
+
+        # Routing Headers
+        cursor.executemany("DELETE FROM email_routing_headers WHERE message_id = ?", stored_ids)
+        cursor.executemany("""
+            INSERT INTO email_routing_headers (message_id, header_name, header_value, hop_order, from_host, by_host, received_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, [(email_data.get("message_id"), rh.get("header_name"), rh.get("header_value"), rh.get("hop_order"),
+               rh.get("from_host"), rh.get("by_host"), rh.get("received_at"))
+              for email_data in messages for rh in email_data.get("routing_headers", [])])
+
+        # Authentication Results (kept as they were when a message has none)
+        auth_rows = [
+            (email_data.get("message_id"),
+             auth_data.get("spf_status"), auth_data.get("spf_domain"),
+             auth_data.get("dkim_status"), auth_data.get("dkim_domain"), auth_data.get("dkim_selector"),
+             auth_data.get("dmarc_status"), auth_data.get("dmarc_policy"))
+            for email_data in messages if (auth_data := email_data.get("authentication_results"))
+        ]
+        cursor.executemany("DELETE FROM email_authentication WHERE message_id = ?",
+                           [row[:1] for row in auth_rows if row[:1] in stored_ids])
+        cursor.executemany("""
+            INSERT INTO email_authentication (message_id, spf_status, spf_domain, dkim_status, dkim_domain, dkim_selector, dmarc_status, dmarc_policy)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, auth_rows)
+
+        # Raw Source (kept only when parsing was asked to keep it)
+        cursor.executemany(
+            "INSERT OR REPLACE INTO email_raw (message_id, codec, raw_size, raw_compressed) VALUES (?, ?, ?, ?)",
+            [(email_data.get("message_id"), raw_data["codec"], raw_data["raw_size"], raw_data["raw_compressed"])
+             for email_data in messages if (raw_data := email_data.get("raw_source"))]
+        )
+
+        # --- 4. Label Flags ---
+        # Recomputed from the labels just written, so a rewritten message never
+        # keeps a flag for a label it no longer has.
+        self._refresh_label_flags(cursor, message_ids)
+
+    def get_raw_source(self, message_id: str) -> Optional[bytes]:
+        """
+        Returns the original RFC 822 source of a message, decompressing it on demand.
+
+        Args:
+            message_id (str): The message ID.
+
+        Returns:
+            Optional[bytes]: The source exactly as received, or None if it was not kept.
+        """
+        if not self.conn:
+            print("Database connection is not open.")
+            return None
+
+        row = self.conn.execute(
+            "SELECT codec, raw_compressed FROM email_raw WHERE message_id = ?", (message_id,)
+        ).fetchone()
+        if not row:
+            return None
+        codec, raw_compressed = row
+        return decompress(raw_compressed, codec)
+
+    def merge_account_database(self, shard_path: str, account: str) -> int:
+        """
+        Replaces an account's messages in this (shared) database with those of its own database.
+
+        The messages and their related rows are copied in one transaction and
+        tagged with the account name; addresses are added if missing. Contacts,
+        sync checkpoints, and failed messages stay in the account's database.
+
+        Message IDs are the primary key of the shared schema, so a message whose
+        ID is already stored for another account (or with no account) cannot be
+        copied. Such collisions are reported and skipped; rows of other accounts
+        are never replaced or deleted.
+
+        Args:
+            shard_path (str): The path of the account's database.
+            account (str): The account name stored in the 'account' column.
+
+        Returns:
+            int: The number of messages copied.
+        """
+        if not self.conn:
+            print("Database connection is not open.")
+            return 0
+
+        cursor = self.conn.cursor()
+        # Foreign keys are checked per row, which is slow for bulk deletes and not
+        # needed here: every related row of the account is replaced explicitly.
+        cursor.execute("PRAGMA foreign_keys = OFF")
+        cursor.execute("ATTACH DATABASE ? AS shard", (shard_path,))
+        try:
+            def shared_columns(table: str, skip_primary_key: bool) -> List[str]:
+                shard_columns = {row[1] for row in cursor.execute(f"PRAGMA shard.table_info({table})")}
+                return [
+                    row[1] for row in cursor.execute(f"PRAGMA main.table_info({table})")
+                    # Surrogate keys are renumbered; a message_id key (email_raw) is kept.
+                    if row[1] in shard_columns and row[1] != "account"
+                    and not (skip_primary_key and row[5] and row[1] != "message_id")
+                ]
+
+            cursor.execute("BEGIN")
+            collisions = cursor.execute("""
+                SELECT s.message_id, m.account FROM shard.emails s JOIN main.emails m ON m.message_id = s.message_id
+                WHERE m.account IS NOT ?
+            """, (account,)).fetchall()
+            if collisions:
+                examples = ", ".join(f"{message_id} ({other or 'no account'})" for message_id, other in collisions[:5])
+                print(f"Skipped {len(collisions)} messages of account '{account}' whose IDs are already "
+                      f"stored for another account: {examples}{', ...' if len(collisions) > 5 else ''}")
+            # Rows of the shard that do not collide with another account's messages.
+            not_colliding = "message_id NOT IN (SELECT message_id FROM main.emails WHERE account IS NOT ?)"
+
+            for table in MESSAGE_CHILD_TABLES:
+                cursor.execute(f"""
+                    DELETE FROM main.{table} WHERE message_id IN (SELECT message_id FROM main.emails WHERE account = ?)
+                """, (account,))
+            # Deleted first rather than replaced: REPLACE does not fire the delete
+            # trigger that removes a message from the search index.
+            cursor.execute("DELETE FROM main.emails WHERE account = ?", (account,))
+
+            cursor.execute("""
+                INSERT OR IGNORE INTO main.email_address (email, display_name)
+                SELECT email, display_name FROM shard.email_address
+            """)
+            columns = ", ".join(shared_columns("emails", skip_primary_key=True))
+            cursor.execute(f"""
+                INSERT INTO main.emails ({columns}, account) SELECT {columns}, ? FROM shard.emails WHERE {not_colliding}
+            """, (account, account))
+            copied = cursor.rowcount
+            for table in MESSAGE_CHILD_TABLES:
+                columns = ", ".join(shared_columns(table, skip_primary_key=True))
+                cursor.execute(f"""
+                    INSERT INTO main.{table} ({columns}) SELECT {columns} FROM shard.{table} WHERE {not_colliding}
+                """, (account,))
+            self.conn.commit()
+            return copied
+        except Exception as e:
+            self.conn.rollback()
+            print(f"Failed to merge the database of account '{account}': {e}")
+            return 0
+        finally:
+            cursor.execute("DETACH DATABASE shard")
+            cursor.execute("PRAGMA foreign_keys = ON")
+
+    def get_sync_state(self, state_key: str) -> Optional[str]:
+        """
+        Retrieves a stored sync checkpoint value.
+
+        Args:
+            state_key (str): The name of the checkpoint (e.g., 'history_id').
+
+        Returns:
+            Optional[str]: The stored value, or None if it has never been set.
+        """
+        if not self.conn:
+            print("Database connection is not open.")
+            return None
+
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT state_value FROM sync_state WHERE state_key = ?", (state_key,))
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+    def set_sync_state(self, state_key: str, state_value: str):
+        """
+        Stores a sync checkpoint value, replacing any previous value.
+
+        Args:
+            state_key (str): The name of the checkpoint (e.g., 'history_id').
+            state_value (str): The value to store.
+        """
+        if not self.conn:
+            print("Database connection is not open.")
+            return
+
+        try:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO sync_state (state_key, state_value, updated_at) VALUES (?, ?, ?)",
+                (state_key, state_value, datetime.datetime.now(datetime.timezone.utc).isoformat())
+            )
+            self.conn.commit()
+        except Exception as e:
+            self.conn.rollback()
+            print(f"Failed to save sync state '{state_key}': {e}")
+
+    def delete_sync_state(self, state_key: str):
+        """
+        Removes a stored sync checkpoint value.
+
+        Args:
+            state_key (str): The name of the checkpoint.
+        """
+        if not self.conn:
+            print("Database connection is not open.")
+            return
+
+        self.conn.execute("DELETE FROM sync_state WHERE state_key = ?", (state_key,))
+        self.conn.commit()
+
+    def get_ingest_checkpoints(self, scan_key: str) -> Dict[str, Tuple[Optional[str], bool]]:
+        """
+        Retrieves how far an interrupted full scan of a label selection listed each label.
+
+        Args:
+            scan_key (str): The sync checkpoint key of the label selection (e.g., 'history_id').
+
+        Returns:
+            Dict[str, Tuple[Optional[str], bool]]: The page token to resume listing
+                from and whether the label was finished, keyed by label.
+        """
+        if not self.conn:
+            print("Database connection is not open.")
+            return {}
+
+        rows = self.conn.execute(
+            "SELECT label, page_token, completed FROM ingest_checkpoints WHERE scan_key = ?", (scan_key,)
+        ).fetchall()
+        return {label: (page_token, bool(completed)) for label, page_token, completed in rows}
+
+    def save_ingest_checkpoints(self, scan_key: str, checkpoints: List[Tuple[str, Optional[str], Optional[str], bool]]):
+        """
+        Stores the listing position of labels and commits.
+
+        Args:
+            scan_key (str): The sync checkpoint key of the label selection being scanned.
+            checkpoints (List[Tuple]): (label, page token, last committed message ID,
+                completed) tuples. The page token is that of the first page not yet
+                fully committed.
+        """
+        if not self.conn or not checkpoints:
+            return
+
+        now = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        self.conn.executemany("""
+            INSERT OR REPLACE INTO ingest_checkpoints (scan_key, label, page_token, last_message_id, completed, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, [(scan_key, label, page_token, last_id, int(completed), now)
+              for label, page_token, last_id, completed in checkpoints])
+        self.conn.commit()
+
+    def clear_ingest_checkpoints(self, scan_key: str):
+        """
+        Removes the listing checkpoints of a label selection, once its full scan has finished.
+
+        Args:
+            scan_key (str): The sync checkpoint key of the label selection.
+        """
+        if not self.conn:
+            print("Database connection is not open.")
+            return
+
+        self.conn.execute("DELETE FROM ingest_checkpoints WHERE scan_key = ?", (scan_key,))
+        self.conn.commit()
+
+    def record_failed_messages(self, failures: List[Tuple[str, str, str, str]]):
+        """
+        Records messages that failed, counting repeated failures. Does not commit.
+
+        Args:
+            failures (List[Tuple[str, str, str, str]]): (message ID, stage, error
+                class, error message) tuples; the stage is 'fetch', 'parse', or 'write'.
+        """
+        if not self.conn or not failures:
+            return
+
+        now = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        self.conn.executemany("""
+            INSERT INTO failed_messages (message_id, stage, error_class, error_message, attempts, first_failed_at, last_failed_at)
+            VALUES (?, ?, ?, ?, 1, ?, ?)
+            ON CONFLICT (message_id) DO UPDATE SET
+                stage = excluded.stage,
+                error_class = excluded.error_class,
+                error_message = excluded.error_message,
+                attempts = attempts + 1,
+                last_failed_at = excluded.last_failed_at
+        """, [(message_id, stage, error_class, error_message, now, now)
+              for message_id, stage, error_class, error_message in failures])
+
+    def clear_failed_messages(self, message_ids: List[str]):
+        """
+        Removes messages from the failed list once they were stored. Does not commit.
+
+        Args:
+            message_ids (List[str]): The IDs of the messages that succeeded.
+        """
+        if not self.conn:
+            return
+
+        for start in range(0, len(message_ids), SQL_IN_CHUNK_SIZE):
+            chunk = message_ids[start:start + SQL_IN_CHUNK_SIZE]
+            self.conn.execute(
+                f"DELETE FROM failed_messages WHERE message_id IN ({', '.join('?' for _ in chunk)})", chunk
+            )
+
+    def get_failed_message_ids(self, max_attempts: int) -> List[str]:
+        """
+        Lists the failed messages that have not yet used up their attempts.
+
+        Args:
+            max_attempts (int): Messages that failed this many times are left out.
+
+        Returns:
+            List[str]: The message IDs, least attempted first.
+        """
+        if not self.conn:
+            print("Database connection is not open.")
+            return []
+
+        rows = self.conn.execute(
+            "SELECT message_id FROM failed_messages WHERE attempts < ? ORDER BY attempts, first_failed_at",
+            (max_attempts,)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def sync_message_labels(self, label_updates: Dict[str, List[str]]) -> Tuple[int, int]:
+        """
+        Brings the stored labels of existing messages in line with Gmail.
+
+        Each message's label IDs are diffed against `email_labels`, and only the
+        missing labels are inserted and the stale ones deleted. As on every
+        label write, the `is_labeled_*` flags of the changed messages are
+        recomputed in the same transaction.
+        Messages that are not in the database are ignored.
+
+        Args:
+            label_updates (Dict[str, List[str]]): The current label IDs keyed by message ID.
+
+        Returns:
+            Tuple[int, int]: The number of label rows inserted and deleted.
+        """
+        if not self.conn:
+            print("Database connection is not open.")
+            return 0, 0
+
+        cursor = self.conn.cursor()
+        message_ids = list(label_updates)
+        stored_ids = set()
+        stored_labels: Dict[str, set] = {}
+
+        for start in range(0, len(message_ids), SQL_IN_CHUNK_SIZE):
+            chunk = message_ids[start:start + SQL_IN_CHUNK_SIZE]
+            placeholders = ",".join("?" * len(chunk))
+            cursor.execute(f"SELECT message_id FROM emails WHERE message_id IN ({placeholders})", chunk)
+            stored_ids.update(row[0] for row in cursor.fetchall())
+            cursor.execute(f"SELECT message_id, label_name FROM email_labels WHERE message_id IN ({placeholders})", chunk)
+            for message_id, label_name in cursor.fetchall():
+                stored_labels.setdefault(message_id, set()).add(label_name)
+
+        inserts = []
+        deletes = []
+        for message_id in stored_ids:
+            new_labels = set(label_updates[message_id])
+            old_labels = stored_labels.get(message_id, set())
+            inserts.extend((message_id, label) for label in new_labels - old_labels)
+            deletes.extend((message_id, label) for label in old_labels - new_labels)
+
+        if not inserts and not deletes:
+            return 0, 0
+
+        try:
+            cursor.executemany("DELETE FROM email_labels WHERE message_id = ? AND label_name = ?", deletes)
+            cursor.executemany("INSERT INTO email_labels (message_id, label_name) VALUES (?, ?)", inserts)
+            self._refresh_label_flags(cursor, {message_id for message_id, _ in inserts + deletes})
+            self.conn.commit()
+        except Exception as e:
+            self.conn.rollback()
+            print(f"Failed to update message labels: {e}")
+            return 0, 0
+
+        return len(inserts), len(deletes)
+
+    def _refresh_label_flags(self, cursor: sqlite3.Cursor, message_ids):
+        """
+        Recomputes the `is_labeled_*` flags of the given messages from `email_labels`.
+
+        Runs inside the caller's transaction; the caller commits.
+        """
+        set_clause = ", ".join(
+            f"{column_name} = EXISTS (SELECT 1 FROM email_labels el "
+            f"WHERE el.message_id = emails.message_id AND el.label_name = '{label_name}')"
+            for label_name, column_name in LABEL_FLAG_COLUMNS.items()
+        )
+        message_ids = list(message_ids)
+        for start in range(0, len(message_ids), SQL_IN_CHUNK_SIZE):
+            chunk = message_ids[start:start + SQL_IN_CHUNK_SIZE]
+            placeholders = ",".join("?" * len(chunk))
+            cursor.execute(f"UPDATE emails SET {set_clause} WHERE message_id IN ({placeholders})", chunk)
 
     def get_all_labels(self) -> List[str]:
         """
@@ -971,7 +1765,7 @@ class SQLiteDB:
         cursor = self.conn.cursor()
 
         if label:
-            cursor.execute("SELECT message_id FROM email_labels WHERE label_name = ?", (label,))
+            cursor.execute(LABEL_MESSAGE_IDS_QUERY, (label,))
         else:
             cursor.execute("SELECT message_id FROM emails")
 
@@ -1026,16 +1820,102 @@ class SQLiteDB:
             print("[No message body found]")
         print("--------------------")
 
+    def has_search_index(self) -> bool:
+        """Returns True if the database has the full-text search index."""
+        if not self.conn:
+            return False
+        return self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'emails_fts'"
+        ).fetchone() is not None
+
+    def rebuild_search_index(self):
+        """
+        Rebuilds the full-text search index from the emails table.
+
+        The index refers to emails by doc_id, which VACUUM keeps, so this is
+        only needed if the index was damaged or changed outside this class.
+        """
+        if not self.has_search_index():
+            print("The database has no search index.")
+            return
+        self.conn.execute("INSERT INTO emails_fts (emails_fts) VALUES ('rebuild')")
+        self.conn.commit()
+
+    def search_emails_ranked(self, search_string: str, limit: Optional[int] = 100) -> List[Dict[str, Any]]:
+        """
+        Searches the subject, sender, and plain-text body of emails, best matches first.
+
+        The full-text index ranks matches with bm25, weighting subject and sender
+        above the body, and returns a snippet of the best-matching field with the
+        term in [brackets]. With the trigram tokenizer any substring of three or
+        more characters matches. Shorter terms, and databases without the index,
+        fall back to a LIKE scan that also covers the HTML body, unranked and
+        without snippets.
+
+        Args:
+            search_string (str): The string to search for.
+            limit (Optional[int]): The maximum number of results, or None for all.
+
+        Returns:
+            List[Dict[str, Any]]: 'message_id', 'subject', 'sender_email', and
+                'snippet' (None for LIKE matches) of each matching email.
+        """
+        if not self.conn:
+            print("Database connection is not open.")
+            return []
+
+        if len(search_string.strip()) < SEARCH_MIN_TERM_CHARS or not self.has_search_index():
+            message_ids = self._search_emails_like(search_string)[:limit]
+            results = []
+            for start in range(0, len(message_ids), SQL_IN_CHUNK_SIZE):
+                chunk = message_ids[start:start + SQL_IN_CHUNK_SIZE]
+                placeholders = ",".join("?" * len(chunk))
+                results.extend(
+                    {"message_id": row[0], "subject": row[1], "sender_email": row[2], "snippet": None}
+                    for row in self.conn.execute(
+                        f"SELECT message_id, subject, sender_email FROM emails WHERE message_id IN ({placeholders})", chunk
+                    )
+                )
+            return results
+
+        # Quoted as one phrase, so operators and punctuation in the term are matched literally.
+        match_expression = '"' + search_string.replace('"', '""') + '"'
+        query = f"""
+            SELECT e.message_id, e.subject, e.sender_email,
+                   snippet(emails_fts, -1, '[', ']', '...', 64)
+            FROM emails_fts
+            JOIN emails e ON e.rowid = emails_fts.rowid
+            WHERE emails_fts MATCH ?
+            ORDER BY bm25(emails_fts, {", ".join(str(weight) for weight in SEARCH_RANK_WEIGHTS)})
+            LIMIT ?
+        """
+        try:
+            rows = self.conn.execute(query, (match_expression, -1 if limit is None else limit)).fetchall()
+        except sqlite3.Error as e:
+            print(f"Search failed: {e}")
+            return []
+        return [{"message_id": row[0], "subject": row[1], "sender_email": row[2], "snippet": row[3]} for row in rows]
+
     def search_emails(self, search_string: str) -> List[str]:
         """
         Searches for a partial string in email fields and returns matching message IDs.
 
+        Uses the full-text index when it can (see `search_emails_ranked`), so the
+        best matches come first. The index covers subject, sender, and the
+        plain-text body but not body_html, so messages whose only body is HTML
+        match on subject and sender alone (terms shorter than three characters
+        still scan body_html too).
+
         Args:
             search_string (str): The string to search for.
 
         Returns:
             List[str]: A list of message IDs from emails that match the search string.
         """
+        return [result["message_id"] for result in self.search_emails_ranked(search_string, limit=None)]
+
+    def _search_emails_like(self, search_string: str) -> List[str]:
+        """Searches all text fields with LIKE '%term%', scanning every email."""
         if not self.conn:
             print("Database connection is not open.")
             return []
@@ -1151,6 +2031,9 @@ class SQLiteDB:
         """
         Backfills the boolean label flags (is_labeled_spam, is_labeled_promotions, etc.) in the 'emails' table
         based on the labels stored in the 'email_labels' table.
+
+        Writes keep the flags current, so this only repairs databases written
+        before they did.
         """
         if not self.conn:
             print("Database connection is not open.")
@@ -1159,18 +2042,8 @@ class SQLiteDB:
         print("Starting to update email label flags...")
         cursor = self.conn.cursor()
 
-        # A dictionary mapping label names to their corresponding column in the emails table.
-        # Note: Gmail's promotions label is 'CATEGORY_PROMOTIONS', etc.
-        label_to_column_map = {
-            'SPAM': 'is_labeled_spam',
-            'CATEGORY_PROMOTIONS': 'is_labeled_promotions',
-            'CATEGORY_SOCIAL': 'is_labeled_social',
-            'CATEGORY_FORUMS': 'is_labeled_forums',
-            'CATEGORY_PERSONAL': 'is_labeled_personal'
-        }
-
         try:
-            for label_name, column_name in label_to_column_map.items():
+            for label_name, column_name in LABEL_FLAG_COLUMNS.items():
                 print(f"  - Updating '{column_name}' flag for label '{label_name}'...")
                 
                 # First, reset the column to 0 for all emails to handle cases where a label might have been removed.
@@ -1394,13 +2267,45 @@ class SQLiteDB:
                 return
 
         try:
-            cursor.execute("DELETE FROM emails WHERE message_id = ?", (message_id,))
+            cursor.execute(DELETE_EMAIL_QUERY, (message_id,))
             self.conn.commit()
             print(f"Successfully deleted message {message_id} and all related data.")
         except Exception as e:
             self.conn.rollback()
             print(f"Failed to delete message {message_id}: {e}")
 
+    def delete_emails(self, message_ids: List[str]) -> Optional[int]:
+        """
+        Deletes many emails and all their related data in one transaction.
+
+        Related rows go through ON DELETE CASCADE, as in delete_email(). IDs that
+        are not stored are ignored. If any delete fails, none are kept.
+
+        Args:
+            message_ids (List[str]): The IDs of the messages to delete.
+
+        Returns:
+            Optional[int]: The number of messages deleted, or None if the
+                           transaction failed and was rolled back.
+        """
+        if not self.conn:
+            print("Database connection is not open.")
+            return None
+
+        cursor = self.conn.cursor()
+        deleted = 0
+        try:
+            for start in range(0, len(message_ids), SQL_IN_CHUNK_SIZE):
+                chunk = message_ids[start:start + SQL_IN_CHUNK_SIZE]
+                cursor.execute(DELETE_EMAILS_QUERY.format(placeholders=", ".join("?" * len(chunk))), chunk)
+                deleted += cursor.rowcount
+            self.conn.commit()
+            return deleted
+        except Exception as e:
+            self.conn.rollback()
+            print(f"Failed to delete {len(message_ids)} messages: {e}")
+            return None
+
     # Example usage:
     # msg = "I need help with my monthly billing statement."
     # best, probs = classify_with_probabilities(msg)
@@ -1415,12 +2320,32 @@ from config import DATABASE_PATH
 if __name__ == '__main__':
     # --- Example Usage ---
     # This block demonstrates how to use the SQLiteDB class for various tasks via a menu.
-    
+    import argparse
+
+    # Browsing only reads, so the database is opened with the read-only 'query'
+    # profile unless another one is chosen; actions that write reopen it writable.
+    arg_parser = argparse.ArgumentParser(description="Browse and manage the mail database.")
+    arg_parser.add_argument("--db-profile", choices=list(PRAGMA_PROFILES), default="query",
+                            help="SQLite PRAGMA profile the database is opened with (default: query, read-only).")
+    args = arg_parser.parse_args()
+
     # Construct the full path to the database file, mirroring the logic in main.py.
     db_path = os.path.join(DATABASE_PATH, "mail_database.db")
-    db = SQLiteDB(db_path)
+    db_profile = args.db_profile
+    if db_profile in READ_ONLY_PROFILES and not os.path.exists(db_path):
+        print(f"{db_path} does not exist yet; creating it with the '{DEFAULT_PROFILE}' profile.")
+        db_profile = DEFAULT_PROFILE
+    db = SQLiteDB(db_path, profile=db_profile)
     db.open_db()
-    print("Database opened and tables created if they didn't exist.")
+    print(f"Database opened with the '{db.profile}' profile.")
+
+    def ensure_writable():
+        """Reopens a database opened with a read-only profile writable, before an action that changes it."""
+        if db.profile in READ_ONLY_PROFILES:
+            print(f"This action changes the database; reopening it with the '{DEFAULT_PROFILE}' profile.")
+            db.close_db()
+            db.profile = DEFAULT_PROFILE
+            db.open_db()
 
     while True:
         print("\n--- SQLiteDB Main Menu ---")
@@ -1432,15 +2357,18 @@ if __name__ == '__main__':
         print("6. Process potential SPAM sender emails")
         print("7. Generate Email Label DataFrame")
         print("8. Export Formatted Messages by Label")
-        print("9. UPDATE email label flags in emails table")
+        print("9. BACKFILL email label flags in emails table")
         print("10. Classify 10 random messages")
         print("11. Search, display, and manage emails")
+        print("13. Report delivery delays by relay")
+        print("14. Check that frequent queries use indexes")
         print("0. Exit")
         
         choice = input("Enter your choice: ")
         
         if choice == '1':
             print("\n--- Processing new sender emails ---")
+            ensure_writable()
             db.show_sender_contact_status()
             new_senders = db.get_sender_emails_not_in_contacts()
             
@@ -1453,6 +2381,7 @@ if __name__ == '__main__':
 
         elif choice == '2':
             print("\n--- Insert email from JSON file (if new) ---")
+            ensure_writable()
             
             json_files = [f for f in os.listdir('.') if f.endswith('.json')]
             if not json_files:
@@ -1479,6 +2408,7 @@ if __name__ == '__main__':
         
         elif choice == '3':
             print("\n--- Find and Edit Email Address ---")
+            ensure_writable()
             email_to_edit = input("Enter the full email address to edit: ")
             if email_to_edit:
                 db.edit_contact_and_email_interactive(email_to_edit)
@@ -1509,12 +2439,12 @@ if __name__ == '__main__':
 
             if filter_choice == '1':
                 label = input("Enter label: ")
-                query = "SELECT e.message_id, e.body_text, e.body_html FROM emails e JOIN email_labels el ON e.message_id = el.message_id WHERE el.label_name = ?"
+                query = LABEL_EXPORT_QUERY
                 params = (label,)
                 json_filename = f"export_label_{label.replace('/', '_')}.json"
             elif filter_choice == '2':
                 email = input("Enter sender email address: ")
-                query = "SELECT message_id, body_text, body_html FROM emails WHERE sender_email = ?"
+                query = SENDER_EXPORT_QUERY
                 params = (email,)
                 json_filename = f"export_email_{email}.json"
             elif filter_choice == '3':
@@ -1549,6 +2479,7 @@ if __name__ == '__main__':
             
         elif choice == '6':
             print("\n--- Processing potential SPAM sender emails ---")
+            ensure_writable()
             db.get_spam_sender_emails_not_in_contacts()
 
         elif choice == '7':
@@ -1568,6 +2499,7 @@ if __name__ == '__main__':
 
         elif choice == '9':
             print("\n--- Updating Email Label Flags ---")
+            ensure_writable()
             db.update_email_label_booleans()
 
         elif choice == '10':
@@ -1636,24 +2568,18 @@ if __name__ == '__main__':
                 print("No search term provided.")
                 continue
 
-            message_ids = db.search_emails(search_term)
-            if not message_ids:
+            # Ranked by relevance, each with a snippet of the match.
+            message_details = db.search_emails_ranked(search_term)
+            if not message_details:
                 print("No matching messages found.")
                 continue
 
-            # Fetch subjects for all messages once
-            message_details = []
-            for msg_id in message_ids:
-                cursor = db.conn.cursor()
-                cursor.execute("SELECT subject FROM emails WHERE message_id = ?", (msg_id,))
-                result = cursor.fetchone()
-                subject = result[0] if result else "No Subject"
-                message_details.append({'message_id': msg_id, 'subject': subject})
-
             while True:
                 print("\n--- Search Results ---")
                 for i, detail in enumerate(message_details):
-                    print(f"{i + 1}. {detail['message_id']} - {detail['subject']}")
+                    print(f"{i + 1}. {detail['message_id']} - {detail['subject'] or 'No Subject'} ({detail['sender_email']})")
+                    if detail['snippet']:
+                        print(f"      {' '.join(detail['snippet'].split())}")
                 
                 initial_action = input("\n[D]elete all shown, [S]elect a message, or [E]xit? (d/s/e): ").lower()
 
@@ -1664,6 +2590,7 @@ if __name__ == '__main__':
                         confirm_delete_all = input(f"Are you sure you want to delete ALL {len(message_details)} messages shown? (y/N): ").lower()
                         if confirm_delete_all == 'y':
                             print("\n--- Deleting all messages ---")
+                            ensure_writable()
                             # Iterate over a copy because message_details will be modified
                             for detail in message_details[:]:
                                 db.delete_email(detail['message_id'], confirm=False)
@@ -1690,6 +2617,7 @@ if __name__ == '__main__':
 
                             action = input("\n[E]dit, [D]elete, or [C]ontinue? (e/d/c): ").lower()
                             if action == 'd':
+                                ensure_writable()
                                 db.delete_email(selected_id, confirm=True)
                                 # Refresh the list of message_details after deletion
                                 message_details.pop(selected_index)
@@ -1706,10 +2634,27 @@ if __name__ == '__main__':
             print("\n--- Redact Sensitive Information ---")
             confirm = input("This will permanently redact information and is irreversible. Are you sure? (y/N): ").lower()
             if confirm == 'y':
+                ensure_writable()
                 db.redact_sensitive_info()
             else:
                 print("Redaction cancelled.")
         
+        elif choice == '13':
+            print("\n--- Delivery Delays by Relay ---")
+            report = db.routing_delay_report()
+            if report is not None:
+                relay_delays, end_to_end = report
+                print(relay_delays.head(20).round(1).to_string())
+                print("\nEnd-to-end (Date header to final hop):")
+                print(end_to_end.round(1).to_string())
+
+        elif choice == '14':
+            print("\n--- Query Plans of Frequent Queries ---")
+            for description, uses_index, plan in db.check_query_plans():
+                print(f"{'OK  ' if uses_index else 'SCAN'} {description}")
+                if not uses_index:
+                    print("       " + plan.replace("\n", "\n       "))
+
         elif choice == '0':
             print("Exiting application.")
             break
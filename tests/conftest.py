@@ -0,0 +1,41 @@
+"""
+Shared fixtures of the test suite.
+
+Tests run against temporary databases and the offline `FakeGmailService`, so
+no credentials or network access are needed.
+"""
+import os
+import sys
+
+import pytest
+
+# config.py exits without a client secret path; the tests never authenticate.
+os.environ.setdefault("GMAIL_CLIENT_SECRET_PATH", "client_secret.json")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_gmail import FakeGmailService  # noqa: E402
+from gmail_api import GmailAPI  # noqa: E402
+from rate_limiter import QuotaRateLimiter  # noqa: E402
+from sqlite_db import SQLiteDB  # noqa: E402
+
+
+@pytest.fixture
+def db(tmp_path):
+    database = SQLiteDB(str(tmp_path / "mail_database.db"))
+    database.open_db()
+    yield database
+    database.close_db()
+
+
+@pytest.fixture
+def gmail():
+    """A client connected to a synthetic mailbox of 300 messages, without quota waits or retries."""
+    client = GmailAPI(service=FakeGmailService.synthetic(300, seed=1),
+                      rate_limiter=QuotaRateLimiter(10 ** 7, max_retries=0))
+    client.connect()
+    return client
+
+
+def all_message_ids(gmail: GmailAPI) -> list:
+    """Lists the ID of every message in the mailbox."""
+    return [message["id"] for page in gmail.iter_message_id_pages("") for message in page]
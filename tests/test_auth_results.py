@@ -0,0 +1,95 @@
+"""
+Table-driven tests of the Authentication-Results tokenizer and parsers.
+"""
+import pytest
+
+from auth_results import (
+    tokenize_auth_results, parse_auth_results_header, parse_auth_results,
+    TOKEN_ATOM, TOKEN_QUOTED, TOKEN_COMMENT, TOKEN_EQUALS, TOKEN_SEMICOLON
+)
+
+
+@pytest.mark.parametrize("header_value, expected_tokens", [
+    ("mx.example.com; spf=pass",
+     [(TOKEN_ATOM, "mx.example.com"), (TOKEN_SEMICOLON, ";"),
+      (TOKEN_ATOM, "spf"), (TOKEN_EQUALS, "="), (TOKEN_ATOM, "pass")]),
+    # A comment nested one level stays one token.
+    ("spf=pass (sender (the relay) permitted) x",
+     [(TOKEN_ATOM, "spf"), (TOKEN_EQUALS, "="), (TOKEN_ATOM, "pass"),
+      (TOKEN_COMMENT, "sender (the relay) permitted"), (TOKEN_ATOM, "x")]),
+    ("(escaped \\) paren)", [(TOKEN_COMMENT, "escaped \\) paren")]),
+    # Unterminated comments and quoted strings end the token.
+    ("spf=pass (no end", [(TOKEN_ATOM, "spf"), (TOKEN_EQUALS, "="), (TOKEN_ATOM, "pass"), (TOKEN_COMMENT, "no end")]),
+    ('reason="no end', [(TOKEN_ATOM, "reason"), (TOKEN_EQUALS, "="), (TOKEN_QUOTED, "no end")]),
+    # Quoted strings lose their quotes and escapes and may hold separators.
+    ('reason="bad \\"sig\\"; (really)"',
+     [(TOKEN_ATOM, "reason"), (TOKEN_EQUALS, "="), (TOKEN_QUOTED, 'bad "sig"; (really)')]),
+    # Base64 padding stays in the value.
+    ("header.b=AbC+/9==", [(TOKEN_ATOM, "header.b"), (TOKEN_EQUALS, "="), (TOKEN_ATOM, "AbC+/9==")]),
+    ("header.b = Zm9v=;", [(TOKEN_ATOM, "header.b"), (TOKEN_EQUALS, "="), (TOKEN_ATOM, "Zm9v="), (TOKEN_SEMICOLON, ";")]),
+    ("", []),
+])
+def test_tokenize_auth_results(header_value, expected_tokens):
+    assert list(tokenize_auth_results(header_value)) == expected_tokens
+
+
+def method_result(method, result, reason=None, comments=(), **properties):
+    return {"method": method, "result": result, "reason": reason, "comments": list(comments),
+            "properties": {name.replace("_", "."): value for name, value in properties.items()}}
+
+
+@pytest.mark.parametrize("header_value, expected_authserv_id, expected_results", [
+    ("mx.example.com; dkim=pass header.d=example.com header.s=s1; spf=pass smtp.mailfrom=bounce@example.com",
+     "mx.example.com",
+     [method_result("dkim", "pass", header_d="example.com", header_s="s1"),
+      method_result("spf", "pass", smtp_mailfrom="bounce@example.com")]),
+    ("mx.example.com 1; none", "mx.example.com", []),
+    ("mx.example.com", "mx.example.com", []),
+    # Method names and results are lower-cased; a method version is dropped.
+    ("mx.example.com; DKIM/1=PASS header.d=Example.com", "mx.example.com",
+     [method_result("dkim", "pass", header_d="Example.com")]),
+    # Nested comments are kept with the result they follow.
+    ("mx.example.com (version (beta)); dmarc=fail (p=REJECT (from policy) dis=NONE) header.from=example.com",
+     "mx.example.com",
+     [method_result("dmarc", "fail", comments=["p=REJECT (from policy) dis=NONE"], header_from="example.com")]),
+    # Quoted values may contain separators.
+    ('mx.example.com; spf=fail reason="mailfrom; not permitted" smtp.mailfrom="a;b@example.com"',
+     "mx.example.com",
+     [method_result("spf", "fail", reason="mailfrom; not permitted", smtp_mailfrom="a;b@example.com")]),
+    # Base64 signature prefixes keep their padding, and the first value of a property wins.
+    ("mx.example.com; dkim=pass header.d=example.com header.b=AbC+/9== header.b=Zm9v;"
+     " dkim=fail header.d=other.org header.b=eHl6",
+     "mx.example.com",
+     [method_result("dkim", "pass", header_d="example.com", header_b="AbC+/9=="),
+      method_result("dkim", "fail", header_d="other.org", header_b="eHl6")]),
+])
+def test_parse_auth_results_header(header_value, expected_authserv_id, expected_results):
+    assert parse_auth_results_header(header_value) == (expected_authserv_id, expected_results)
+
+
+@pytest.mark.parametrize("header_values, arc_header_values, expected", [
+    (None, [], None),
+    ("mx.example.com; none", [], None),
+    # Two DKIM results in one header: the passing one is preferred.
+    ("mx.example.com; dkim=fail header.d=other.org header.s=a; dkim=pass header.d=example.com header.s=b",
+     [],
+     {"dkim_status": "pass", "dkim_domain": "example.com", "dkim_selector": "b"}),
+    # Several headers: each method comes from the first (topmost) header reporting it.
+    (["mx.example.com; spf=fail smtp.mailfrom=a@spoof.example",
+      "relay.example.com; spf=pass smtp.mailfrom=a@example.com; dmarc=pass policy.dmarc=reject"],
+     [],
+     {"spf_status": "fail", "spf_domain": "spoof.example", "dmarc_status": "pass", "dmarc_policy": "reject"}),
+    # ARC headers are read newest instance first, whatever their order in the message.
+    ([],
+     ["i=1; mx.origin.example; spf=fail smtp.mailfrom=a@origin.example",
+      "i=3; mx.hop3.example; spf=pass smtp.mailfrom=a@hop3.example",
+      "i=2; mx.hop2.example; spf=softfail smtp.mailfrom=a@hop2.example; dkim=pass header.i=@hop2.example"],
+     {"spf_status": "pass", "spf_domain": "hop3.example", "dkim_status": "pass", "dkim_domain": "hop2.example",
+      "dkim_selector": None}),
+    # Authentication-Results headers are trusted before any ARC header.
+    ("mx.example.com; dmarc=fail (p=QUARANTINE sp=NONE)",
+     ["i=1; mx.origin.example; dmarc=pass policy.dmarc=none"],
+     {"dmarc_status": "fail", "dmarc_policy": "quarantine"}),
+])
+def test_parse_auth_results(header_values, arc_header_values, expected):
+    assert parse_auth_results(header_values, arc_header_values) == expected
@@ -0,0 +1,38 @@
+"""
+Tests of `IngestPipeline` failure handling: every message is either stored or
+recorded in `failed_messages`, whatever goes wrong while fetching it.
+"""
+import socket
+
+from conftest import all_message_ids
+from gmail_api import GmailAPI
+from ingest_pipeline import IngestPipeline
+
+
+def test_connection_errors_fail_only_their_chunk(db, gmail, monkeypatch):
+    message_ids = all_message_ids(gmail)
+    failing_chunk = set(message_ids[100:200])
+    original = GmailAPI.get_raw_messages_by_ids
+
+    def flaky(self, chunk, batch_size=100):
+        if failing_chunk & set(chunk):
+            raise socket.timeout("timed out")
+        return original(self, chunk, batch_size=batch_size)
+
+    monkeypatch.setattr(GmailAPI, "get_raw_messages_by_ids", flaky)
+    resolved = []
+    stats = IngestPipeline(gmail, db, fetch_workers=2).run(message_ids, on_commit=resolved.extend)
+
+    assert stats["written"] == len(message_ids) - len(failing_chunk)
+    assert stats["fetch_errors"] == len(failing_chunk)
+    failed = db.query_db("SELECT message_id, stage, error_class FROM failed_messages")
+    assert {row[0] for row in failed} == failing_chunk
+    assert {(row[1], row[2]) for row in failed} == {("fetch", "TimeoutError")}
+    assert sorted(resolved) == sorted(message_ids)
+
+
+def test_batch_errors_keep_their_exception_class(db, gmail):
+    message_ids = all_message_ids(gmail)
+    gmail.service.error_rate = 1.0
+    IngestPipeline(gmail, db).run(message_ids[:10])
+    assert db.query_db("SELECT DISTINCT stage, error_class FROM failed_messages") == [("fetch", "HttpError")]
@@ -0,0 +1,41 @@
+"""
+Tests that the `is_labeled_*` flags of `emails` always match `email_labels`,
+whichever write path changed the labels.
+"""
+import random
+
+from fake_gmail import synthetic_raw_message
+from mail_parser import parse_raw_message
+
+MESSAGE_ID = "000000000000002a"
+
+
+def parsed_message(label_ids: list) -> dict:
+    message = {"id": MESSAGE_ID, "threadId": MESSAGE_ID, "labelIds": label_ids,
+               "internalDate": "0", "snippet": ""}
+    return parse_raw_message(synthetic_raw_message(42, random.Random(0)), message)
+
+
+def spam_flag(db) -> int:
+    return db.query_db("SELECT is_labeled_spam FROM emails WHERE message_id = ?", (MESSAGE_ID,))[0][0]
+
+
+def test_rewritten_message_drops_stale_flags(db):
+    db.insert_messages([parsed_message(["INBOX"])])
+    db.sync_message_labels({MESSAGE_ID: ["INBOX", "SPAM"]})
+    assert spam_flag(db) == 1
+
+    db.insert_messages([parsed_message(["INBOX"])])
+    assert db.query_db("SELECT label_name FROM email_labels WHERE message_id = ?", (MESSAGE_ID,)) == [("INBOX",)]
+    assert spam_flag(db) == 0
+
+
+def test_inserted_message_gets_its_flags(db):
+    db.insert_messages([parsed_message(["SPAM", "CATEGORY_SOCIAL"])])
+    flags = db.query_db("SELECT is_labeled_spam, is_labeled_social, is_labeled_promotions FROM emails")
+    assert flags == [(1, 1, 0)]
+
+
+def test_single_insert_gets_its_flags(db):
+    assert db.insert_message(parsed_message(["SPAM"]))
+    assert spam_flag(db) == 1
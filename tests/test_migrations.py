@@ -0,0 +1,189 @@
+"""
+Tests that `migrate` upgrades a database created by the first release without
+losing rows or breaking the foreign keys and the full-text index.
+"""
+import sqlite3
+
+import pytest
+
+import migrations
+from migrations import LATEST_VERSION, get_schema_version
+from sqlite_db import SQLiteDB, MESSAGE_CHILD_TABLES
+
+MESSAGE_COUNT = 40
+
+# The tables as the first release created them, at schema version 0.
+BASELINE_SCHEMA = """
+CREATE TABLE contacts (
+    contact_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    first_name TEXT,
+    last_name TEXT,
+    common_name TEXT,
+    interest_keywords TEXT,
+    family_members TEXT,
+    church TEXT,
+    employer TEXT,
+    family_proximity INTEGER,
+    physical_proximity INTEGER,
+    business_proximity INTEGER,
+    digital_proximity INTEGER,
+    interest_proximity INTEGER,
+    church_proximity INTEGER
+);
+CREATE TABLE email_address (
+    email TEXT PRIMARY KEY,
+    display_name TEXT,
+    contact_id INTEGER,
+    interest_keywords TEXT,
+    business_keywords TEXT,
+    is_unknown_email INTEGER, is_personal INTEGER, is_business INTEGER,
+    is_marketing INTEGER, is_membership INTEGER, is_family INTEGER,
+    is_hobby INTEGER, is_retail INTEGER, is_education INTEGER,
+    is_certification INTEGER, is_spam INTEGER, is_invalid INTEGER,
+    is_interest INTEGER, is_mentor INTEGER, is_colleague INTEGER,
+    is_professional INTEGER,
+    fromGmailHistory INTEGER,
+    fromContactList INTEGER,
+    FOREIGN KEY (contact_id) REFERENCES contacts (contact_id)
+);
+CREATE TABLE emails (
+    message_id TEXT PRIMARY KEY,
+    thread_id TEXT,
+    sender_email TEXT,
+    subject TEXT,
+    body_text TEXT,
+    body_html TEXT,
+    sent_timestamp TEXT,
+    internal_date_ms INTEGER,
+    date_received TEXT,
+    mime_type TEXT,
+    content_transfer_encoding TEXT,
+    charset TEXT,
+    to_recipients TEXT,
+    cc_recipients TEXT,
+    bcc_recipients TEXT,
+    return_path TEXT,
+    header_sender TEXT,
+    FOREIGN KEY (sender_email) REFERENCES email_address (email)
+);
+CREATE TABLE email_attachments (
+    attachment_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    message_id TEXT,
+    filename TEXT,
+    mime_type TEXT,
+    attachment_size INTEGER,
+    FOREIGN KEY (message_id) REFERENCES emails (message_id) ON DELETE CASCADE
+);
+CREATE TABLE email_xheaders (
+    xheader_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    message_id TEXT,
+    header_name TEXT,
+    header_value TEXT,
+    FOREIGN KEY (message_id) REFERENCES emails (message_id) ON DELETE CASCADE
+);
+CREATE TABLE email_labels (
+    label_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    message_id TEXT,
+    label_name TEXT,
+    FOREIGN KEY (message_id) REFERENCES emails (message_id) ON DELETE CASCADE
+);
+CREATE TABLE email_routing_headers (
+    route_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    message_id TEXT,
+    header_name TEXT,
+    header_value TEXT,
+    hop_order INTEGER,
+    FOREIGN KEY (message_id) REFERENCES emails (message_id) ON DELETE CASCADE
+);
+CREATE TABLE email_authentication (
+    auth_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    message_id TEXT,
+    spf_status TEXT,
+    spf_domain TEXT,
+    dkim_status TEXT,
+    dkim_domain TEXT,
+    dkim_selector TEXT,
+    dmarc_status TEXT,
+    dmarc_policy TEXT,
+    FOREIGN KEY (message_id) REFERENCES emails (message_id) ON DELETE CASCADE
+);
+"""
+
+# The per-message tables of the first release, each with the rows every message gets.
+BASELINE_CHILD_ROWS = {
+    "email_attachments": ("(message_id, filename, mime_type, attachment_size)", lambda i: (f"m{i}", f"file{i}.pdf", "application/pdf", i)),
+    "email_xheaders": ("(message_id, header_name, header_value)", lambda i: (f"m{i}", "X-Mailer", "test")),
+    "email_labels": ("(message_id, label_name)", lambda i: (f"m{i}", "INBOX")),
+    "email_routing_headers": ("(message_id, header_name, header_value, hop_order)", lambda i: (f"m{i}", "Received", "from a by b", 0)),
+    "email_authentication": ("(message_id, spf_status, dkim_status, dmarc_status)", lambda i: (f"m{i}", "pass", "pass", "pass")),
+}
+
+
+@pytest.fixture
+def baseline_db(tmp_path):
+    """A database file created by the first release, holding MESSAGE_COUNT messages."""
+    path = str(tmp_path / "mail_database.db")
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA foreign_keys = ON")
+    conn.executescript(BASELINE_SCHEMA)
+    conn.execute("INSERT INTO email_address (email) VALUES ('sender@example.com')")
+    conn.executemany(
+        "INSERT INTO emails (message_id, thread_id, sender_email, subject, body_text) VALUES (?, ?, ?, ?, ?)",
+        [(f"m{i}", f"t{i}", "sender@example.com", f"Quarterly report {i}", f"Body of message number {i}")
+         for i in range(MESSAGE_COUNT)]
+    )
+    for table, (columns, make_row) in BASELINE_CHILD_ROWS.items():
+        placeholders = ",".join("?" * len(make_row(0)))
+        conn.executemany(f"INSERT INTO {table} {columns} VALUES ({placeholders})",
+                         [make_row(i) for i in range(MESSAGE_COUNT)])
+    conn.commit()
+    assert get_schema_version(conn) == 0
+    conn.close()
+    return path
+
+
+@pytest.fixture
+def migrated_db(baseline_db, monkeypatch):
+    # Small chunks, so the search index backfill runs over several transactions.
+    monkeypatch.setattr(migrations, "SEARCH_BACKFILL_CHUNK_ROWS", 7)
+    database = SQLiteDB(baseline_db)
+    database.open_db()
+    yield database
+    database.close_db()
+
+
+def test_migration_reaches_the_latest_version(migrated_db):
+    assert get_schema_version(migrated_db.conn) == LATEST_VERSION
+    emails_sql = migrated_db.query_db("SELECT sql FROM sqlite_master WHERE name = 'emails'")[0][0]
+    assert "doc_id INTEGER PRIMARY KEY" in emails_sql
+    for table in BASELINE_CHILD_ROWS:
+        table_sql = migrated_db.query_db("SELECT sql FROM sqlite_master WHERE name = ?", (table,))[0][0]
+        assert "AUTOINCREMENT" not in table_sql.upper()
+
+
+def test_migration_keeps_every_row(migrated_db):
+    assert migrated_db.query_db("SELECT COUNT(*) FROM emails") == [(MESSAGE_COUNT,)]
+    for table in BASELINE_CHILD_ROWS:
+        assert migrated_db.query_db(f"SELECT COUNT(*) FROM {table}") == [(MESSAGE_COUNT,)]
+    assert migrated_db.query_db("SELECT subject FROM emails WHERE message_id = 'm3'") == [("Quarterly report 3",)]
+    assert migrated_db.query_db("PRAGMA foreign_key_check") == []
+
+
+def test_deletes_still_cascade_after_migration(migrated_db):
+    migrated_db.delete_email("m5", confirm=False)
+    for table in MESSAGE_CHILD_TABLES:
+        assert migrated_db.query_db(f"SELECT COUNT(*) FROM {table} WHERE message_id = 'm5'") == [(0,)]
+    assert migrated_db.query_db("SELECT COUNT(*) FROM email_labels") == [(MESSAGE_COUNT - 1,)]
+
+
+def test_search_index_covers_migrated_and_new_messages(migrated_db):
+    assert migrated_db.has_search_index()
+    results = migrated_db.search_emails_ranked("Quarterly", limit=None)
+    assert len(results) == MESSAGE_COUNT
+    assert migrated_db.search_emails_ranked("message number 17")[0]["message_id"] == "m17"
+
+    # The triggers were recreated after the rebuild: updates and deletes reach the index.
+    migrated_db.conn.execute("UPDATE emails SET subject = 'Renamed invoice' WHERE message_id = 'm2'")
+    migrated_db.delete_email("m4", confirm=False)
+    assert [result["message_id"] for result in migrated_db.search_emails_ranked("Renamed invoice")] == ["m2"]
+    assert len(migrated_db.search_emails_ranked("Quarterly", limit=None)) == MESSAGE_COUNT - 2
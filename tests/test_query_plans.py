@@ -0,0 +1,76 @@
+"""
+Checks that the frequent queries of `sqlite_db` use the indexes created for them.
+
+The statements checked are the ones `SQLiteDB` and its menu run, not copies,
+so a change to a statement that loses its index fails here.
+"""
+import os
+import random
+import sys
+
+import pytest
+
+os.environ.setdefault("GMAIL_CLIENT_SECRET_PATH", "client_secret.json")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_gmail import synthetic_raw_message  # noqa: E402
+from mail_parser import parse_raw_message  # noqa: E402
+from sqlite_db import (  # noqa: E402
+    SQLiteDB, HOT_QUERIES, DELETE_EMAIL_QUERY, LABEL_MESSAGE_IDS_QUERY, LABEL_EXPORT_QUERY,
+    SENDER_EXPORT_QUERY, MESSAGE_CHILD_TABLES
+)
+
+
+@pytest.fixture
+def db(tmp_path):
+    database = SQLiteDB(str(tmp_path / "mail_database.db"))
+    database.open_db()
+    yield database
+    database.close_db()
+
+
+def store_messages(db: SQLiteDB, count: int) -> list:
+    """Stores synthetic messages labeled INBOX and returns them."""
+    rng = random.Random(0)
+    messages = []
+    for index in range(count):
+        message = {"id": f"{index:016x}", "threadId": f"{index:016x}", "labelIds": ["INBOX", "UNREAD"],
+                   "internalDate": str(index), "snippet": ""}
+        messages.append(parse_raw_message(synthetic_raw_message(index, rng), message))
+    written_ids, failures = db.insert_messages(messages)
+    assert len(written_ids) == count and not failures
+    return messages
+
+
+def test_hot_queries_use_their_indexes(db):
+    results = db.check_query_plans()
+    assert len(results) == len(HOT_QUERIES)
+    for description, uses_index, plan in results:
+        assert uses_index, f"{description} does not use its index:\n{plan}"
+
+
+def test_hot_queries_include_the_statements_run():
+    checked = {query for _, query, _ in HOT_QUERIES}
+    for query in (DELETE_EMAIL_QUERY, LABEL_MESSAGE_IDS_QUERY, LABEL_EXPORT_QUERY, SENDER_EXPORT_QUERY):
+        assert query in checked
+
+
+def test_random_msg_ids_by_label(db):
+    messages = store_messages(db, 5)
+    assert sorted(db.random_msg_ids(10, label="INBOX")) == sorted(m["message_id"] for m in messages)
+    assert db.random_msg_ids(10, label="SPAM") == []
+
+
+def test_label_export(db):
+    messages = store_messages(db, 3)
+    rows = db.query_db(LABEL_EXPORT_QUERY, ("INBOX",))
+    assert sorted(row[0] for row in rows) == sorted(m["message_id"] for m in messages)
+
+
+def test_delete_email_removes_related_rows(db):
+    messages = store_messages(db, 2)
+    deleted_id = messages[0]["message_id"]
+    db.delete_email(deleted_id, confirm=False)
+    assert db.query_db("SELECT message_id FROM emails") == [(messages[1]["message_id"],)]
+    for table in MESSAGE_CHILD_TABLES:
+        assert db.query_db(f"SELECT COUNT(*) FROM {table} WHERE message_id = ?", (deleted_id,)) == [(0,)]
@@ -0,0 +1,97 @@
+"""
+Tests that interrupted and partly failed scans keep enough state to finish later:
+listing checkpoints survive an aborted listing, and an aborted sync does not
+advance the history checkpoint past labels that were never listed.
+"""
+import pytest
+
+from conftest import all_message_ids
+from gmail_api import GmailAPI
+from ingest_pipeline import IngestPipeline
+import main
+
+LABELS = ["INBOX", "CATEGORY_PROMOTIONS"]
+SCAN_KEY = "history_id:" + ",".join(sorted(LABELS))
+
+
+@pytest.fixture
+def small_pages(monkeypatch):
+    """Lists 20 messages per page; returns a dict whose 'fail_after' page count makes listing raise."""
+    control = {"fail_after": None, "served": 0}
+    original = GmailAPI.iter_message_id_pages_with_tokens
+
+    def pages(self, query, max_results_per_page=500, page_token=None):
+        for page in original(self, query, 20, page_token):
+            if control["fail_after"] is not None and control["served"] >= control["fail_after"]:
+                raise ConnectionError("connection reset by peer")
+            control["served"] += 1
+            yield page
+
+    monkeypatch.setattr(GmailAPI, "iter_message_id_pages_with_tokens", pages)
+    return control
+
+
+def labeled_ids(gmail: GmailAPI) -> set:
+    return {message["id"] for label in LABELS for page in gmail.iter_message_id_pages(f"in:{label}") for message in page}
+
+
+def sync(gmail, db) -> bool:
+    pipeline = IngestPipeline(gmail, db, fetch_workers=1, write_batch_size=20, queue_depth=1)
+    return main.sync_mailbox(gmail, db, pipeline, LABELS, True, False, False, False)
+
+
+def stored_ids(db) -> set:
+    return {row[0] for row in db.query_db("SELECT message_id FROM emails")}
+
+
+def test_listing_error_keeps_checkpoints(db, gmail, small_pages):
+    small_pages["fail_after"] = 3
+    assert sync(gmail, db) is False
+
+    checkpoints = db.get_ingest_checkpoints(SCAN_KEY)
+    assert checkpoints and not all(completed for _, completed in checkpoints.values())
+    assert db.get_sync_state(SCAN_KEY) is None
+    small_pages["fail_after"] = None
+    assert set() < stored_ids(db) < labeled_ids(gmail)
+
+
+def test_interrupted_scan_resumes_from_its_checkpoint(db, gmail, small_pages, capsys):
+    small_pages["fail_after"] = None
+    full_listing_pages = len(list(gmail.iter_message_id_pages_with_tokens("in:INBOX"))) + \
+        len(list(gmail.iter_message_id_pages_with_tokens("in:CATEGORY_PROMOTIONS")))
+
+    small_pages.update(fail_after=4, served=0)
+    assert sync(gmail, db) is False
+    small_pages.update(fail_after=None, served=0)
+    capsys.readouterr()
+    assert sync(gmail, db) is True
+
+    assert "Resuming an interrupted full scan." in capsys.readouterr().out
+    # Pages committed before the interruption are not listed again.
+    assert small_pages["served"] < full_listing_pages
+    assert stored_ids(db) == labeled_ids(gmail)
+    assert db.get_ingest_checkpoints(SCAN_KEY) == {}
+    assert db.get_sync_state(SCAN_KEY) is not None
+
+
+def test_failed_fetch_is_queued_and_retried(db, gmail, monkeypatch):
+    expected = labeled_ids(gmail)
+    unlucky = set(sorted(expected)[:30])
+    original = GmailAPI.get_raw_messages_by_ids
+
+    def flaky(self, chunk, batch_size=100):
+        if unlucky & set(chunk):
+            raise ConnectionError("connection reset by peer")
+        return original(self, chunk, batch_size=batch_size)
+
+    monkeypatch.setattr(GmailAPI, "get_raw_messages_by_ids", flaky)
+    # Failed messages are queued, so the scan itself completes.
+    assert sync(gmail, db) is True
+    failed = {row[0] for row in db.query_db("SELECT message_id FROM failed_messages WHERE stage = 'fetch'")}
+    assert unlucky <= failed
+    assert stored_ids(db) == expected - failed
+
+    monkeypatch.setattr(GmailAPI, "get_raw_messages_by_ids", original)
+    assert main.run_retry_failed(db, IngestPipeline(gmail, db, update_if_exists=True)) is True
+    assert db.query_db("SELECT COUNT(*) FROM failed_messages") == [(0,)]
+    assert stored_ids(db) == expected